@@ -0,0 +1,99 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from benchmarks.bench_standardize import make_parts
+from etl.load.column_schema import ColumnSchema
+from etl.load.export_profiles import DEFAULT_PROFILE, get_export_profile, sort_keys, writer_options
+
+# Benchmark layout Parquet theo profile: với cùng 1 part dữ liệu giả lập, đo thời gian encode,
+# kích thước file và tốc độ đọc lại của profile mặc định, profile của collection và vài biến thể codec.
+# Chạy: poetry run python -m benchmarks.bench_export_profiles --collection raw_data --rows 250000
+
+COUNTRIES = [('US', 'United States of America'), ('DE', 'Germany'), ('VN', 'Viet Nam'), ('GB', 'United Kingdom'),
+             ('FR', 'France'), ('IT', 'Italy')]
+REGIONS = ['California', 'Bayern', 'Ha Noi', 'England', 'Ile-de-France', 'Lombardia', '-']
+CITIES = ['Los Angeles', 'Munich', 'Hanoi', 'London', 'Paris', 'Milan', '-']
+
+
+def make_ip_location_docs(rows, seed):
+    # Document giống collection ip_locations (kết quả tra IP2Location)
+    rng = random.Random(seed)
+    docs = []
+    for _ in range(rows):
+        country_short, country_long = rng.choice(COUNTRIES)
+        docs.append({
+            'ip': f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}",
+            'country_short': country_short,
+            'country_long': country_long,
+            'region': rng.choice(REGIONS),
+            'city': rng.choice(CITIES)
+        })
+    return docs
+
+
+def make_table(collection, rows, seed, schema_file):
+    # Chuẩn hóa giống engine pandas (ColumnSchema) rồi đổi sang bảng Arrow để mọi profile ghi cùng 1 dữ liệu
+    if collection == 'ip_locations':
+        docs = make_ip_location_docs(rows, seed)
+    else:
+        docs = make_parts(rows, 1, seed)[0]
+    df = ColumnSchema(schema_file).normalize(pd.DataFrame(docs))
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def build_variants(collection):
+    # (tên, profile): mặc định cũ, profile của collection và profile đó với các codec khác
+    profile = get_export_profile(collection)
+    variants = [('default (snappy)', dict(DEFAULT_PROFILE)), (f"{collection} profile", profile)]
+    for compression, level in [('snappy', None), ('lz4', None), ('zstd', 1), ('zstd', 9)]:
+        if (compression, level) != (profile['compression'], profile['compression_level']):
+            name = f"profile + {compression}" + (f":{level}" if level is not None else '')
+            variants.append((name, {**profile, 'compression': compression, 'compression_level': level}))
+    return variants
+
+
+def run_variant(table, profile, filename):
+    # Encode (sắp xếp + ghi) rồi đọc lại toàn bộ file
+    start = time.perf_counter()
+    keys = sort_keys(profile, table.column_names)
+    if keys:
+        table = table.sort_by(keys)
+    pq.write_table(table, filename, row_group_size=profile['row_group_rows'],
+                   **writer_options(profile, table.column_names))
+    encode_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pq.read_table(filename)
+    read_time = time.perf_counter() - start
+
+    return encode_time, os.path.getsize(filename), read_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark layout Parquet theo profile export")
+    parser.add_argument('--collection', default='raw_data', choices=['raw_data', 'ip_locations'])
+    parser.add_argument('--rows', type=int, default=250000, help="Số dòng của part giả lập")
+    parser.add_argument('--seed', type=int, default=1412)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"Sinh {args.rows} document giống {args.collection}...")
+        table = make_table(args.collection, args.rows, args.seed, os.path.join(tmp_dir, 'schema.json'))
+
+        print(f"\n{'Profile':<24} | {'Encode (s)':<10} | {'Size (MB)':<10} | {'Bytes/row':<10} | {'Read (s)':<9} | "
+              f"{'Read rows/s':<12}")
+        print("-" * 90)
+        for i, (name, profile) in enumerate(build_variants(args.collection)):
+            encode_time, size, read_time = run_variant(table, profile, os.path.join(tmp_dir, f"variant_{i}.parquet"))
+            print(f"{name:<24} | {encode_time:<10.2f} | {size / 1024 / 1024:<10.2f} | {size / table.num_rows:<10.1f} | "
+                  f"{read_time:<9.2f} | {table.num_rows / read_time:<12.0f}")
+        print("-" * 90)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import os
+import random
+import socket
+import time
+import IP2Location
+from etl.transform.ip_processing import normalize_data
+from etl.transform.ip_cache import CachedIPResolver
+
+# Benchmark cache LRU khi tra IP theo từng event: lượng truy cập lệch (phân phối Zipf, ít IP sinh phần lớn event)
+# so sánh tra thẳng IP2Location cho mọi event với CachedIPResolver ở vài kích thước cache.
+# Chạy: poetry run python -m benchmarks.bench_ip_cache --events 500000 --distinct 200000 --zipf 1.1
+# (file BIN lấy từ biến IP_DATA_PATH, hoặc truyền --bin)
+
+
+def make_events(events, distinct, zipf, seed):
+    rng = random.Random(seed)
+    pool = [socket.inet_ntoa(rng.getrandbits(32).to_bytes(4, 'big')) for _ in range(distinct)]
+    weights = [1 / (rank + 1) ** zipf for rank in range(distinct)]
+    return rng.choices(pool, weights=weights, k=events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cache LRU cho tra cứu IP theo event")
+    parser.add_argument('--bin', default=os.environ.get('IP_DATA_PATH'), help="File BIN IP2Location")
+    parser.add_argument('--events', type=int, default=500000, help="Số event (lượt tra IP)")
+    parser.add_argument('--distinct', type=int, default=200000, help="Số IP khác nhau")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Độ lệch của phân phối IP (Zipf)")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="Các kích thước cache (số entry) cần thử")
+    parser.add_argument('--batch', type=int, default=1000, help="Số event mỗi lượt lookup")
+    parser.add_argument('--seed', type=int, default=1412)
+    args = parser.parse_args()
+
+    ips = make_events(args.events, args.distinct, args.zipf, args.seed)
+    ip_data = IP2Location.IP2Location(args.bin)
+
+    def resolve(ip_list):
+        return [normalize_data(ip, ip_data.get_all(ip)) for ip in ip_list]
+
+    start = time.perf_counter()
+    for i in range(0, len(ips), args.batch):
+        resolve(ips[i:i + args.batch])
+    base_time = time.perf_counter() - start
+
+    print(f"{args.events} event, {args.distinct} IP khác nhau, Zipf {args.zipf}")
+    print(f"\n{'Cache (entry)':<14} | {'Thời gian (s)':<14} | {'Hit rate':<9} | {'Eviction':<10} | {'MB':<7} | {'Speedup':<8}")
+    print("-" * 76)
+    print(f"{'không':<14} | {base_time:<14.2f} | {'-':<9} | {'-':<10} | {'-':<7} | {1:<8.2f}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        resolver = CachedIPResolver(resolve, max_entries=size)
+        start = time.perf_counter()
+        for i in range(0, len(ips), args.batch):
+            resolver.lookup(ips[i:i + args.batch])
+        elapsed = time.perf_counter() - start
+        m = resolver.metrics()
+        print(f"{size:<14} | {elapsed:<14.2f} | {m['hit_rate']:<9.1%} | {m['evictions']:<10} | "
+              f"{m['bytes'] / 1024 / 1024:<7.1f} | {base_time / elapsed:<8.2f}")
+    print("-" * 76)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import os
+import random
+import socket
+import tempfile
+import time
+import IP2Location
+from etl.transform.ip_processing import normalize_data
+from etl.transform.ip_range_index import IPRangeIndex
+
+# Benchmark tra cứu IP: cách cũ (IP2Location.get_all + normalize_data cho từng IP)
+# so với IPRangeIndex (mảng NumPy + searchsorted theo batch) trên cùng 1 file BIN.
+# Chạy: poetry run python -m benchmarks.bench_ip_lookup --ips 200000 --ipv6-ratio 0.1
+# (file BIN lấy từ biến IP_DATA_PATH, hoặc truyền --bin)
+
+
+def make_ips(count, ipv6_ratio, seed):
+    rng = random.Random(seed)
+    ips = []
+    for _ in range(count):
+        if rng.random() < ipv6_ratio:
+            ips.append(socket.inet_ntop(socket.AF_INET6, rng.getrandbits(128).to_bytes(16, 'big')))
+        else:
+            ips.append(socket.inet_ntoa(rng.getrandbits(32).to_bytes(4, 'big')))
+    return ips
+
+
+def load_ips(ip_file, limit):
+    # File text mỗi dòng 1 IP (VD: export từ collection ip_locations)
+    with open(ip_file, 'r', encoding='utf-8') as f:
+        ips = [line.rstrip('\n') for line in f if line.strip()]
+    return ips[:limit] if limit else ips
+
+
+def run_library(bin_file, ips):
+    ip_data = IP2Location.IP2Location(bin_file)
+    start = time.perf_counter()
+    results = [normalize_data(ip, ip_data.get_all(ip)) for ip in ips]
+    return results, time.perf_counter() - start
+
+
+def run_index(index, ips, batch_size):
+    start = time.perf_counter()
+    results = []
+    for i in range(0, len(ips), batch_size):
+        results.extend(index.lookup(ips[i:i + batch_size]))
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tra cứu IP: IP2Location từng IP so với IPRangeIndex")
+    parser.add_argument('--bin', default=os.environ.get('IP_DATA_PATH'), help="File BIN IP2Location")
+    parser.add_argument('--ips', type=int, default=200000, help="Số IP ngẫu nhiên cần tra")
+    parser.add_argument('--ipv6-ratio', type=float, default=0.0, help="Tỉ lệ IPv6 trong danh sách IP ngẫu nhiên")
+    parser.add_argument('--ip-file', default=None, help="Dùng danh sách IP thật từ file (mỗi dòng 1 IP)")
+    parser.add_argument('--batch', type=int, default=10000, help="Số IP mỗi batch khi tra bằng IPRangeIndex")
+    parser.add_argument('--seed', type=int, default=1412)
+    args = parser.parse_args()
+
+    ips = load_ips(args.ip_file, args.ips) if args.ip_file else make_ips(args.ips, args.ipv6_ratio, args.seed)
+    print(f"Tra {len(ips)} IP trên {args.bin}...")
+
+    library, library_time = run_library(args.bin, ips)
+
+    start = time.perf_counter()
+    index = IPRangeIndex.from_bin(args.bin)
+    build_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        index.save(cache_dir)
+        start = time.perf_counter()
+        cached = IPRangeIndex.load(cache_dir, args.bin)
+        open_time = time.perf_counter() - start
+        result, index_time = run_index(cached, ips, args.batch)
+
+    print(f"\nChỉ mục: dựng từ BIN {build_time:.2f}s, mở lại từ cache (mmap) {open_time:.3f}s")
+    print(f"\n{'Cách':<24} | {'Thời gian (s)':<14} | {'IP/s':<12} | {'Speedup':<8}")
+    print("-" * 68)
+    print(f"{'IP2Location.get_all':<24} | {library_time:<14.2f} | {len(ips) / library_time:<12.0f} | {1:<8.2f}")
+    print(f"{'IPRangeIndex':<24} | {index_time:<14.2f} | {len(ips) / index_time:<12.0f} | "
+          f"{library_time / index_time:<8.2f}")
+    print("-" * 68)
+    print(f"Số IP cho kết quả khác nhau giữa 2 cách: {sum(old != new for old, new in zip(library, result))}")
+
+
+if __name__ == "__main__":
+    main()
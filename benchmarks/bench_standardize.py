@@ -0,0 +1,120 @@
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+import pandas as pd
+from bson.objectid import ObjectId
+from etl.load.column_schema import ColumnSchema, standardlized_for_parquet
+
+# Benchmark chuẩn hóa DataFrame trước khi ghi Parquet: cách cũ (standardlized_for_parquet)
+# so với ColumnSchema (schema đoán 1 lần, xử lý theo cả cột) trên dữ liệu giả lập giống raw_data.
+# Chạy: poetry run python -m benchmarks.bench_standardize --rows 250000 --parts 3
+
+EVENT_TYPES = ['view_product_detail', 'select_product_option', 'select_product_option_quality',
+               'add_to_cart_action', 'product_detail_recommendation_visible', 'checkout']
+
+
+def make_option(rng):
+    # Mảng option giống các event select_product_option
+    return [{'option_label': rng.choice(['alloy', 'diamond', 'stone']),
+             'option_id': str(rng.randint(1, 999999)),
+             'value_label': rng.choice(['Yellow 585', 'White 750', 'Sapphire', 'Ruby']),
+             'value_id': str(rng.randint(1, 999999))}
+            for _ in range(rng.randint(1, 3))]
+
+
+def make_raw_data_doc(rng, time_base):
+    event = rng.choice(EVENT_TYPES)
+    product_id = str(rng.randint(1, 120000))
+    doc = {
+        '_id': ObjectId(rng.randbytes(12)),  # Sinh từ rng để 2 lần make_parts cùng seed ra cùng _id
+        'time_stamp': time_base + rng.randint(0, 86400 * 30),
+        'ip': f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}",
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36',
+        'resolution': rng.choice(['1920x1080', '1366x768', '390x844']),
+        'user_id_db': rng.choice(['', str(rng.randint(1, 500000))]),
+        'device_id': f"{rng.getrandbits(64):016x}",
+        'api_version': '1.0',
+        'store_id': str(rng.randint(1, 90)),
+        'local_time': datetime.datetime(2020, 6, 1) + datetime.timedelta(seconds=rng.randint(0, 86400 * 30)),
+        'show_recommendation': rng.choice(['true', 'false']),
+        'current_url': f"https://www.glamira.com/glamira-ring-{product_id}.html",
+        'referrer_url': rng.choice(['', 'https://www.google.com/']),
+        'email_address': rng.choice(['', 'customer@example.com']),
+        'collection': event,
+        'product_id': product_id,
+        'price': f"{rng.randint(100, 5000)}.00",
+        'currency': rng.choice(['€', '$', '£']),
+        'is_paypal': rng.choice([None, True, False]),
+        'cat_id': rng.choice([None, rng.randint(1, 300)]),
+    }
+    if event.startswith('select_product_option'):
+        doc['option'] = make_option(rng)
+    if event == 'checkout':
+        doc['cart_products'] = [{'product_id': rng.randint(1, 120000), 'amount': rng.randint(1, 3),
+                                 'price': f"{rng.randint(100, 5000)}.00", 'option': make_option(rng)}
+                                for _ in range(rng.randint(1, 4))]
+    return doc
+
+
+def make_parts(rows, parts, seed):
+    rng = random.Random(seed)
+    time_base = 1590969600
+    return [[make_raw_data_doc(rng, time_base) for _ in range(rows)] for _ in range(parts)]
+
+
+# Chỉ đo bước chuẩn hóa: DataFrame được dựng trước (2 cách dựng giống nhau nên không đưa vào thời gian)
+def run_legacy(frames):
+    start = time.perf_counter()
+    results = [standardlized_for_parquet(df) for df in frames]
+    return results, time.perf_counter() - start
+
+
+def run_schema(frames, schema_file):
+    start = time.perf_counter()
+    column_schema = ColumnSchema(schema_file)
+    results = [column_schema.normalize(df) for df in frames]
+    return results, time.perf_counter() - start
+
+
+def count_mismatch(legacy, schema):
+    # So sánh kết quả 2 cách theo giá trị string của từng ô (bỏ qua khác biệt NaN/None)
+    mismatch = 0
+    for df_old, df_new in zip(legacy, schema):
+        for col in df_old.columns:
+            old = df_old[col].astype(str).where(df_old[col].notna(), '')
+            new = df_new[col].astype(str).where(df_new[col].notna(), '')
+            mismatch += int((old != new).sum())
+    return mismatch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chuẩn hóa DataFrame trước khi ghi Parquet")
+    parser.add_argument('--rows', type=int, default=250000, help="Số dòng mỗi part (mặc định bằng CHUNK_SIZE)")
+    parser.add_argument('--parts', type=int, default=3, help="Số part giả lập")
+    parser.add_argument('--seed', type=int, default=1412)
+    args = parser.parse_args()
+
+    print(f"Sinh {args.parts} part x {args.rows} document giống raw_data...")
+    legacy_parts = [pd.DataFrame(docs) for docs in make_parts(args.rows, args.parts, args.seed)]
+    schema_parts = [pd.DataFrame(docs) for docs in make_parts(args.rows, args.parts, args.seed)]
+
+    legacy, legacy_time = run_legacy(legacy_parts)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        schema, schema_time = run_schema(schema_parts, os.path.join(tmp_dir, 'raw_data_schema.json'))
+
+    total_rows = args.rows * args.parts
+    print(f"\n{'Cách':<22} | {'Thời gian (s)':<14} | {'Rows/s':<12} | {'Speedup':<8}")
+    print("-" * 66)
+    print(f"{'standardlized (cũ)':<22} | {legacy_time:<14.2f} | {total_rows / legacy_time:<12.0f} | {1:<8.2f}")
+    print(f"{'ColumnSchema':<22} | {schema_time:<14.2f} | {total_rows / schema_time:<12.0f} | "
+          f"{legacy_time / schema_time:<8.2f}")
+    print("-" * 66)
+    print(f"Số ô khác nhau giữa 2 cách: {count_mismatch(legacy, schema)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import glob
+import os
+import time
+from etl.extract.title_extractor import EXTRACTORS, extract_title_fast
+
+# Benchmark so sánh các extractor tên sản phẩm trên bộ trang HTML đã lưu sẵn.
+# Mỗi file .html trong thư mục corpus là 1 trang sản phẩm Glamira (lưu nguyên bytes của response).
+# Chạy: poetry run python -m benchmarks.bench_title_extractor --corpus data/raw/html_corpus
+
+
+def load_corpus(corpus_dir, limit=None):
+    # Đọc toàn bộ trang HTML dạng bytes (giống res.content của crawler)
+    files = sorted(glob.glob(os.path.join(corpus_dir, '*.html')))
+    if limit:
+        files = files[:limit]
+
+    pages = []
+    for filename in files:
+        with open(filename, 'rb') as f:
+            pages.append((os.path.basename(filename), f.read()))
+    return pages
+
+
+def run_extractor(extractor, pages, repeat):
+    # Trả về (kết quả của lần chạy cuối, số trang/giây)
+    results = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [extractor(body) for _, body in pages]
+    duration = time.perf_counter() - start
+    return results, (len(pages) * repeat) / duration if duration else float('inf')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các extractor tên sản phẩm")
+    parser.add_argument('--corpus', default=os.environ.get('HTML_CORPUS_PATH'),
+                        help="Thư mục chứa các file .html (mặc định: biến HTML_CORPUS_PATH)")
+    parser.add_argument('--limit', type=int, default=None, help="Số trang tối đa dùng để đo")
+    parser.add_argument('--repeat', type=int, default=3, help="Số lần lặp lại toàn bộ corpus")
+    args = parser.parse_args()
+
+    if not args.corpus:
+        raise ValueError("LỖI: Chưa truyền --corpus hoặc biến HTML_CORPUS_PATH")
+
+    pages = load_corpus(args.corpus, args.limit)
+    if not pages:
+        raise ValueError(f"LỖI: Không tìm thấy file .html nào trong '{args.corpus}'")
+
+    total_mb = sum(len(body) for _, body in pages) / 1024 / 1024
+    print(f"Corpus: {len(pages)} trang ({total_mb:.1f} MB), lặp {args.repeat} lần")
+
+    # Kết quả của BeautifulSoup là chuẩn để đối chiếu độ chính xác
+    baseline, _ = run_extractor(EXTRACTORS['soup'], pages, 1)
+
+    # Tỉ lệ trang mà fast path tự xử lý được (không phải rơi xuống BeautifulSoup)
+    fast_hits = sum(1 for _, body in pages if extract_title_fast(body) is not None)
+
+    print(f"\n{'Extractor':<10} | {'Pages/s':<10} | {'Speedup':<8} | {'Match':<12} | {'Mismatch':<8}")
+    print("-" * 60)
+
+    soup_speed = None
+    mismatches = {}
+    for name in ['soup'] + [n for n in EXTRACTORS if n != 'soup']:
+        results, pages_per_sec = run_extractor(EXTRACTORS[name], pages, args.repeat)
+        if name == 'soup':
+            soup_speed = pages_per_sec
+
+        wrong = [(pages[i][0], baseline[i], results[i]) for i in range(len(pages)) if results[i] != baseline[i]]
+        mismatches[name] = wrong
+        matched = len(pages) - len(wrong)
+
+        print(f"{name:<10} | {pages_per_sec:<10.1f} | {pages_per_sec / soup_speed:<8.2f} | "
+              f"{matched}/{len(pages):<10} | {len(wrong):<8}")
+
+    print("-" * 60)
+    print(f"Fast path tự xử lý: {fast_hits}/{len(pages)} trang ({fast_hits / len(pages) * 100:.1f}%), còn lại dùng BeautifulSoup")
+
+    for name, wrong in mismatches.items():
+        for filename, expected, actual in wrong[:10]:
+            print(f"[{name}] {filename}: soup={expected!r} | {name}={actual!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from dotenv import load_dotenv
+import threading
 import os
 
 # Lấy thư mục file hiện tại
@@ -16,30 +19,190 @@ load_dotenv(dotenv_path=env_path)
 MONGO_URI = os.environ.get('MONGO_URI')
 DB_NAME = os.environ.get('DB_NAME')
 
-# Biến toàn cục để lưu kết nối (Singleton)
-_client = None
+# Profile kết nối theo kiểu tải, mỗi profile có MongoClient (và connection pool) riêng:
+# - client: tham số truyền thẳng cho MongoClient (pool, nén wire protocol, read preference...)
+#   Nén: zstd/snappy cần extra pymongo[zstd,snappy] (khai báo trong pyproject.toml), thiếu thư viện pymongo tự dùng zlib
+# - batch_size: số document mỗi lượt getMore cho cursor đọc của profile
+# - raw_bson: trả về RawBSONDocument (chỉ decode field nào được truy cập) thay vì dict
+MONGO_PROFILES = {
+    # Giữ nguyên cấu hình cũ cho các script chưa chọn profile
+    'default': {
+        'client': {'maxPoolSize': 50},
+        'batch_size': None,
+        'raw_bson': False
+    },
+    # Quét lớn (export, gom IP, lấy danh sách product): ít kết nối, nén mạnh, đọc từ secondary nếu có
+    'bulk-scan': {
+        'client': {
+            'maxPoolSize': 16,
+            'compressors': 'zstd,snappy,zlib',
+            'readPreference': 'secondaryPreferred',
+            'socketTimeoutMS': 0,
+            'appname': 'glamira-bulk-scan'
+        },
+        'batch_size': 5000,
+        'raw_bson': True
+    },
+    # Quét bị chặn bởi high-water mark (export incremental, tra IP): cận trên _id (find_one) và lượt quét phải đọc
+    # cùng 1 bản dữ liệu, secondary trễ khác nhau sẽ làm mất vĩnh viễn document nằm dưới cận trên -> đọc từ primary
+    'incremental-scan': {
+        'client': {
+            'maxPoolSize': 16,
+            'compressors': 'zstd,snappy,zlib',
+            'readPreference': 'primary',
+            'readConcernLevel': 'majority',
+            'socketTimeoutMS': 0,
+            'appname': 'glamira-incremental-scan'
+        },
+        'batch_size': 5000,
+        'raw_bson': True
+    },
+    # Crawler: nhiều thread cùng ghi kết quả nhỏ lẻ, cần nhiều kết nối, nén nhẹ
+    'crawler': {
+        'client': {
+            'maxPoolSize': 50,
+            'compressors': 'snappy,zlib',
+            'readPreference': 'primary',
+            'retryWrites': True,
+            'appname': 'glamira-crawler'
+        },
+        'batch_size': 1000,
+        'raw_bson': False
+    },
+    # Ghi hàng loạt (insert_many/bulk_write lô lớn)
+    'writer': {
+        'client': {
+            'maxPoolSize': 8,
+            'compressors': 'zstd,snappy,zlib',
+            'readPreference': 'primary',
+            'retryWrites': True,
+            'w': 1,
+            'appname': 'glamira-writer'
+        },
+        'batch_size': None,
+        'raw_bson': False
+    }
+}
 
-def get_database():
-    # Hàm đảm bảo chỉ có 1 kết nối MongoClient được tạo ra và sử dụng cho toàn bộ chương trình.
-    global _client
+RAW_BSON_OPTIONS = CodecOptions(document_class=RawBSONDocument)
 
-    if _client is None:
-        # maxPoolSize=50: Cho phép mở tối đa 50 kết nối con song song
-        _client = MongoClient(MONGO_URI, maxPoolSize=50)
-        print("--> Đã khởi tạo kết nối MongoDB mới.")
 
-    # Trả về đối tượng Database để dùng luôn
-    return _client[DB_NAME]
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    # Đếm sự kiện connection pool của 1 profile (được gọi từ nhiều thread nên cần lock)
+
+    def __init__(self, profile):
+        self.profile = profile
+        self._lock = threading.Lock()
+        self.counters = {
+            'created': 0,
+            'closed': 0,
+            'checked_out': 0,
+            'checkout_failed': 0,
+            'in_use': 0,
+            'max_in_use': 0,
+            'pool_cleared': 0
+        }
+
+    def _add(self, key, value=1):
+        with self._lock:
+            self.counters[key] += value
+            if key == 'in_use':
+                self.counters['max_in_use'] = max(self.counters['max_in_use'], self.counters['in_use'])
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add('pool_cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add('closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._add('checkout_failed')
+
+    def connection_checked_out(self, event):
+        self._add('checked_out')
+        self._add('in_use')
+
+    def connection_checked_in(self, event):
+        self._add('in_use', -1)
+
+
+# Mỗi profile 1 MongoClient dùng chung cho toàn bộ chương trình (Singleton theo profile)
+_clients = {}
+_metrics = {}
+_clients_lock = threading.Lock()
+
+def get_profile(profile):
+    if profile not in MONGO_PROFILES:
+        raise ValueError(f"LỖI: Mongo profile '{profile}' không hợp lệ. Chọn 1 trong {list(MONGO_PROFILES)}")
+    return MONGO_PROFILES[profile]
+
+def get_client(profile='default'):
+    # Hàm đảm bảo mỗi profile chỉ có 1 kết nối MongoClient được tạo ra và sử dụng cho toàn bộ chương trình.
+    config = get_profile(profile)
+
+    with _clients_lock:
+        if profile not in _clients:
+            _metrics[profile] = PoolMetrics(profile)
+            _clients[profile] = MongoClient(MONGO_URI, event_listeners=[_metrics[profile]], **config['client'])
+            print(f"--> Đã khởi tạo kết nối MongoDB mới (profile '{profile}').")
+
+    return _clients[profile]
+
+def get_database(profile='default', raw_bson=None):
+    # Trả về đối tượng Database của profile để dùng luôn
+    # raw_bson=None: theo profile. Code cần dict thật (pandas, sửa document) thì truyền raw_bson=False
+    config = get_profile(profile)
+    client = get_client(profile)
+
+    if raw_bson is None:
+        raw_bson = config['raw_bson']
+    if raw_bson:
+        return client.get_database(DB_NAME, codec_options=RAW_BSON_OPTIONS)
+    return client[DB_NAME]
+
+def get_batch_size(profile, default=None):
+    # Batch size đọc cursor của profile
+    return get_profile(profile)['batch_size'] or default
+
+def get_pool_metrics():
+    # {profile: số liệu connection pool} của các profile đã mở kết nối
+    return {profile: metrics.snapshot() for profile, metrics in _metrics.items()}
 
 def close_connection():
-    # Hàm đóng kết nối khi chương trình dừng hẳn
-    global _client
-    if _client:
-        _client.close()
-        _client = None
-        print("--> Đã đóng kết nối MongoDB.")
+    # Hàm đóng toàn bộ kết nối khi chương trình dừng hẳn, in số liệu pool của từng profile
+    with _clients_lock:
+        for profile, client in _clients.items():
+            client.close()
+            counters = _metrics[profile].snapshot()
+            print(f"--> Đã đóng kết nối MongoDB (profile '{profile}'): tạo {counters['created']} kết nối, "
+                  f"{counters['checked_out']} lượt mượn, tối đa {counters['max_in_use']} kết nối đồng thời, "
+                  f"{counters['checkout_failed']} lượt mượn lỗi.")
+        _clients.clear()
+        _metrics.clear()
 
 
 if __name__ == "__main__":
     db = get_database()
-    close_connection()
\ No newline at end of file
+    close_connection()
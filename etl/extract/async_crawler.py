@@ -0,0 +1,280 @@
+import asyncio
+import itertools
+import random
+import time
+from urllib.parse import urlsplit
+from curl_cffi.requests.errors import RequestsError
+from config.get_mongo_connection import get_database
+from etl.extract.session_pool import AsyncSessionPool
+from etl.extract.parser_pool import parse_body_async
+from etl.extract.crawl_common import (
+    BATCH_SIZE,
+    BROWSER_LIST,
+    FLUSH_INTERVAL,
+    MAX_RETRY,
+    OUTPUT_CSV,
+    PROXY_MANAGER,
+    TARGET_COLLECTION,
+    backoff_delay,
+    open_csv_writer,
+    print_progress,
+    print_round_header,
+    print_round_report,
+    save_results,
+)
+
+MAX_IN_FLIGHT = 1000  # Số request tối đa đang chạy đồng thời (toàn cục)
+PER_HOST_LIMIT = 100  # Số request đồng thời tối đa tới cùng 1 host
+PER_PROXY_LIMIT = 50  # Số request đồng thời tối đa qua cùng 1 proxy
+FEED_CHUNK = 500  # Số item lấy từ generator MongoDB mỗi lần (chạy trong thread riêng)
+
+
+class AsyncCrawlEngine:
+    """
+    Engine crawl dựa trên curl_cffi AsyncSession (lấy từ AsyncSessionPool theo proxy/browser).
+    - Giới hạn đồng thời theo toàn cục, theo host và theo proxy bằng asyncio.Semaphore.
+    - Proxy do ProxyManager chọn theo điểm sức khỏe; thời gian chờ theo tốc độ AIMD và backoff
+      khi retry đều được đặt lên timer queue của event loop (loop.call_later),
+      nên URL đang chờ không giữ slot nào, các URL khác vẫn chạy bình thường.
+    - Kết quả trả về đúng format dict của name_scrapping để dùng lại process_results.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, per_host_limit=PER_HOST_LIMIT,
+                 per_proxy_limit=PER_PROXY_LIMIT, max_retry=MAX_RETRY):
+        self.max_in_flight = max_in_flight
+        self.per_host_limit = per_host_limit
+        self.per_proxy_limit = per_proxy_limit
+        self.max_retry = max_retry
+
+        self.host_semaphores = {}
+        self.proxy_semaphores = {}
+
+    def _host_semaphore(self, host):
+        if host not in self.host_semaphores:
+            self.host_semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return self.host_semaphores[host]
+
+    def _proxy_semaphore(self, proxy):
+        if proxy not in self.proxy_semaphores:
+            self.proxy_semaphores[proxy] = asyncio.Semaphore(self.per_proxy_limit)
+        return self.proxy_semaphores[proxy]
+
+    def _schedule_retry(self, job, result):
+        # Nếu còn lượt thử lại: đặt job lên timer queue và trả về None, ngược lại trả về kết quả cuối
+        if job['attempt'] < self.max_retry - 1:
+            job['attempt'] += 1
+            self.loop.call_later(backoff_delay(job['attempt'] - 1), self.work_queue.put_nowait, job)
+            return None
+        return result
+
+    async def _attempt(self, job):
+        # Thực hiện 1 lần request cho job, trả về dict kết quả hoặc None nếu đã lên lịch retry
+        product_id = job['product_id']
+        url = job['url']
+        host = urlsplit(url).hostname or ''
+
+        # Chọn proxy tốt nhất; nếu phải chờ theo tốc độ AIMD thì đặt job lên timer queue thay vì giữ slot
+        if job.get('proxy') is None:
+            proxy, wait = PROXY_MANAGER.acquire(host)
+            job['proxy'] = proxy
+            if wait > 0:
+                self.loop.call_later(wait, self.work_queue.put_nowait, job)
+                return None
+
+        proxy = job.pop('proxy')
+        request_start = time.time()
+
+        try:
+            async with self._host_semaphore(host), self._proxy_semaphore(proxy):
+                session = self.session_pool.acquire(proxy, job['browser'])
+                try:
+                    res = await session.get(url, timeout=10)
+                except Exception:
+                    self.session_pool.release(proxy, job['browser'], session, broken=True)
+                    raise
+                self.session_pool.release(proxy, job['browser'], session)
+        except RequestsError as e:
+            # LỖI MẠNG KHI REQUEST
+            PROXY_MANAGER.report(proxy, host, network_error=True)
+            return self._schedule_retry(job, {'product_id': product_id, 'url': url,
+                                                             'status': 'err_network', 'error_msg': str(e)})
+        except Exception as e:
+            # LỖI KHÁC: vẫn báo cho ProxyManager để proxy đang thăm dò (probing) được giải phóng
+            PROXY_MANAGER.report(proxy, host, network_error=True)
+            return self._schedule_retry(job, {'product_id': product_id, 'url': url, 'status': 'err_other',
+                                                           'http_code': 0, 'error_msg': str(e)})
+
+        PROXY_MANAGER.report(proxy, host, status_code=res.status_code, latency=time.time() - request_start)
+
+        # TRƯỜNG HỢP 1: THÀNH CÔNG (200)
+        if res.status_code == 200:
+            try:
+                product_name = await parse_body_async(res.content)
+            except Exception as e:
+                # Lỗi bóc tách (extractor, BrokenProcessPool...) -> lỗi khác giống engine thread
+                return {'product_id': product_id, 'url': url, 'status': 'err_other',
+                        'http_code': 200, 'error_msg': f'Parse error: {e}'}
+            return {'product_id': product_id, 'product_name': product_name, 'url': url,
+                    'status': 'success', 'http_code': 200, 'error_msg': ''}
+
+        # TRƯỜNG HỢP 2: LỖI 404 -> KHÔNG RETRY
+        if res.status_code == 404:
+            return {'product_id': product_id, 'url': url, 'status': 'err_404',
+                    'http_code': 404, 'error_msg': 'Page Not Found'}
+
+        # TRƯỜNG HỢP 3: LỖI 403 -> RETRY và đổi sang browser khác
+        if res.status_code == 403:
+            job['browser'] = random.choice([b for b in BROWSER_LIST if b != job['browser']])
+            return self._schedule_retry(job, {'product_id': product_id, 'url': url, 'status': 'err_403',
+                                                         'http_code': 403, 'error_msg': 'Forbidden'})
+
+        # TRƯỜNG HỢP 4: LỖI 429 -> BACKOFF + RETRY
+        if res.status_code == 429:
+            return self._schedule_retry(job, {'product_id': product_id, 'url': url, 'status': 'err_429',
+                                                         'http_code': 429, 'error_msg': 'Rate limit'})
+
+        # TRƯỜNG HỢP 5: LỖI 5xx -> RETRY
+        if 500 <= res.status_code < 600:
+            return self._schedule_retry(job, {'product_id': product_id, 'url': url, 'status': 'err_5xx',
+                                                         'http_code': res.status_code, 'error_msg': f'HTTP {res.status_code}'})
+
+        # Mã HTTP khác -> thử lại, hết lượt thì tính là lỗi khác
+        return self._schedule_retry(job, {'product_id': product_id, 'url': url, 'status': 'err_other',
+                                                       'http_code': res.status_code, 'error_msg': f'HTTP {res.status_code}'})
+
+    def _finish_job(self):
+        # Job đã có kết quả cuối: trả slot admission, báo xong khi không còn job nào
+        self.pending -= 1
+        self.admission.release()
+
+        if self.feed_done and self.pending == 0:
+            self.all_done.set()
+
+    async def _worker(self):
+        while True:
+            job = await self.work_queue.get()
+            finished = True
+            try:
+                result = await self._attempt(job)
+
+                # Job đã được đặt lịch retry trên timer queue
+                if result is None:
+                    finished = False
+                    continue
+            except asyncio.CancelledError:
+                finished = False
+                raise
+            except Exception as e:
+                # Lỗi ngoài dự kiến -> tính là lỗi khác, không để 1 job hỏng làm chết worker
+                result = {'product_id': job['product_id'], 'url': job['url'], 'status': 'err_other',
+                          'http_code': 0, 'error_msg': str(e)}
+            finally:
+                if finished:
+                    self.result_queue.put_nowait(result)
+                    self._finish_job()
+
+    async def _feed(self, items):
+        # Đọc item từ generator (MongoDB là I/O đồng bộ nên chạy trong thread riêng)
+        iterator = iter(items)
+
+        while True:
+            chunk = await asyncio.to_thread(lambda: list(itertools.islice(iterator, FEED_CHUNK)))
+            if not chunk:
+                break
+
+            for item in chunk:
+                # Không nhận quá max_in_flight URL chưa có kết quả (kể cả URL đang chờ retry)
+                await self.admission.acquire()
+                self.pending += 1
+                self.work_queue.put_nowait({'product_id': item['product_id'], 'url': item['url'],
+                                            'browser': random.choice(BROWSER_LIST), 'attempt': 0})
+
+        self.feed_done = True
+        if self.pending == 0:
+            self.all_done.set()
+
+    async def _consume(self, handle_batch):
+        # Gom kết quả thành từng micro-batch BATCH_SIZE rồi gọi handle_batch trong thread (ghi CSV/Mongo là I/O đồng bộ)
+        # Lô cũng được ghi khi quá FLUSH_INTERVAL giây kể từ lần ghi trước
+        batch = []
+        last_flush = time.time()
+        while True:
+            timeout = max(FLUSH_INTERVAL - (time.time() - last_flush), 0)
+            try:
+                result = await asyncio.wait_for(self.result_queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                result = False
+
+            if result is None:
+                break
+
+            if result:
+                batch.append(result)
+
+            if len(batch) >= BATCH_SIZE or (batch and time.time() - last_flush >= FLUSH_INTERVAL):
+                await asyncio.to_thread(handle_batch, batch)
+                batch = []
+                last_flush = time.time()
+            elif not batch:
+                last_flush = time.time()
+
+        if batch:
+            await asyncio.to_thread(handle_batch, batch)
+
+    async def run(self, items, handle_batch):
+        self.loop = asyncio.get_running_loop()
+        self.work_queue = asyncio.Queue()
+        self.result_queue = asyncio.Queue()
+        self.admission = asyncio.Semaphore(self.max_in_flight)
+        self.all_done = asyncio.Event()
+        self.pending = 0
+        self.feed_done = False
+
+        self.session_pool = AsyncSessionPool()
+
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.max_in_flight)]
+        consumer = asyncio.create_task(self._consume(handle_batch))
+
+        try:
+            await self._feed(items)
+            await self.all_done.wait()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self.session_pool.aclose()
+
+        # Báo cho consumer ghi nốt phần dư
+        await self.result_queue.put(None)
+        await consumer
+
+
+def run_async_crawler_round(round_number, stats, candidates, start_time):
+    # Hàm tương đương run_crawler_round nhưng dùng AsyncCrawlEngine
+
+    tgt_collection = get_database('crawler')[TARGET_COLLECTION]
+    batch_start_time = time.time()
+
+    print_round_header(round_number, stats)
+
+    with open(OUTPUT_CSV, mode='a', encoding='utf-8-sig', newline='') as f:
+        writer = open_csv_writer(f)
+
+        def handle_batch(results):
+            nonlocal batch_start_time
+
+            save_results(results, writer, stats, tgt_collection)
+
+            # Xử lý LOGGING
+            current_time = time.time()
+            batch_duration = current_time - batch_start_time
+            batch_start_time = current_time
+
+            chunk_num = stats['processed'] // BATCH_SIZE
+            pending = max(stats['total'] - stats['processed'], 0)
+            print_progress(chunk_num, pending, stats, batch_duration)
+
+        engine = AsyncCrawlEngine()
+        asyncio.run(engine.run(candidates, handle_batch))
+
+    print_round_report(round_number, stats, start_time, session_pool=engine.session_pool)
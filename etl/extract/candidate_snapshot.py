@@ -0,0 +1,109 @@
+import json
+import os
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bson.objectid import ObjectId
+
+SNAPSHOT_SCHEMA = pa.schema([
+    ('product_id', pa.string()),
+    ('url', pa.string())
+])
+
+
+class CandidateSnapshot:
+    """
+    Ảnh chụp danh sách (product_id -> url) cần crawl, lưu gọn dưới dạng Parquet sắp xếp theo product_id.
+    - Lần đầu: quét toàn bộ raw_data 1 lần bằng aggregation rồi lưu file.
+    - Các lần sau (round sau hoặc lần chạy sau): chỉ quét những event có _id lớn hơn high-water mark đã lưu.
+    - get_total/get_product của các round chỉ đọc từ bộ nhớ, không quét lại raw_data.
+    """
+
+    def __init__(self, snapshot_file):
+        self.snapshot_file = snapshot_file
+        self.state_file = os.path.splitext(snapshot_file)[0] + '_state.json'
+        self.candidates = {}
+        self.last_id = None
+
+    def load(self):
+        # Đọc snapshot và high-water mark từ lần chạy trước (nếu có)
+        if os.path.exists(self.snapshot_file) and os.path.exists(self.state_file):
+            table = pq.read_table(self.snapshot_file)
+            self.candidates = dict(zip(table.column('product_id').to_pylist(), table.column('url').to_pylist()))
+
+            with open(self.state_file, 'r') as f:
+                last_id = json.load(f).get('last_id')
+                self.last_id = ObjectId(last_id) if last_id else None
+        else:
+            self.candidates = {}
+            self.last_id = None
+
+        return self
+
+    def save(self):
+        # Ghi ra file tạm rồi đổi tên để không bao giờ để lại snapshot ghi dở
+        product_ids = sorted(self.candidates)
+        table = pa.table({
+            'product_id': product_ids,
+            'url': [self.candidates[pid] for pid in product_ids]
+        }, schema=SNAPSHOT_SCHEMA)
+
+        tmp_file = self.snapshot_file + '.tmp'
+        pq.write_table(table, tmp_file, compression='zstd')
+        os.replace(tmp_file, self.snapshot_file)
+
+        # State ghi sau snapshot: nếu chết giữa chừng, lần sau chỉ quét lại phần dữ liệu mới 1 lần nữa
+        tmp_state = self.state_file + '.tmp'
+        with open(tmp_state, 'w') as f:
+            json.dump({'last_id': str(self.last_id) if self.last_id else None,
+                       'total': len(self.candidates)}, f)
+        os.replace(tmp_state, self.state_file)
+
+    def refresh(self, src_collection, build_stages):
+        """
+        Cập nhật snapshot với các event mới từ src_collection.
+        build_stages(id_range) trả về các stage aggregation gom nhóm theo product_id (_id) kèm url.
+        """
+        start_time = time.time()
+
+        # Chốt high-water mark mới trước khi quét để không bỏ sót event được ghi trong lúc quét
+        latest = src_collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+        if latest is None:
+            return self
+
+        new_last_id = latest['_id']
+        if self.last_id is not None and new_last_id <= self.last_id:
+            print(f"--> Candidate snapshot đã mới nhất ({len(self.candidates)} product).")
+            return self
+
+        id_range = {'$lte': new_last_id}
+        if self.last_id is not None:
+            id_range['$gt'] = self.last_id
+
+        added = 0
+        cursor = src_collection.aggregate(build_stages(id_range), allowDiskUse=True, batchSize=5000)
+        try:
+            for doc in cursor:
+                # Giữ URL đã có trong snapshot, chỉ thêm product mới
+                if doc['_id'] not in self.candidates:
+                    self.candidates[doc['_id']] = doc['url']
+                    added += 1
+        finally:
+            cursor.close()
+
+        self.last_id = new_last_id
+        self.save()
+
+        mode = "bổ sung" if id_range.get('$gt') else "tạo mới"
+        print(f"--> Candidate snapshot ({mode}): +{added} product, tổng {len(self.candidates)} "
+              f"({time.time() - start_time:.2f}s).")
+        return self
+
+    def count_pending(self, existing_products_set):
+        return sum(1 for pid in self.candidates if pid not in existing_products_set)
+
+    def iter_pending(self, existing_products_set):
+        # Trả về các (product_id, url) chưa xử lý theo thứ tự product_id
+        for product_id in sorted(self.candidates):
+            if product_id not in existing_products_set:
+                yield {'product_id': product_id, 'url': self.candidates[product_id]}
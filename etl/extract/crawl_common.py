@@ -0,0 +1,204 @@
+import csv
+import time
+import os
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from config.get_mongo_connection import get_database
+from src.get_data_from_env import get_filename
+from src.checkpoint_manager import CheckpointWriter
+from etl.extract.session_pool import SessionPool
+from etl.extract.proxy_manager import ProxyManager, load_proxy_list, backoff_delay  # backoff_delay: dùng chung 2 engine
+
+# Phần dùng chung của 2 engine crawl (product_crawler: thread, async_crawler: asyncio).
+# Tách riêng để async_crawler không phải import ngược product_crawler: khi chạy product_crawler
+# bằng "python -m", import ngược sẽ nạp module lần 2 và tạo thêm 1 bộ singleton (checkpoint, proxy, session).
+
+TARGET_COLLECTION = 'product_names'  # Collection mới để chứa kết quả
+PROCESSED_COLLECTION = 'processed_product_ids'  # Collection chứa ID đã xử lý (success + 404), dùng để anti-join
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 5 # Số giây tối đa giữ kết quả trước khi ghi CSV/Mongo
+MAX_RETRY = 3 # Số lần thử lại cho mỗi URL
+
+BROWSER_LIST = [
+    "chrome124",
+    "edge101",
+    "safari17_0"
+]
+
+# Lấy thư mục file hiện tại
+current_dir = os.path.dirname(__file__)
+
+# Lấy thư mục gốc của project
+project_dir = os.path.abspath(os.path.join(current_dir, '../..'))
+
+# Lấy thư mục file .env
+env_path = os.path.join(project_dir, '.env')
+
+# Load file, nếu không thấy file sẽ báo
+if load_dotenv(dotenv_path=env_path):
+    print("Đã load thành công cấu hình từ file .env")
+else:
+    print("Không tìm thấy file .env, đang sử dụng biến môi trường có sẵn của hệ thống.")
+
+product_name_path = os.environ.get('PRODUCT_NAME_PATH')
+
+OUTPUT_CSV = get_filename(product_name_path, 'PRODUCT_NAME_PATH')
+
+# Nguồn danh sách cần crawl:
+# - 'snapshot' (mặc định): dùng candidate snapshot lưu trên đĩa, chỉ quét phần raw_data mới theo _id
+# - 'aggregate': mỗi round chạy aggregation + anti-join với PROCESSED_COLLECTION trên MongoDB
+CANDIDATE_SOURCE = os.environ.get('CANDIDATE_SOURCE', 'snapshot').lower()
+
+if CANDIDATE_SOURCE not in ('snapshot', 'aggregate'):
+    raise ValueError(f"LỖI: CANDIDATE_SOURCE '{CANDIDATE_SOURCE}' không hợp lệ. Chọn 'snapshot' hoặc 'aggregate'")
+
+# Ghi checkpoint theo lô, commit cùng nhịp với insert_many trong save_results
+CHECKPOINT_WRITER = CheckpointWriter(auto_commit=False)
+
+# Bể session dùng chung cho các luồng crawl
+SESSION_POOL = SessionPool()
+
+# Quản lý proxy theo sức khỏe (danh sách proxy đọc từ PROXY_LIST_PATH/PROXY_LIST trong .env)
+PROXY_MANAGER = ProxyManager(load_proxy_list())
+
+def mark_processed(results_list):
+    # Ghi các ID đã xử lý xong (success/404) lên PROCESSED_COLLECTION để lần query sau tự loại bỏ
+    product_ids = {str(r['product_id']) for r in results_list if r['status'] in ('success', 'err_404')}
+    if not product_ids:
+        return
+
+    requests_list = [UpdateOne({'_id': pid}, {'$setOnInsert': {'_id': pid}}, upsert=True) for pid in product_ids]
+    try:
+        get_database('crawler')[PROCESSED_COLLECTION].bulk_write(requests_list, ordered=False)
+    except Exception as e:
+        print(f"Đây là lỗi khi ghi ID đã xử lý vào MONGO: {e}")
+
+
+# DATA QUALITY (CHUẨN HÓA & VALIDATE)
+def normalize_data(raw_item):
+    # Hàm chuẩn hóa dữ liệu trước khi lưu
+    return {
+        'product_id': str(raw_item.get('product_id', '')).strip(),
+        'product_name': str(raw_item.get('product_name', '')).strip(),
+        'url': str(raw_item.get('url', '')).strip()
+    }
+
+def validate_data(item):
+    # Hàm kiểm tra dữ liệu sạch
+    if not item['product_id']:
+        return False, 'missing_id'
+    # Tên sản phẩm phải có và không được là "Unknown name"
+    if not item['product_name'] or item['product_name'].lower() == 'unknown name':
+        return False, 'missing_name'
+    if not item['url']:
+        return False, 'missing_url'
+    return True, 'valid'
+
+def process_results(results_list, csv_writer, stats):
+    # Hàm xử lý danh sách kết quả (Dùng chung cho cả batch và phần dư)
+
+    insert_mongo_batch = []
+    for result in results_list:
+        # 1. Ghi log CSV (Ghi tất cả kết quả, kể cả lỗi)
+        csv_writer.writerow(result)
+
+        # 2. Cập nhật thống kê mạng
+        stats['processed'] += 1
+        status_key = result['status']
+
+        if status_key == 'success':
+            stats['success'] += 1
+        elif status_key in stats:
+            stats[status_key] += 1
+        else:
+            stats['err_other'] += 1
+
+        # 3. Xử lý CHECKPOINT: Đưa productid vào bộ đệm, ghi xuống file sau khi insert MongoDB xong
+        CHECKPOINT_WRITER.add(result['product_id'], result['status'])
+
+        # 4. Xử lý Data Quality & chuẩn bị ghi vào MongoDB
+        if status_key == 'success':
+            # Chuẩn hóa
+            normalized_item = normalize_data(result)
+            # Kiểm tra
+            is_valid, reason = validate_data(normalized_item)
+
+            if is_valid:
+                stats['dq_valid'] += 1
+                insert_mongo_batch.append(normalized_item)
+            else:
+                dq_key = f"dq_{reason}"
+                if dq_key in stats:
+                    stats[dq_key] += 1
+    return insert_mongo_batch
+
+def save_results(results_list, csv_writer, stats, tgt_collection):
+    # Hàm xử lý kết quả và ghi data sạch vào MongoDB (dùng chung cho cả engine thread và asyncio)
+    insert_mongo_batch = process_results(results_list, csv_writer, stats)
+
+    # Đánh dấu ID đã xử lý trên MongoDB cho bước sinh danh sách cần crawl (chỉ cần khi anti-join trên server)
+    if CANDIDATE_SOURCE == 'aggregate':
+        mark_processed(results_list)
+
+    # Insert vào Mongo (Chỉ data sạch)
+    if insert_mongo_batch:
+        try:
+            tgt_collection.insert_many(insert_mongo_batch, ordered=False)
+        except Exception as e:
+            print(f"Đây là lỗi khi insert vào MONGO: {e}")
+
+    # Ghi checkpoint của cả micro-batch (1 lần fsync) sau khi đã lưu MongoDB
+    CHECKPOINT_WRITER.commit()
+
+def open_csv_writer(f):
+    # Hàm tạo CSV writer cho file log kết quả crawl
+    field_names = ['product_id', 'product_name', 'url', 'status', 'http_code', 'error_msg']
+
+    writer = csv.DictWriter(f, fieldnames=field_names)
+
+    # Nếu file chưa tồn tại thì ghi Header
+    if not os.path.isfile(OUTPUT_CSV):
+        # Ghi header
+        writer.writeheader()
+
+    return writer
+
+def print_round_header(round_number, stats):
+    print("\n" + "=" * 40)
+    print(f"BẮT ĐẦU CRAWLING ROUND {round_number}")
+    print(f"{'Chunk':<6} | {'Pending':<8} | {'OK':<6} | {'Valid':<6} | {'404':<5} | {'403':<5} | {'429':<5} | {'5xx':<5} | {'Net':<5} | {'Other':<5} | {'Time (s)':<10}")
+    print("-" * 85)
+    print(f"{0:<6} | {stats['total']:<8} | {stats['success']:<6} | {stats['dq_valid']:<6} | {stats['err_404']:<5} | {stats['err_403']:<5} | {stats['err_429']:<5} | {stats['err_5xx']:<5} | {stats['err_network']:<5} | {stats['err_other']:<5} | 0s")
+
+def print_progress(chunk_num, pending, stats, batch_duration):
+    print(f"{chunk_num:<6} | {pending:<8} | {stats['success']:<6} | {stats['dq_valid']:<6} | {stats['err_404']:<5} | {stats['err_403']:<5} | {stats['err_429']:<5} | "
+        f"{stats['err_5xx']:<5} | {stats['err_network']:<5} | {stats['err_other']:<5} | {batch_duration:.2f}s")
+
+def print_round_report(round_number, stats, start_time, session_pool=SESSION_POOL):
+    total_duration = time.time() - start_time
+
+    # --- FINAL REPORT ---
+    print("\n" + "=" * 40)
+    print(f"HOÀN TẤT CRAWLING ROUND {round_number}!")
+    print(f"BÁO CÁO TỔNG KẾT")
+    print("-" * 50)
+    print(f"Tổng thời gian  : {total_duration:.2f}s ({total_duration / 60:.2f} phút)")
+    print("-" * 30)
+    print(f"SUCCESS (200)   : {stats['success']} ({stats['success'] / max(stats['total'], 1) * 100:.1f}%)")
+    print(f"Data Valid      : {stats['dq_valid']}")
+    print(f"Data Invalid")
+    print(f" - Missing ID   : {stats['dq_missing_id']}")
+    print(f" - Missing Name : {stats['dq_missing_name']}")
+    print(f" - Missing Url  : {stats['dq_missing_url']}")
+    print("-" * 30)
+    print(f"404 Not Found   : {stats['err_404']}")
+    print(f"403 Forbidden   : {stats['err_403']}")
+    print(f"429 RateLimit   : {stats['err_429']}")
+    print(f"5xx Server Err  : {stats['err_5xx']}")
+    print(f"Network Err     : {stats['err_network']}")
+    print(f"Other Errors    : {stats['err_other']}")
+    print("-" * 50)
+    session_pool.print_stats()
+    PROXY_MANAGER.print_stats()
+    print(f"MongoDB: Đã lưu vào collection: '{TARGET_COLLECTION}'")
+    print(f"CSV: Đã lưu vào '{OUTPUT_CSV}'")
@@ -0,0 +1,69 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+from etl.extract.title_extractor import extract_product_name
+
+# Lấy thư mục file hiện tại
+current_dir = os.path.dirname(__file__)
+
+# Lấy thư mục gốc của project
+project_dir = os.path.abspath(os.path.join(current_dir, '../..'))
+
+# Lấy thư mục file .env
+env_path = os.path.join(project_dir, '.env')
+
+load_dotenv(dotenv_path=env_path)
+
+# Chế độ parse HTML:
+# - 'inline': parse ngay trong luồng/coroutine vừa tải trang (mặc định)
+# - 'process': gửi body (bytes) sang ProcessPoolExecutor, luồng mạng không phải giữ GIL để parse
+PARSE_MODE = os.environ.get('PARSE_MODE', 'inline').lower()
+PARSER_WORKERS = int(os.environ.get('PARSER_WORKERS') or os.cpu_count() or 1)
+
+if PARSE_MODE not in ('inline', 'process'):
+    raise ValueError(f"LỖI: PARSE_MODE '{PARSE_MODE}' không hợp lệ. Chọn 'inline' hoặc 'process'")
+
+_parser_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_parser_pool():
+    # Khởi tạo process pool khi cần lần đầu (chỉ 1 pool cho toàn chương trình)
+    global _parser_pool
+
+    with _pool_lock:
+        if _parser_pool is None:
+            # spawn: pool được tạo khi các luồng crawl đã chạy, fork lúc này có thể chép lock đang bị giữ sang process con
+            _parser_pool = ProcessPoolExecutor(max_workers=PARSER_WORKERS,
+                                               mp_context=multiprocessing.get_context('spawn'))
+            print(f"--> Đã khởi tạo {PARSER_WORKERS} process parse HTML.")
+    return _parser_pool
+
+
+def parse_body(body):
+    # Dùng trong luồng fetch: luồng chờ kết quả từ process khác nên không chiếm GIL khi parse
+    if PARSE_MODE == 'process':
+        return get_parser_pool().submit(extract_product_name, bytes(body)).result()
+    return extract_product_name(body)
+
+
+async def parse_body_async(body):
+    # Dùng trong engine asyncio: parse ở process pool để không chặn event loop
+    if PARSE_MODE == 'process':
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_parser_pool(), extract_product_name, bytes(body))
+    return extract_product_name(body)
+
+
+def close_parser_pool():
+    # Đóng process pool khi chương trình dừng hẳn
+    global _parser_pool
+
+    with _pool_lock:
+        if _parser_pool is not None:
+            _parser_pool.shutdown()
+            _parser_pool = None
+            print("--> Đã đóng process pool parse HTML.")
@@ -0,0 +1,280 @@
+import os
+import random
+import threading
+import time
+from dotenv import load_dotenv
+from src.get_data_from_env import get_filename
+
+# Tốc độ gửi request (request/giây) được điều chỉnh theo kiểu AIMD:
+# thành công -> cộng thêm ADDITIVE_INCREASE, bị chặn (403/429) -> nhân với MULTIPLICATIVE_DECREASE
+INITIAL_RATE = 2.0
+MIN_RATE = 0.05
+MAX_RATE = 20.0
+ADDITIVE_INCREASE = 0.1
+MULTIPLICATIVE_DECREASE = 0.5
+
+# Tốc độ cho cả host đích (mọi proxy cộng lại), nên cao hơn tốc độ của 1 proxy
+HOST_INITIAL_RATE = 20.0
+HOST_MAX_RATE = 200.0
+
+EWMA_ALPHA = 0.2  # Trọng số của mẫu mới khi tính trung bình trượt (tỉ lệ thành công, độ trễ)
+QUARANTINE_AFTER = 5  # Số lỗi liên tiếp để đưa proxy vào cách ly
+QUARANTINE_MIN_SCORE = 0.2  # Tỉ lệ thành công dưới ngưỡng này (sau MIN_SAMPLES request) cũng bị cách ly
+MIN_SAMPLES = 20
+QUARANTINE_SECONDS = 60  # Thời gian cách ly lần đầu, mỗi lần tái phạm sẽ nhân đôi
+MAX_QUARANTINE_SECONDS = 1800
+
+RETRY_BASE_DELAY = 1.0  # Thời gian chờ cơ bản trước khi thử lại (exponential backoff + jitter)
+RETRY_MAX_DELAY = 30.0
+
+# Lấy thư mục file hiện tại
+current_dir = os.path.dirname(__file__)
+
+# Lấy thư mục gốc của project
+project_dir = os.path.abspath(os.path.join(current_dir, '../..'))
+
+# Lấy thư mục file .env
+env_path = os.path.join(project_dir, '.env')
+
+load_dotenv(dotenv_path=env_path)
+
+
+def load_proxy_list():
+    """
+    Đọc danh sách proxy từ cấu hình thay vì viết cứng trong code.
+    Ưu tiên PROXY_LIST_PATH (file text, mỗi dòng 1 proxy, dòng bắt đầu bằng # là chú thích),
+    nếu không có thì đọc PROXY_LIST (các proxy cách nhau bởi dấu phẩy).
+    Định dạng proxy: http://username:password@ip_address:port
+    """
+    proxy_list_path = os.environ.get('PROXY_LIST_PATH')
+    proxies = []
+
+    if proxy_list_path:
+        proxy_filename = get_filename(proxy_list_path, 'PROXY_LIST_PATH')
+        if not os.path.exists(proxy_filename):
+            raise FileNotFoundError(f"LỖI: Không tìm thấy file proxy '{proxy_filename}'")
+
+        with open(proxy_filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    proxies.append(line)
+    else:
+        proxies = [p.strip() for p in os.environ.get('PROXY_LIST', '').split(',') if p.strip()]
+
+    if not proxies:
+        raise ValueError("LỖI: Biến PROXY_LIST_PATH hoặc PROXY_LIST chưa được set hoặc bị rỗng trong file .env")
+
+    # Bỏ trùng nhưng giữ nguyên thứ tự
+    return list(dict.fromkeys(proxies))
+
+
+def backoff_delay(attempt):
+    # Exponential backoff có jitter: 1s, 2s, 4s... (tối đa RETRY_MAX_DELAY)
+    delay = min(RETRY_BASE_DELAY * (2 ** attempt), RETRY_MAX_DELAY)
+    return random.uniform(delay / 2, delay)
+
+
+class RateState:
+    # Trạng thái AIMD: tốc độ cho phép hiện tại và thời điểm sớm nhất được gửi request tiếp theo
+
+    def __init__(self, initial_rate=INITIAL_RATE, max_rate=MAX_RATE):
+        self.rate = initial_rate
+        self.max_rate = max_rate
+        self.next_allowed = 0.0
+
+    def increase(self):
+        self.rate = min(self.rate + ADDITIVE_INCREASE, self.max_rate)
+
+    def decrease(self):
+        self.rate = max(self.rate * MULTIPLICATIVE_DECREASE, MIN_RATE)
+
+    def reserve(self, now):
+        # Giữ chỗ 1 request, trả về số giây phải chờ
+        start = max(now, self.next_allowed)
+        self.next_allowed = start + 1.0 / self.rate
+        return start - now
+
+
+class ProxyHealth:
+    # Thống kê sức khỏe của 1 proxy
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.rate = RateState()
+
+        self.requests = 0
+        self.success = 0
+        self.err_4xx = 0
+        self.err_5xx = 0
+        self.err_network = 0
+
+        self.success_ewma = 1.0  # Tỉ lệ thành công (trung bình trượt)
+        self.latency_ewma = None  # Độ trễ trung bình trượt (giây)
+        self.consecutive_failures = 0
+
+        self.quarantined_until = 0.0
+        self.quarantine_count = 0
+        self.probing = False  # Đang có 1 request thăm dò sau khi hết cách ly
+
+    def score(self):
+        # Điểm càng cao càng tốt: ưu tiên tỉ lệ thành công cao, độ trễ thấp
+        latency = self.latency_ewma if self.latency_ewma is not None else 1.0
+        return self.success_ewma / (1.0 + latency)
+
+    def record(self, ok, latency):
+        self.success_ewma = (1 - EWMA_ALPHA) * self.success_ewma + EWMA_ALPHA * (1.0 if ok else 0.0)
+        if latency is not None:
+            if self.latency_ewma is None:
+                self.latency_ewma = latency
+            else:
+                self.latency_ewma = (1 - EWMA_ALPHA) * self.latency_ewma + EWMA_ALPHA * latency
+
+    def to_dict(self):
+        return {
+            'proxy': self.proxy,
+            'requests': self.requests,
+            'success': self.success,
+            'err_4xx': self.err_4xx,
+            'err_5xx': self.err_5xx,
+            'err_network': self.err_network,
+            'success_rate': round(self.success_ewma, 3),
+            'latency': round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            'rate': round(self.rate.rate, 3),
+            'quarantined': self.quarantined_until > time.time()
+        }
+
+
+class ProxyManager:
+    """
+    Quản lý proxy theo sức khỏe thay cho random.choice:
+    - acquire(host): chọn proxy điểm cao nhất đang sẵn sàng, trả về (proxy, số giây cần chờ)
+      theo tốc độ AIMD của proxy và của host đích.
+    - report(...): cập nhật thống kê, điều chỉnh tốc độ, cách ly proxy hỏng.
+    - Proxy hết hạn cách ly chỉ được nhận 1 request thăm dò; thành công mới được dùng lại bình thường.
+    """
+
+    def __init__(self, proxies):
+        if not proxies:
+            raise ValueError("LỖI: Danh sách proxy rỗng")
+
+        self.proxies = {proxy: ProxyHealth(proxy) for proxy in proxies}
+        self.hosts = {}
+        self._lock = threading.Lock()
+
+    def _host_rate(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = RateState(HOST_INITIAL_RATE, HOST_MAX_RATE)
+        return self.hosts[host]
+
+    def _is_available(self, health, now):
+        if health.quarantined_until > now:
+            return False
+        # Hết hạn cách ly nhưng chưa thăm dò xong: chỉ cho 1 request thăm dò tại 1 thời điểm
+        if health.quarantine_count and health.probing:
+            return False
+        return True
+
+    def acquire(self, host):
+        now = time.time()
+
+        with self._lock:
+            available = [h for h in self.proxies.values() if self._is_available(h, now)]
+
+            if available:
+                # Chọn proxy sẵn sàng sớm nhất, nếu cùng lúc thì lấy điểm cao nhất
+                health = min(available, key=lambda h: (max(h.rate.next_allowed - now, 0), -h.score()))
+            else:
+                # Tất cả đều đang bị cách ly: dùng proxy sắp hết hạn cách ly nhất
+                health = min(self.proxies.values(), key=lambda h: h.quarantined_until)
+
+            if health.quarantine_count:
+                health.probing = True
+
+            # Chờ hết cách ly (nếu có) rồi mới tới lượt theo tốc độ của proxy
+            wait = max(health.quarantined_until - now, 0)
+            wait += health.rate.reserve(now + wait)
+
+            host_rate = self._host_rate(host)
+            wait = max(wait, host_rate.reserve(now))
+
+            health.requests += 1
+
+        return health.proxy, wait
+
+    def report(self, proxy, host, status_code=None, latency=None, network_error=False):
+        # Ghi nhận kết quả 1 request. status_code=None + network_error=True khi lỗi mạng
+        now = time.time()
+
+        with self._lock:
+            health = self.proxies.get(proxy)
+            if health is None:
+                return
+
+            host_rate = self._host_rate(host)
+
+            # 404 nghĩa là proxy vẫn hoạt động tốt, chỉ là trang không tồn tại
+            ok = not network_error and status_code is not None and (status_code < 400 or status_code == 404)
+            health.record(ok, latency)
+
+            if ok:
+                health.success += 1
+                health.consecutive_failures = 0
+                health.rate.increase()
+                host_rate.increase()
+
+                # Thăm dò thành công -> đưa proxy trở lại hoạt động bình thường
+                if health.quarantine_count:
+                    health.quarantine_count = 0
+                    health.probing = False
+                    health.rate = RateState()
+                return
+
+            health.consecutive_failures += 1
+
+            if network_error:
+                health.err_network += 1
+                health.rate.decrease()
+            elif status_code == 429:
+                # Bị giới hạn tốc độ: giảm cả tốc độ của proxy lẫn của host đích
+                health.err_4xx += 1
+                health.rate.decrease()
+                host_rate.decrease()
+            elif status_code == 403:
+                # 403 thường là proxy đã bị website chặn
+                health.err_4xx += 1
+                health.rate.decrease()
+            elif status_code >= 500:
+                # Lỗi phía server: giảm tốc độ gửi tới host
+                health.err_5xx += 1
+                host_rate.decrease()
+            else:
+                health.err_4xx += 1
+
+            unhealthy = (health.consecutive_failures >= QUARANTINE_AFTER or
+                         (health.requests >= MIN_SAMPLES and health.success_ewma < QUARANTINE_MIN_SCORE))
+
+            # Thăm dò thất bại hoặc proxy không khỏe -> cách ly (thời gian tăng gấp đôi mỗi lần)
+            if health.probing or unhealthy:
+                duration = min(QUARANTINE_SECONDS * (2 ** health.quarantine_count), MAX_QUARANTINE_SECONDS)
+                health.quarantined_until = now + duration
+                health.quarantine_count += 1
+                health.probing = False
+                health.consecutive_failures = 0
+                print(f"--> Cách ly proxy {mask_proxy(proxy)} trong {duration}s (lần {health.quarantine_count})")
+
+    def get_stats(self):
+        with self._lock:
+            return [health.to_dict() for health in self.proxies.values()]
+
+    def print_stats(self):
+        print(f"{'Proxy':<28} | {'Req':<6} | {'OK':<6} | {'4xx':<5} | {'5xx':<5} | {'Net':<5} | {'Rate':<6} | {'Lat (s)':<7} | Quarantine")
+        for item in self.get_stats():
+            latency = f"{item['latency']:.2f}" if item['latency'] is not None else '-'
+            print(f"{mask_proxy(item['proxy']):<28} | {item['requests']:<6} | {item['success']:<6} | {item['err_4xx']:<5} | "
+                  f"{item['err_5xx']:<5} | {item['err_network']:<5} | {item['rate']:<6} | {latency:<7} | {item['quarantined']}")
+
+
+def mask_proxy(proxy):
+    # Ẩn username/password khi in log
+    return proxy.rsplit('@', 1)[-1]
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from curl_cffi import requests
+from curl_cffi.requests import AsyncSession
+
+MAX_IDLE_SECONDS = 60  # Session nằm chờ quá lâu sẽ bị đóng (proxy/server thường đã cắt kết nối)
+MAX_REQUESTS_PER_SESSION = 200  # Số request tối đa trên 1 session trước khi thay session mới
+
+
+class SessionPool:
+    """
+    Bể chứa các curl_cffi Session đã "ấm" (đã bắt tay TCP/TLS qua proxy), phân nhóm theo (proxy, browser).
+    - acquire/release theo kiểu mượn - trả: 1 session chỉ phục vụ 1 request tại 1 thời điểm.
+    - Session bị đóng khi quá MAX_IDLE_SECONDS không dùng, hoặc đã phục vụ đủ MAX_REQUESTS_PER_SESSION.
+    - Bộ đếm hit/miss dùng để đo số lần bắt tay được tiết kiệm.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_SECONDS, max_requests=MAX_REQUESTS_PER_SESSION):
+        self.max_idle = max_idle
+        self.max_requests = max_requests
+
+        # key -> list các entry [session, last_used, request_count] đang rảnh
+        self._idle = {}
+        # id(session) -> entry của session đang được mượn
+        self._in_use = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self.stats = {
+            'hits': 0,  # Dùng lại session cũ (không tốn bắt tay mới)
+            'misses': 0,  # Phải tạo session mới
+            'expired': 0,  # Session bị đóng do idle quá lâu
+            'retired': 0,  # Session bị đóng do đủ số request tối đa
+            'broken': 0  # Session bị đóng do lỗi mạng
+        }
+
+    def _create(self, proxy, browser):
+        return requests.Session(
+            impersonate=browser,
+            proxies={"http": proxy, "https": proxy},
+            verify=False
+        )
+
+    def _close(self, session):
+        try:
+            session.close()
+        except Exception as e:
+            print(f"Lỗi khi đóng session: {e}")
+
+    def acquire(self, proxy, browser):
+        # Mượn 1 session cho cặp (proxy, browser), ưu tiên session còn ấm
+        key = (proxy, browser)
+        now = time.time()
+        expired = []
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("SessionPool đã bị đóng")
+
+            entry = None
+            idle_entries = self._idle.get(key, [])
+
+            while idle_entries:
+                candidate = idle_entries.pop()
+                if now - candidate[1] > self.max_idle:
+                    expired.append(candidate[0])
+                    self.stats['expired'] += 1
+                    continue
+                entry = candidate
+                break
+
+            if entry:
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+
+        # Đóng/tạo session ngoài lock để không chặn các luồng khác
+        for session in expired:
+            self._close(session)
+
+        if entry is None:
+            entry = [self._create(proxy, browser), now, 0]
+
+        entry[2] += 1
+        with self._lock:
+            self._in_use[id(entry[0])] = entry
+
+        return entry[0]
+
+    def release(self, proxy, browser, session, broken=False):
+        # Trả session về bể. broken=True khi request gặp lỗi mạng -> đóng luôn, không dùng lại
+        key = (proxy, browser)
+        to_close = None
+
+        with self._lock:
+            entry = self._in_use.pop(id(session), None)
+
+            if entry is None or self._closed or broken:
+                to_close = session
+                if broken:
+                    self.stats['broken'] += 1
+            elif entry[2] >= self.max_requests:
+                to_close = session
+                self.stats['retired'] += 1
+            else:
+                entry[1] = time.time()
+                self._idle.setdefault(key, []).append(entry)
+
+        if to_close is not None:
+            self._close(to_close)
+
+    @contextmanager
+    def session(self, proxy, browser):
+        # Dùng: with SESSION_POOL.session(proxy, browser) as session: session.get(url)
+        session = self.acquire(proxy, browser)
+        try:
+            yield session
+        except Exception:
+            self.release(proxy, browser, session, broken=True)
+            raise
+        else:
+            self.release(proxy, browser, session)
+
+    def close(self):
+        # Đóng toàn bộ session đang rảnh. Session đang được mượn sẽ bị đóng khi được trả về
+        with self._lock:
+            self._closed = True
+            sessions = [entry[0] for entries in self._idle.values() for entry in entries]
+            self._idle.clear()
+
+        for session in sessions:
+            self._close(session)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['idle'] = sum(len(entries) for entries in self._idle.values())
+            stats['in_use'] = len(self._in_use)
+
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 4) if total else 0.0
+        return stats
+
+    def print_stats(self):
+        stats = self.get_stats()
+        print(f"Session pool    : hit {stats['hits']} | miss {stats['misses']} | hit rate {stats['hit_rate'] * 100:.1f}% | "
+              f"expired {stats['expired']} | retired {stats['retired']} | broken {stats['broken']}")
+
+
+class AsyncSessionPool(SessionPool):
+    # Phiên bản dùng cho engine asyncio: session là curl_cffi AsyncSession, việc đóng session là coroutine
+
+    def __init__(self, max_idle=MAX_IDLE_SECONDS, max_requests=MAX_REQUESTS_PER_SESSION):
+        super().__init__(max_idle=max_idle, max_requests=max_requests)
+        self._closing = []
+
+    def _create(self, proxy, browser):
+        return AsyncSession(
+            impersonate=browser,
+            proxies={"http": proxy, "https": proxy},
+            verify=False
+        )
+
+    def _close(self, session):
+        # Bỏ các tác vụ đóng đã xong để list không phình ra khi chạy lâu
+        self._closing = [task for task in self._closing if not task.done()]
+        self._closing.append(asyncio.ensure_future(session.close()))
+
+    async def aclose(self):
+        self.close()
+        await asyncio.gather(*self._closing, return_exceptions=True)
+        self._closing = []
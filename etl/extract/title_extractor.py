@@ -0,0 +1,160 @@
+import html as html_lib
+import os
+import re
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+
+UNKNOWN_NAME = "Unknown name"
+
+# Regex cho fast path: chỉ quét đến khi gặp thẻ cần thiết, không dựng cây DOM
+H1_OPEN_RE = re.compile(r'<h1\b([^>]*)>', re.I)
+H1_CLOSE_RE = re.compile(r'</h1\s*>', re.I)
+SPAN_TAG_RE = re.compile(r'<(/?)span\b[^>]*?(/?)>', re.I)
+META_RE = re.compile(r'<meta\b([^>]*)>', re.I)
+ATTR_RE = re.compile(r'''([^\s"'=<>/]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''')
+TAG_RE = re.compile(r'<[^>]*>')
+SKIP_BLOCK_RE = re.compile(r'<(script|style)\b.*?</\1\s*>|<!--.*?-->', re.I | re.S)
+
+# Lấy thư mục file hiện tại
+current_dir = os.path.dirname(__file__)
+
+# Lấy thư mục gốc của project
+project_dir = os.path.abspath(os.path.join(current_dir, '../..'))
+
+# Lấy thư mục file .env
+env_path = os.path.join(project_dir, '.env')
+
+load_dotenv(dotenv_path=env_path)
+
+
+def parse_attrs(attr_text):
+    # Đọc các thuộc tính của 1 thẻ HTML thành dict (tên thuộc tính viết thường giống lxml)
+    attrs = {}
+    for match in ATTR_RE.finditer(attr_text):
+        name = match.group(1).lower()
+        if name in attrs:
+            continue
+        value = next((v for v in match.group(2, 3, 4) if v is not None), '')
+        attrs[name] = html_lib.unescape(value)
+    return attrs
+
+
+def get_text_strip(fragment):
+    # Mô phỏng get_text(strip=True) của BeautifulSoup: strip từng đoạn text rồi nối lại
+    fragment = SKIP_BLOCK_RE.sub('', fragment)
+    parts = (html_lib.unescape(part).strip() for part in TAG_RE.split(fragment))
+    return ''.join(part for part in parts if part)
+
+
+def find_h1_span_text(text):
+    """
+    Tìm span đầu tiên nằm trong h1.page-title (tương đương soup.select_one('h1.page-title span')).
+    Trả về text của span (có thể rỗng), hoặc None nếu không có span nào khớp.
+    """
+    for h1_match in H1_OPEN_RE.finditer(text):
+        classes = parse_attrs(h1_match.group(1)).get('class', '').split()
+        if 'page-title' not in classes:
+            continue
+
+        close_match = H1_CLOSE_RE.search(text, h1_match.end())
+        h1_end = close_match.start() if close_match else len(text)
+
+        # Tìm thẻ span mở đầu tiên rồi dò thẻ đóng tương ứng (có tính span lồng nhau)
+        depth = 0
+        span_start = None
+        for tag in SPAN_TAG_RE.finditer(text, h1_match.end(), h1_end):
+            is_close, self_closing = tag.group(1), tag.group(2)
+            if not is_close:
+                if self_closing:
+                    if span_start is None:
+                        return ''
+                    continue
+                if span_start is None:
+                    span_start = tag.end()
+                depth += 1
+            elif span_start is not None:
+                depth -= 1
+                if depth == 0:
+                    return get_text_strip(text[span_start:tag.start()])
+
+        if span_start is not None:
+            # Span không có thẻ đóng: lấy đến hết h1
+            return get_text_strip(text[span_start:h1_end])
+
+    return None
+
+
+def find_og_title(text):
+    # Tìm thẻ meta property="og:title" đầu tiên (tương đương soup.find('meta', property='og:title'))
+    for meta_match in META_RE.finditer(text):
+        attrs = parse_attrs(meta_match.group(1))
+        if attrs.get('property') == 'og:title':
+            return attrs.get('content')
+    return None
+
+
+def extract_title_soup(html):
+    # Logic gốc: dựng toàn bộ cây BeautifulSoup rồi tìm tên sản phẩm
+    soup = BeautifulSoup(html, "lxml")
+    product_name = UNKNOWN_NAME
+
+    h1_tag = soup.select_one('h1.page-title span')
+    if h1_tag:
+        text = h1_tag.get_text(strip=True)
+        if text: product_name = text
+
+    if product_name == UNKNOWN_NAME:
+        meta_tag = soup.find('meta', property='og:title')
+        if meta_tag:
+            content = meta_tag.get('content')
+            if content: product_name = content
+
+    return product_name
+
+
+def extract_title_fast(html):
+    """
+    Fast path bằng regex: dừng ngay khi tìm thấy tên, không dựng cây DOM.
+    Trả về None khi không tìm được thẻ nào khớp để bên gọi chuyển sang BeautifulSoup.
+    """
+    if isinstance(html, (bytes, bytearray)):
+        html = bytes(html).decode('utf-8', errors='replace')
+
+    span_text = find_h1_span_text(html)
+    if span_text:
+        return span_text
+
+    content = find_og_title(html)
+    if content:
+        return content
+
+    # Có h1.page-title hoặc og:title nhưng rỗng -> logic gốc cũng trả về Unknown name
+    if span_text is not None or content is not None:
+        return UNKNOWN_NAME
+
+    return None
+
+
+def extract_title_fast_with_fallback(html):
+    # Mặc định: thử fast path trước, chỉ dựng BeautifulSoup khi fast path không tìm thấy gì
+    product_name = extract_title_fast(html)
+    if product_name is None:
+        product_name = extract_title_soup(html)
+    return product_name
+
+
+# Danh sách extractor có thể chọn qua biến môi trường TITLE_EXTRACTOR
+EXTRACTORS = {
+    'fast': extract_title_fast_with_fallback,
+    'soup': extract_title_soup
+}
+
+TITLE_EXTRACTOR = os.environ.get('TITLE_EXTRACTOR', 'fast').lower()
+
+if TITLE_EXTRACTOR not in EXTRACTORS:
+    raise ValueError(f"LỖI: TITLE_EXTRACTOR '{TITLE_EXTRACTOR}' không hợp lệ. Chọn một trong: {list(EXTRACTORS)}")
+
+
+def extract_product_name(html, extractor=None):
+    # Hàm bóc tách tên sản phẩm từ HTML (str hoặc bytes), dùng extractor cấu hình trong TITLE_EXTRACTOR
+    return EXTRACTORS[extractor or TITLE_EXTRACTOR](html)
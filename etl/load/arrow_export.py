@@ -0,0 +1,347 @@
+import datetime
+import json
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bson import decode_all
+from bson.decimal128 import Decimal128
+from bson.int64 import Int64
+from bson.objectid import ObjectId
+
+# Các cột nghi ngờ dễ bị nhận nhầm thành số để ép thành string (giống standardlized_for_parquet)
+FORCE_STRING_COLS = ['cat_id', 'is_paypal']
+
+
+def iter_decoded_batches(src_collection, query, batch_size, projection=None):
+    """
+    Đọc collection theo từng batch BSON thô (find_raw_batches) và chỉ decode từng batch một,
+    nên bộ nhớ chỉ phụ thuộc vào kích thước 1 batch chứ không phải cả chunk.
+    Trả về từng cặp (docs, số byte BSON của batch) để chia part theo kích thước.
+    """
+    cursor = src_collection.find_raw_batches(query, projection, sort=[('_id', 1)], batch_size=batch_size)
+    try:
+        for raw_batch in cursor:
+            docs = decode_all(raw_batch)
+            if docs:
+                yield docs, len(raw_batch)
+    finally:
+        cursor.close()
+
+
+def normalize_value(value, nested=False):
+    """
+    Chuẩn hóa 1 giá trị BSON thành kiểu Python mà pyarrow hiểu được.
+    nested=False: list/dict -> chuỗi JSON. nested=True: giữ list/dict (chuẩn hóa đệ quy từng phần tử)
+    để ghi thành cột LIST/STRUCT.
+    """
+    # Int64 (số nguyên 64-bit của BSON) là lớp con của int -> đổi về int thường để infer_arrow_type nhận đúng kiểu
+    if isinstance(value, Int64):
+        return int(value)
+    if value is None or isinstance(value, (bool, int, float, str, datetime.datetime)):
+        return value
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (list, dict)):
+        if nested:
+            if isinstance(value, list):
+                return [normalize_value(v, True) for v in value]
+            return {str(k): normalize_value(v, True) for k, v in value.items()}
+        # Dữ liệu phức tạp (LIST/DICT) -> ép json thành string
+        return json.dumps(value, ensure_ascii=False, default=str)
+    if isinstance(value, bytes):
+        return value
+    return str(value)
+
+
+def infer_arrow_type(values):
+    # Đoán kiểu cột từ các giá trị (đã chuẩn hóa, bỏ qua None). Kiểu thập cẩm -> string
+    kinds = {type(v) for v in values if v is not None}
+
+    # Cột toàn None: chưa biết kiểu, để null (ghi vào part nào cũng được)
+    if not kinds:
+        return pa.null()
+    if kinds == {bool}:
+        return pa.bool_()
+    if kinds == {int}:
+        if all(-2 ** 63 <= v < 2 ** 63 for v in values if v is not None):
+            return pa.int64()
+        return pa.string()
+    if kinds <= {int, float}:
+        return pa.float64()
+    if kinds == {datetime.datetime}:
+        return pa.timestamp('ms')
+    if kinds == {bytes}:
+        return pa.binary()
+    if kinds == {list}:
+        # LIST: kiểu phần tử đoán từ toàn bộ phần tử của mọi ô
+        return pa.list_(infer_arrow_type([item for v in values if v is not None for item in v]))
+    if kinds == {dict}:
+        return infer_struct_type([v for v in values if v is not None])
+    return pa.string()
+
+
+def infer_struct_type(dicts):
+    # STRUCT: hợp các key của mọi ô (giữ thứ tự xuất hiện), key thiếu ở ô nào thì ô đó là null
+    keys = {}
+    for d in dicts:
+        for key in d:
+            keys.setdefault(key, None)
+
+    # Dict rỗng không ghi được thành STRUCT trong Parquet -> để null (sẽ ghi thành string)
+    if not keys:
+        return pa.null()
+    return pa.struct([pa.field(key, infer_arrow_type([d.get(key) for d in dicts])) for key in keys])
+
+
+def merge_types(left, right):
+    """
+    Gộp 2 kiểu của cùng 1 cột (giữa các batch/part) thành kiểu chung.
+    null + X -> X, int + float -> float, STRUCT gộp theo tên field, LIST gộp kiểu phần tử, còn lại lệch -> string.
+    """
+    if left == right:
+        return left
+    if pa.types.is_null(left):
+        return right
+    if pa.types.is_null(right):
+        return left
+    if {str(left), str(right)} == {'int64', 'double'}:
+        return pa.float64()
+    if pa.types.is_list(left) and pa.types.is_list(right):
+        return pa.list_(merge_types(left.value_type, right.value_type))
+    if pa.types.is_struct(left) and pa.types.is_struct(right):
+        fields = {f.name: f.type for f in left}
+        for f in right:
+            fields[f.name] = merge_types(fields[f.name], f.type) if f.name in fields else f.type
+        return pa.struct([pa.field(name, arrow_type) for name, arrow_type in fields.items()])
+    return pa.string()
+
+
+def to_string(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value)
+
+
+def coerce_value(value, arrow_type):
+    # Ép 1 giá trị lồng nhau theo kiểu đã gộp (lá lệch kiểu -> string, int trong cột float -> float)
+    if value is None:
+        return None
+    if pa.types.is_string(arrow_type):
+        return to_string(value)
+    if pa.types.is_list(arrow_type):
+        return [coerce_value(v, arrow_type.value_type) for v in value]
+    if pa.types.is_struct(arrow_type):
+        return {f.name: coerce_value(value.get(f.name), f.type) for f in arrow_type}
+    if pa.types.is_floating(arrow_type) and isinstance(value, int):
+        return float(value)
+    return value
+
+
+def docs_to_columns(docs, nested=False):
+    # Chuyển list document thành dict {tên cột: list giá trị đã chuẩn hóa}, giữ thứ tự cột xuất hiện
+    columns = {}
+    for row_idx, doc in enumerate(docs):
+        for key, value in doc.items():
+            if key not in columns:
+                columns[key] = [None] * row_idx
+            columns[key].append(normalize_value(value, nested))
+        for key, column in columns.items():
+            if len(column) <= row_idx:
+                column.append(None)
+
+    for col in FORCE_STRING_COLS:
+        if col in columns:
+            # Biến ô trống thành chuỗi rỗng và ép toàn bộ thành string
+            columns[col] = ['' if v is None else to_string(v) for v in columns[col]]
+
+    return columns
+
+
+def infer_schema(columns):
+    fields = []
+    for name, values in columns.items():
+        arrow_type = pa.string() if name in FORCE_STRING_COLS else infer_arrow_type(values)
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def to_part_type(arrow_type):
+    # Kiểu null (kể cả nằm trong LIST/STRUCT) không dùng được trên BigQuery -> ghi thành string
+    if pa.types.is_null(arrow_type):
+        return pa.string()
+    if pa.types.is_list(arrow_type):
+        return pa.list_(to_part_type(arrow_type.value_type))
+    if pa.types.is_struct(arrow_type):
+        return pa.struct([pa.field(f.name, to_part_type(f.type)) for f in arrow_type])
+    return arrow_type
+
+
+def to_part_schema(batch_schema):
+    # Schema dùng để mở file Parquet: cột chưa rõ kiểu (null) được ghi thành string
+    return pa.schema([pa.field(f.name, to_part_type(f.type)) for f in batch_schema])
+
+
+def is_compatible(batch_schema, part_schema):
+    # Batch ghi được vào part hiện tại nếu không có cột mới và không đổi kiểu
+    # (trừ khi part là string, hoặc batch int64 ghi vào part double)
+    for field in batch_schema:
+        if field.type == pa.null():
+            continue
+        idx = part_schema.get_field_index(field.name)
+        if idx == -1:
+            return False
+        part_type = part_schema.field(idx).type
+        if field.type == part_type or part_type == pa.string():
+            continue
+        if field.type == pa.int64() and part_type == pa.float64():
+            continue
+        return False
+    return True
+
+
+def widen_part_schema(batch_schema, part_schema):
+    # Part int64 gặp batch double: trả về schema part với các cột đó đổi thành double, None nếu không cần nới
+    fields = []
+    widened = False
+    for field in part_schema:
+        idx = batch_schema.get_field_index(field.name)
+        if idx != -1 and field.type == pa.int64() and batch_schema.field(idx).type == pa.float64():
+            field = pa.field(field.name, pa.float64())
+            widened = True
+        fields.append(field)
+    return pa.schema(fields) if widened else None
+
+
+def columns_to_record_batch(columns, schema):
+    # Dựng RecordBatch theo đúng schema của part: cột thiếu -> null, cột lệch kiểu -> ép string
+    num_rows = len(next(iter(columns.values()))) if columns else 0
+    arrays = []
+    for field in schema:
+        values = columns.get(field.name)
+        if values is None:
+            arrays.append(pa.nulls(num_rows, type=field.type))
+            continue
+        if field.type == pa.string():
+            values = [to_string(v) for v in values]
+        elif pa.types.is_nested(field.type) or pa.types.is_floating(field.type):
+            values = [coerce_value(v, field.type) for v in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def docs_to_record_batch(docs, schema=None):
+    """
+    Chuyển 1 batch document thành pyarrow RecordBatch có kiểu rõ ràng.
+    schema=None: tự suy ra schema từ batch. Trả về (record_batch, schema của batch).
+    """
+    columns = docs_to_columns(docs)
+    batch_schema = infer_schema(columns)
+    return columns_to_record_batch(columns, schema or to_part_schema(batch_schema)), batch_schema
+
+
+class MergedSchema:
+    """
+    Schema gộp của 1 collection cho chế độ giữ kiểu lồng nhau (LIST/STRUCT), lưu ra file cạnh checkpoint.
+    Mỗi batch mới được gộp vào (thêm cột/field mới, lệch kiểu -> string), schema chỉ mở rộng chứ không thu hẹp,
+    nên các part sau luôn đọc được bằng schema của part trước cộng thêm cột mới.
+    """
+
+    def __init__(self, schema_file):
+        self.schema_file = schema_file
+        self.schema = self._read() or pa.schema([])
+
+    def _read(self):
+        if os.path.exists(self.schema_file):
+            with open(self.schema_file, 'rb') as f:
+                return pa.ipc.read_schema(pa.py_buffer(f.read()))
+        return None
+
+    def _merge_schema(self, other):
+        fields = {f.name: f.type for f in self.schema}
+        for f in other:
+            fields[f.name] = merge_types(fields[f.name], f.type) if f.name in fields else f.type
+        return pa.schema([pa.field(name, arrow_type) for name, arrow_type in fields.items()])
+
+    def merge(self, batch_schema):
+        # Gộp schema của batch vào, trả về True nếu schema thay đổi (đã lưu lại file)
+        merged = self._merge_schema(batch_schema)
+        if merged.equals(self.schema):
+            return False
+
+        # Gộp thêm với file hiện tại (các process export song song có thể cùng cập nhật) rồi ghi đè an toàn
+        stored = self._read()
+        self.schema = merged
+        if stored is not None:
+            self.schema = self._merge_schema(stored)
+
+        tmp_file = self.schema_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(self.schema.serialize().to_pybytes())
+        os.replace(tmp_file, self.schema_file)
+        return True
+
+
+class ParquetPartWriter:
+    """
+    Ghi 1 file Parquet theo từng row group, không giữ cả chunk trong RAM.
+    row_group_rows=None: mỗi lần write là 1 row group. Có row_group_rows: gom các batch đủ số dòng rồi mới ghi.
+    sort_by: sắp xếp dòng trong từng row group trước khi ghi (VD: [('collection', 'ascending')]).
+    File chỉ được mở khi ghi row group đầu tiên, trước đó schema còn nới được (widen).
+    """
+
+    def __init__(self, where, schema, row_group_rows=None, sort_by=None, **writer_options):
+        # where: đường dẫn file hoặc file-like (buffer) đang mở để ghi
+        self.where = where
+        self.schema = schema
+        self.row_group_rows = row_group_rows
+        self.sort_by = [(col, order) for col, order in (sort_by or []) if col in schema.names]
+        self.rows = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._writer_options = writer_options
+        self._writer = None
+
+    @property
+    def pending_rows(self):
+        # Số dòng đang gom trong RAM, chưa ghi thành row group
+        return self._pending_rows
+
+    def _open(self):
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.where, self.schema, **self._writer_options)
+        return self._writer
+
+    def widen(self, schema):
+        # Đổi schema của part (VD: cột int64 -> double), chỉ được khi chưa có row group nào ghi ra file
+        if self._writer is not None:
+            return False
+        self._pending = pa.Table.from_batches(self._pending, schema=self.schema).cast(schema, safe=False).to_batches()
+        self.schema = schema
+        return True
+
+    def _flush(self):
+        if not self._pending:
+            return
+        table = pa.Table.from_batches(self._pending, schema=self.schema)
+        if self.sort_by:
+            table = table.sort_by(self.sort_by)
+        self._open().write_table(table, row_group_size=self.row_group_rows or table.num_rows)
+        self._pending = []
+        self._pending_rows = 0
+
+    def write(self, record_batch):
+        self._pending.append(record_batch)
+        self._pending_rows += record_batch.num_rows
+        self.rows += record_batch.num_rows
+        if self.row_group_rows is None or self._pending_rows >= self.row_group_rows:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self._open().close()
@@ -0,0 +1,210 @@
+import json
+import os
+import pandas as pd
+from pandas.api.types import infer_dtype
+
+# Các cột nghi ngờ dễ bị nhận nhầm thành số để ép thành string
+FORCE_STRING_COLS = ['cat_id', 'is_paypal']
+
+# Kiểu chuẩn hóa của từng cột (lưu trong file schema), xếp theo thứ tự "rộng dần":
+# native: để nguyên kiểu số/ngày tháng của pandas | binary: giữ nguyên bytes (cột BINARY trong Parquet, VD: ip_key)
+# string: ép thành chuỗi | json: list/dict -> chuỗi JSON
+KIND_NATIVE = 'native'
+KIND_BINARY = 'binary'
+KIND_STRING = 'string'
+KIND_JSON = 'json'
+KIND_FORCE_STRING = 'force_string'
+KIND_ORDER = {KIND_NATIVE: 0, KIND_BINARY: 1, KIND_STRING: 2, KIND_JSON: 3, KIND_FORCE_STRING: 4}
+
+# Encoder dùng chung cho cả cột: gọi thẳng encode() nhanh hơn json.dumps vì không phải dựng encoder mỗi ô
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, default=str)
+
+
+def standardlized_for_parquet(df):
+    # Cách chuẩn hóa cũ: đoán kiểu lại trên từng part, xử lý từng ô bằng Python (giữ lại để đối chiếu/benchmark)
+
+    for force_col in FORCE_STRING_COLS:
+        if force_col in df.columns:
+            # Biến ô trống thành chuỗi rỗng và ép toàn bộ thành string
+            df[force_col] = df[force_col].fillna('').astype(str)
+
+    for col in df.columns:
+        # Bỏ qua những cột vừa bị ép kiểu thủ công ở trên để đỡ tốn thời gian chạy lại
+        if col in FORCE_STRING_COLS:
+            continue
+
+        # Bỏ qua các cột đã là kiểu số/ngày tháng rõ ràng, chỉ xử lý cột 'object' (kiểu thập cẩm)
+        if df[col].dtype == 'object':
+
+            # TẠO MẶT NẠ LỌC: Chỉ tìm những ô KHÔNG BỊ TRỐNG
+            valid_mask = df[col].notna()
+
+            # Nếu cột trống dữ liệu, bỏ qua luôn
+            if not valid_mask.any():
+                continue
+
+            # Thay vì quét apply toàn bộ cột, ta chỉ lấy mẫu 100 dòng đầu có chứa data để đoán định dạng
+            sample_data = df.loc[valid_mask, col].head(100)
+            has_complex_type = sample_data.apply(lambda x: isinstance(x, (list, dict))).any()
+
+            # Nếu cột chứa dữ liệu phức tạp (LIST/DICT)
+            if has_complex_type:
+                processed_values = []
+
+                # Lấy ra đúng những ô CÓ DỮ LIỆU (bỏ qua ô trống) để mang đi xử lý
+                data_to_process = df.loc[valid_mask, col]
+
+                # Lặp qua từng ô để xử lý kiểu dữ liệu
+                for x in data_to_process:
+                    if isinstance(x, (list, dict)):
+                        # Nếu là mảng -> ép json biến thành string
+                        json_str = json.dumps(x, ensure_ascii=False)
+                        processed_values.append(json_str)
+
+                    else:
+                        # Nếu chỉ là số hoặc chữ -> Ép thành string
+                        obj_str = str(x)
+                        processed_values.append(obj_str)
+
+                # Lấy toàn bộ kết quả đã xử lý đè ngược lại vào bảng DataFrame
+                df.loc[valid_mask, col] = processed_values
+
+            # Nếu cột chứa dữ liệu đơn giản
+            else:
+                df.loc[valid_mask, col] = df.loc[valid_mask, col].astype(str)
+
+    return df
+
+
+def is_complex(series):
+    # Mask các ô là list/dict (type() là hàm C nên map nhanh hơn nhiều so với apply(isinstance))
+    return series.map(type).isin((list, dict))
+
+
+def infer_column_kind(series):
+    # Đoán kiểu chuẩn hóa của 1 cột. Trả về None nếu cột toàn ô trống (chưa đủ thông tin)
+    if series.name in FORCE_STRING_COLS:
+        return KIND_FORCE_STRING
+    if series.dtype != 'object':
+        return KIND_NATIVE
+
+    inferred = infer_dtype(series, skipna=True)
+    if inferred == 'empty':
+        return None
+    if inferred == 'string':
+        return KIND_STRING
+    if inferred == 'bytes':
+        return KIND_BINARY
+
+    return KIND_JSON if is_complex(series).any() else KIND_STRING
+
+
+def encode_column(series):
+    """
+    Ép cột về string trong 1 lượt duyệt các ô có dữ liệu: list/dict -> chuỗi JSON, giá trị khác -> str,
+    ô trống giữ nguyên. Dùng chung cho kiểu string và json (cột string không có list/dict thì 2 kiểu cho cùng kết quả).
+    Trả về (Series mới, cột có ô list/dict hay không) để nới schema string -> json mà không phải quét lại cột.
+    """
+    # Cột chuỗi của pandas (StringDtype) đã đúng kiểu, không cần duyệt
+    if series.dtype != 'object' and pd.api.types.is_string_dtype(series.dtype):
+        return series, False
+
+    # Cột object toàn chuỗi (pandas < 3): kiểm tra bằng infer_dtype (C) nhanh hơn duyệt từng ô bằng Python
+    if infer_dtype(series, skipna=True) in ('string', 'empty'):
+        return series, False
+
+    mask = series.notna().to_numpy()
+    values = series.to_numpy(dtype=object, copy=True)
+    encode = JSON_ENCODER.encode
+    has_complex = False
+    encoded = []
+    for value in values[mask]:
+        value_type = type(value)
+        if value_type is str:
+            encoded.append(value)
+        elif value_type is list or value_type is dict:
+            has_complex = True
+            encoded.append(encode(value))
+        else:
+            encoded.append(str(value))
+    values[mask] = encoded
+    return pd.Series(values, index=series.index, name=series.name, dtype=object), has_complex
+
+
+class ColumnSchema:
+    """
+    Schema chuẩn hóa theo từng collection ({cột: kiểu}), đoán 1 lần rồi lưu vào file JSON cạnh checkpoint.
+    Các part sau dùng lại schema thay vì lấy mẫu đoán lại, nên kiểu cột giữ ổn định giữa các part.
+    Cột mới hoặc cột đổi sang kiểu rộng hơn (VD: native -> string, string -> json) sẽ được cập nhật vào file.
+    """
+
+    def __init__(self, schema_file):
+        self.schema_file = schema_file
+        self.columns = self._read()
+
+    def _read(self):
+        if os.path.exists(self.schema_file):
+            with open(self.schema_file, 'r') as f:
+                return json.load(f).get('columns', {})
+        return {}
+
+    def _merge(self, col, kind):
+        # Chỉ nới rộng kiểu, không bao giờ thu hẹp lại
+        current = self.columns.get(col)
+        if kind is not None and (current is None or KIND_ORDER[kind] > KIND_ORDER[current]):
+            self.columns[col] = kind
+            return True
+        return False
+
+    def save(self):
+        # Gộp với file hiện tại (các process export song song có thể cùng cập nhật) rồi ghi đè an toàn
+        for col, kind in self._read().items():
+            self._merge(col, kind)
+
+        tmp_file = self.schema_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'columns': self.columns}, f, indent=2)
+        os.replace(tmp_file, self.schema_file)
+
+    def _resolve_kind(self, series):
+        kind = self.columns.get(series.name)
+
+        # Cột mới hoặc cột native nhưng part này lại có dữ liệu thập cẩm -> đoán lại
+        if kind is None or (kind == KIND_NATIVE and series.dtype == 'object'):
+            return infer_column_kind(series)
+
+        # Cột binary nhưng part này có giá trị không phải bytes -> đoán lại (nới thành string/json)
+        if kind == KIND_BINARY and infer_dtype(series, skipna=True) not in ('bytes', 'empty'):
+            return infer_column_kind(series)
+
+        # Các kiểu còn lại tin theo schema, không quét lại cột (string gặp list/dict được nới khi encode)
+        return kind
+
+    def normalize(self, df):
+        # Chuẩn hóa DataFrame theo schema, trả về DataFrame mới (không sửa từng ô qua df.loc)
+        changed = False
+        normalized = {}
+
+        for col in df.columns:
+            series = df[col]
+            kind = self._resolve_kind(series)
+            changed = self._merge(col, kind) or changed
+            kind = self.columns.get(col)
+
+            if kind == KIND_FORCE_STRING:
+                # Biến ô trống thành chuỗi rỗng và ép toàn bộ thành string
+                series = series.fillna('').astype(str)
+            elif kind == KIND_BINARY:
+                pass
+            elif kind in (KIND_STRING, KIND_JSON) or (kind == KIND_NATIVE and series.dtype == 'object'):
+                series, has_complex = encode_column(series)
+                # Cột string nhưng part này xuất hiện list/dict -> nới thành json
+                if has_complex:
+                    changed = self._merge(col, KIND_JSON) or changed
+
+            normalized[col] = series
+
+        if changed:
+            self.save()
+
+        return pd.DataFrame(normalized, index=df.index)
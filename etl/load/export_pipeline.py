@@ -0,0 +1,186 @@
+import logging
+import os
+import queue
+import threading
+
+PIPELINE_QUEUE_SIZE = 2 # Số phần tử tối đa chờ giữa 2 tầng (giới hạn RAM/đĩa tạm khi tầng sau chậm)
+_DONE = object() # Đánh dấu tầng trước đã hết dữ liệu
+
+
+class PipelineStopped(Exception):
+    # Dừng 1 tầng vì tầng khác đã lỗi
+    pass
+
+
+def discard_part(part):
+    # Bỏ part chưa upload (pipeline bị hủy giữa chừng), lần sau sẽ chạy lại từ checkpoint
+    buffer = part.get('buffer')
+    if buffer is not None:
+        buffer.close()
+
+    local_filename = part.get('local_filename')
+    if local_filename and os.path.exists(local_filename):
+        os.remove(local_filename)
+
+
+class InlineExportPipeline:
+    """
+    Chạy tuần tự read -> encode -> upload -> checkpoint trong cùng 1 luồng (cách cũ).
+    encoder: có feed(item) / finish() trả về list part đã ghi xong, abort() dọn part ghi dở.
+    upload(part): đẩy part lên GCS. commit(part): ghi checkpoint sau khi upload thành công.
+    """
+
+    def __init__(self, encoder, upload, commit):
+        self.encoder = encoder
+        self.upload = upload
+        self.commit = commit
+
+    def _ship(self, parts):
+        for part in parts:
+            self.upload(part)
+            self.commit(part)
+
+    def put(self, item):
+        self._ship(self.encoder.feed(item))
+
+    def close(self):
+        self._ship(self.encoder.finish())
+
+    def abort(self):
+        self.encoder.abort()
+
+
+class ThreadedExportPipeline:
+    """
+    Pipeline 3 tầng read -> encode -> upload chạy chồng lên nhau:
+    - Luồng gọi put() (đọc MongoDB) đẩy dữ liệu vào encode_queue.
+    - Luồng encode ghi Parquet, đẩy part đã xong vào upload_queue.
+    - Luồng upload đẩy part lên GCS, upload xong mới ghi checkpoint.
+    Mỗi tầng chỉ có 1 luồng nên part được upload và checkpoint đúng thứ tự, giữ nguyên ngữ nghĩa resume.
+    2 queue đều giới hạn kích thước: tầng sau chậm thì tầng trước phải chờ.
+    """
+
+    def __init__(self, encoder, upload, commit, queue_size=PIPELINE_QUEUE_SIZE):
+        self.encoder = encoder
+        self.upload = upload
+        self.commit = commit
+
+        self.encode_queue = queue.Queue(maxsize=queue_size)
+        self.upload_queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._error = None
+
+        self._encode_thread = threading.Thread(target=self._encode_loop, name='export-encode', daemon=True)
+        self._upload_thread = threading.Thread(target=self._upload_loop, name='export-upload', daemon=True)
+        self._encode_thread.start()
+        self._upload_thread.start()
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _put(self, q, item):
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q):
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+    def _encode_loop(self):
+        try:
+            while True:
+                item = self._get(self.encode_queue)
+                parts = self.encoder.finish() if item is _DONE else self.encoder.feed(item)
+                for part in parts:
+                    self._put(self.upload_queue, part)
+                if item is _DONE:
+                    self._put(self.upload_queue, _DONE)
+                    return
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            logging.error(f"Lỗi ở tầng encode: {e}")
+            self._fail(e)
+        finally:
+            if self._stop.is_set():
+                self.encoder.abort()
+
+    def _upload_loop(self):
+        try:
+            while True:
+                part = self._get(self.upload_queue)
+                if part is _DONE:
+                    return
+                try:
+                    self.upload(part)
+                except Exception:
+                    discard_part(part)
+                    raise
+                self.commit(part)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            logging.error(f"Lỗi ở tầng upload: {e}")
+            self._fail(e)
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def put(self, item):
+        # Gọi từ luồng đọc MongoDB: chờ nếu tầng encode đang bận, báo lỗi ngay nếu tầng sau đã hỏng
+        try:
+            self._put(self.encode_queue, item)
+        except PipelineStopped:
+            self._raise_if_failed()
+            raise
+
+    def _join(self):
+        self._encode_thread.join()
+        self._upload_thread.join()
+
+        # Dọn các part đã encode nhưng chưa kịp upload
+        while True:
+            try:
+                part = self.upload_queue.get_nowait()
+            except queue.Empty:
+                break
+            if part is not _DONE:
+                discard_part(part)
+
+    def close(self):
+        # Báo hết dữ liệu, chờ 2 tầng sau chạy xong
+        try:
+            self._put(self.encode_queue, _DONE)
+        except PipelineStopped:
+            pass
+        self._join()
+        self._raise_if_failed()
+
+    def abort(self):
+        # Luồng đọc bị lỗi: dừng các tầng sau, bỏ các part chưa upload
+        self._stop.set()
+        self._join()
+
+
+PIPELINE_MODES = {
+    'inline': InlineExportPipeline,
+    'threaded': ThreadedExportPipeline
+}
+
+
+def create_pipeline(mode, encoder, upload, commit):
+    return PIPELINE_MODES[mode](encoder, upload, commit)
@@ -0,0 +1,128 @@
+import json
+import os
+
+# Cấu hình layout Parquet theo từng collection:
+# - target_file_mb: kích thước file Parquet mong muốn, ngưỡng chính để chốt part (None = chỉ chốt theo chunk_rows)
+# - chunk_rows: số dòng tối đa mỗi part (giới hạn phụ, giống CHUNK_SIZE cũ). Engine pandas giữ cả chunk trong RAM
+#   nên đây cũng là giới hạn bộ nhớ; engine arrow ghi theo row group nên chỉ dùng khi không có target_file_mb
+# - max_input_mb: số byte BSON tối đa được giữ trong RAM chờ ghi (chunk của engine pandas, row group của engine arrow)
+# - row_group_rows: số dòng mỗi row group (None = mặc định của pyarrow/mỗi batch 1 row group)
+# - compression / compression_level: codec nén (snappy, zstd, lz4, gzip...) và mức nén
+# - dictionary_columns: các cột bật dictionary encoding (None = để pyarrow tự bật cho mọi cột)
+# - sort_by: sắp xếp dòng trong từng row group trước khi ghi, giúp nén tốt hơn và lọc nhanh hơn trên BigQuery
+# - projection: projection MongoDB khi đọc collection (None = lấy cả document). Chỉ dùng dạng loại bỏ field
+#   ({field: 0}) để _id luôn được trả về (checkpoint và chia partition dựa vào _id)
+DEFAULT_PROFILE = {
+    'chunk_rows': 250000,
+    'target_file_mb': 128,
+    'max_input_mb': 512,
+    'row_group_rows': None,
+    'compression': 'snappy',
+    'compression_level': None,
+    'dictionary_columns': None,
+    'sort_by': None,
+    'projection': None
+}
+
+EXPORT_PROFILES = {
+    # Event hành vi: nhiều cột lặp lại giá trị (loại event, store, thiết bị...) -> dictionary + zstd, sắp theo loại event
+    'raw_data': {
+        'chunk_rows': 250000, # Giữ chunk của engine pandas như mặc định, part của engine arrow lớn dần theo target_file_mb
+        'target_file_mb': 256,
+        'row_group_rows': 100000,
+        'compression': 'zstd',
+        'compression_level': 3,
+        'dictionary_columns': ['collection', 'store_id', 'api_version', 'resolution', 'currency',
+                               'show_recommendation', 'user_agent', 'referrer_url', 'is_paypal', 'cat_id'],
+        'sort_by': [('collection', 'ascending'), ('time_stamp', 'ascending')]
+    },
+    # Bảng IP: ít cột, giá trị địa lý lặp lại nhiều. Layout compact/ranges (IP_LAYOUT) chỉ còn khóa IP nhị phân + geo_id
+    'ip_locations': {
+        'chunk_rows': 2000000,
+        'target_file_mb': 128,
+        'row_group_rows': 250000,
+        'compression': 'zstd',
+        'compression_level': 6,
+        'dictionary_columns': ['country_short', 'country_long', 'region', 'city'],
+        'sort_by': [('country_short', 'ascending'), ('region', 'ascending'), ('geo_id', 'ascending')]
+    },
+    # Bảng địa điểm của layout compact/ranges: vài nghìn dòng, mỗi địa điểm 1 dòng
+    'ip_places': {
+        'compression': 'zstd',
+        'compression_level': 6,
+        'sort_by': [('geo_id', 'ascending')]
+    },
+    'product_names': {
+        'compression': 'zstd',
+        'compression_level': 3
+    }
+}
+
+
+def load_profile_overrides(profiles_file):
+    # File JSON {collection: {tham số: giá trị}} để chỉnh profile mà không sửa code
+    if profiles_file and os.path.exists(profiles_file):
+        with open(profiles_file, 'r') as f:
+            return json.load(f)
+    return {}
+
+
+def get_export_profile(collection, overrides=None):
+    # Profile của collection = mặc định <- profile có sẵn <- override từ file
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(EXPORT_PROFILES.get(collection, {}))
+    profile.update((overrides or {}).get(collection, {}))
+    if profile['sort_by']:
+        profile['sort_by'] = [tuple(key) for key in profile['sort_by']]
+    return profile
+
+
+def writer_options(profile, column_names):
+    # Tham số cho ParquetWriter/write_table theo profile, chỉ giữ cột dictionary có trong schema
+    options = {'compression': profile['compression']}
+    if profile['compression_level'] is not None:
+        options['compression_level'] = profile['compression_level']
+    if profile['dictionary_columns'] is not None:
+        options['use_dictionary'] = [col for col in profile['dictionary_columns'] if col in column_names]
+    return options
+
+
+def sort_keys(profile, column_names):
+    # Bỏ các cột sắp xếp không có trong part (VD: collection không có time_stamp)
+    return [(col, order) for col, order in (profile['sort_by'] or []) if col in column_names]
+
+
+class PartSizer:
+    """
+    Quyết định thời điểm chốt part theo số byte thay vì số dòng, vì độ rộng document khác nhau giữa các collection.
+    Kích thước file dự kiến = byte đã thực sự ghi ra file + byte BSON đầu vào chưa ghi x tỉ lệ nén
+    (byte Parquet / byte BSON) đo trên các part đã ghi (bình quân trượt, part đầu tiên coi như 1).
+    chunk_rows chỉ còn là giới hạn phụ, max_input_mb giới hạn RAM giữ dữ liệu chờ ghi.
+    row_cap=False (engine arrow): bỏ giới hạn chunk_rows khi đã có target_file_mb, part lớn dần theo kích thước.
+    """
+
+    def __init__(self, profile, row_cap=True):
+        self.target_bytes = profile['target_file_mb'] * 1024 * 1024 if profile['target_file_mb'] else None
+        self.max_rows = profile['chunk_rows'] if row_cap or self.target_bytes is None else None
+        self.max_input_bytes = profile['max_input_mb'] * 1024 * 1024 if profile['max_input_mb'] else None
+        self.ratio = None
+
+    def estimated_size(self, pending_input_bytes, written_bytes=0):
+        return written_bytes + pending_input_bytes * (self.ratio or 1.0)
+
+    def should_cut(self, rows, pending_input_bytes, written_bytes=0):
+        # rows: số dòng của part, pending_input_bytes: byte BSON còn giữ trong RAM, written_bytes: byte đã ghi ra file
+        if self.max_rows and rows >= self.max_rows:
+            return True
+        if self.max_input_bytes and pending_input_bytes >= self.max_input_bytes:
+            return True
+        return self.target_bytes is not None and \
+            self.estimated_size(pending_input_bytes, written_bytes) >= self.target_bytes
+
+    def observe(self, input_bytes, size_bytes):
+        # Cập nhật tỉ lệ nén từ 1 part đã ghi xong
+        if not input_bytes or not size_bytes:
+            return
+
+        observed = size_bytes / input_bytes
+        self.ratio = observed if self.ratio is None else 0.5 * self.ratio + 0.5 * observed
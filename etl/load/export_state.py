@@ -0,0 +1,133 @@
+import datetime
+import glob
+import json
+import os
+from bson.objectid import ObjectId
+
+
+def write_json(filename, data):
+    # Ghi file tạm rồi đổi tên để không bao giờ để lại file state ghi dở
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_file, filename)
+
+
+def read_json(filename):
+    if os.path.exists(filename):
+        with open(filename, 'r') as f:
+            return json.load(f)
+    return None
+
+
+def append_part_record(checkpoint_path, part_prefix, record):
+    # Ghi thêm 1 dòng vào log các part đã upload của 1 part_prefix (mỗi process chỉ ghi file của mình)
+    parts_file = os.path.join(checkpoint_path, f"{part_prefix}_parts.jsonl")
+    with open(parts_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_part_records(checkpoint_path, run_key):
+    # Gom log part của 1 lượt chạy (gồm cả các partition {run_key}_p{i}), sắp xếp theo tên blob
+    records = []
+    for parts_file in glob.glob(os.path.join(checkpoint_path, f"{run_key}*_parts.jsonl")):
+        with open(parts_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                # Dòng cuối không có ký tự xuống dòng là dòng ghi dở -> bỏ
+                if line.endswith('\n') and line.strip():
+                    records.append(json.loads(line))
+    return sorted(records, key=lambda r: r['name'])
+
+
+def remove_run_files(checkpoint_path, run_key):
+    # Dọn checkpoint, log part và kế hoạch partition của 1 lượt chạy đã hoàn tất
+    for pattern in (f"{run_key}*_checkpoint.json", f"{run_key}*_parts.jsonl", f"{run_key}_partitions.json"):
+        for filename in glob.glob(os.path.join(checkpoint_path, pattern)):
+            os.remove(filename)
+
+
+class IncrementalState:
+    """
+    Trạng thái export tăng dần của 1 collection, lưu trong thư mục checkpoints:
+    - {collection}_hwm.json: high-water mark (_id lớn nhất đã xuất xong), giữ qua các lần chạy.
+    - {collection}_run.json: lượt chạy đang dở (run_id, thư mục ngày, khoảng _id). Bị ngắt giữa chừng thì
+      lần sau chạy tiếp đúng lượt đó (cùng khoảng _id, cùng thư mục GCS) thay vì mở lượt mới.
+    Mỗi lượt chỉ xuất các document có _id trong (high-water mark, _id lớn nhất lúc bắt đầu lượt].
+    Lượt snapshot (replace=True) bỏ qua high-water mark và xuất lại cả collection.
+    """
+
+    def __init__(self, checkpoint_path, collection):
+        self.checkpoint_path = checkpoint_path
+        self.collection = collection
+        self.hwm_file = os.path.join(checkpoint_path, f"{collection}_hwm.json")
+        self.run_file = os.path.join(checkpoint_path, f"{collection}_run.json")
+
+    def get_high_water_mark(self):
+        data = read_json(self.hwm_file)
+        return ObjectId(data['last_id']) if data and data.get('last_id') else None
+
+    def seed(self, last_id):
+        # Lần đầu chuyển từ chế độ full: lấy last_id của checkpoint full làm high-water mark ban đầu
+        write_json(self.hwm_file, {
+            'last_id': str(last_id),
+            'runs': 0,
+            'updated_at': datetime.datetime.now(datetime.timezone.utc).isoformat()
+        })
+
+    def get_run(self):
+        return read_json(self.run_file)
+
+    def start_run(self, src_collection, snapshot=False):
+        """
+        Trả về lượt chạy cần xử lý: lượt đang dở nếu có, nếu không thì mở lượt mới.
+        Trả về None nếu không có dữ liệu mới kể từ high-water mark.
+        snapshot=True: lượt mới xuất toàn bộ collection (không có cận dưới), manifest đánh dấu replace.
+        """
+        run = self.get_run()
+        if run is not None:
+            return run
+
+        # Chốt cận trên trước khi quét để document được ghi trong lúc export thuộc về lượt sau
+        latest = src_collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+        lower = None if snapshot else self.get_high_water_mark()
+        if latest is None or (lower is not None and latest['_id'] <= lower):
+            return None
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        run = {
+            'run_id': now.strftime('%Y%m%dT%H%M%S'),
+            'dt': now.strftime('%Y-%m-%d'),
+            'lower': str(lower) if lower else None,
+            'upper': str(latest['_id']),
+            'replace': snapshot,
+            'started_at': now.isoformat()
+        }
+        write_json(self.run_file, run)
+        return run
+
+    @staticmethod
+    def run_range(run):
+        # Khoảng _id của lượt chạy dạng điều kiện MongoDB
+        id_range = {'$lte': ObjectId(run['upper'])}
+        if run.get('lower'):
+            id_range['$gt'] = ObjectId(run['lower'])
+        return id_range
+
+    def run_key(self, run):
+        # Tiền tố dùng cho checkpoint và tên file part của lượt chạy
+        return f"{self.collection}_{run['run_id']}"
+
+    def finish_run(self, run, rows):
+        # Lượt chạy xong: nâng high-water mark lên cận trên của lượt, xóa state của lượt
+        data = read_json(self.hwm_file) or {}
+        write_json(self.hwm_file, {
+            'last_id': run['upper'],
+            'last_run_id': run['run_id'],
+            'last_run_rows': rows,
+            'runs': data.get('runs', 0) + 1,
+            'updated_at': datetime.datetime.now(datetime.timezone.utc).isoformat()
+        })
+        os.remove(self.run_file)
+        remove_run_files(self.checkpoint_path, self.run_key(run))
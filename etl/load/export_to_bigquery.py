@@ -1,12 +1,18 @@
 import os
+import json
 import logging
-from google.cloud import bigquery
+from google.cloud import bigquery, storage
+from google.api_core.exceptions import NotFound
+from google.cloud.bigquery.format_options import ParquetOptions
 from src.get_data_from_env import get_filename
 from dotenv import load_dotenv
+from etl.transform.ip_layout import IP_LAYOUT, PLACES_COLLECTION, layout_collections
 import time
 
-COLLECTIONS = ["product_names", "raw_data", "ip_locations"]
+# Layout compact/ranges của ip_locations (IP_LAYOUT) nạp thêm bảng địa điểm ip_places
+COLLECTIONS = layout_collections(["product_names", "raw_data", "ip_locations"])
 DATASET = "raw_layer"
+IP_VIEW = "ip_locations_resolved" # View trả ip_locations layout compact/ranges về dạng đọc được (chuỗi IP + tên địa điểm)
 
 # Cấu hình Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -28,6 +34,14 @@ else:
 
 bucket_name = os.environ.get('BUCKET_NAME')
 
+# Chế độ nạp (giống EXPORT_MODE của export_to_gcs):
+# - 'full': nạp lại toàn bộ raw/<collection>/*.parquet với WRITE_TRUNCATE (mặc định)
+# - 'incremental': chỉ nạp các part trong manifest chưa nạp, MERGE theo _id vào bảng đích
+LOAD_MODE = os.environ.get('EXPORT_MODE', 'full').lower()
+
+if LOAD_MODE not in ('full', 'incremental'):
+    raise ValueError(f"LỖI: EXPORT_MODE '{LOAD_MODE}' không hợp lệ. Chọn 'full' hoặc 'incremental'")
+
 if not bucket_name:
     raise ValueError("LỖI: Biến BUCKET_NAME chưa được khai báo trong file .env")
 
@@ -47,6 +61,121 @@ else:
     logging.info("Không tìm thấy File JSON. Sẽ sử dụng quyền mặc định của VM.")
 
 
+def get_parquet_options():
+    # Cột LIST trong Parquet (chế độ EXPORT_NESTED='preserve') được nạp thành ARRAY thay vì STRUCT lồng "list.element"
+    parquet_options = ParquetOptions()
+    parquet_options.enable_list_inference = True
+    return parquet_options
+
+def list_pending_manifests(bucket, collection):
+    # Các manifest (raw/<collection>/dt=.../_manifest_<run_id>.json) chưa có dấu đã nạp, theo thứ tự run_id
+    manifests = {}
+    loaded = set()
+    for blob in bucket.list_blobs(prefix=f"raw/{collection}/"):
+        file_name = blob.name.split("/")[-1]
+        if file_name.startswith("_manifest_") and file_name.endswith(".json"):
+            manifests[file_name[len("_manifest_"):-len(".json")]] = blob
+        elif blob.name.startswith(f"raw/{collection}/_loaded/"):
+            loaded.add(file_name)
+
+    return [manifests[run_id] for run_id in sorted(manifests) if run_id not in loaded]
+
+def load_manifest(client, bucket, collection, manifest_blob):
+    # Nạp các part của 1 manifest vào bảng tạm, rồi tạo mới hoặc MERGE theo _id vào bảng đích
+    # Manifest snapshot (replace=True, VD: ip_locations bị ghi lại) chứa cả bảng -> nạp đè bằng WRITE_TRUNCATE
+    manifest = json.loads(manifest_blob.download_as_bytes())
+    run_id = manifest['run_id']
+    uris = [f"gs://{bucket_name}/{part['name']}" for part in manifest['parts']]
+
+    target_table = f"{client.project}.{DATASET}.{collection}"
+    temp_table = f"{client.project}.{DATASET}.{collection}_temp_{run_id}"
+
+    if uris and manifest.get('replace'):
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE, # Xóa bảng cũ, đè bằng snapshot mới
+            autodetect=True
+        )
+        job_config.parquet_options = get_parquet_options()
+        client.load_table_from_uri(uris, target_table, job_config=job_config).result()
+    elif uris:
+        try:
+            target_schema = client.get_table(target_table).schema
+        except NotFound:
+            target_schema = None
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE # Tạo dữ liệu bảng temp mới
+        )
+        job_config.parquet_options = get_parquet_options()
+
+        # Nếu bảng đích đã có, ép Schema của bảng tạm y hệt bảng đích
+        if target_schema is not None:
+            job_config.schema = target_schema
+        else:
+            job_config.autodetect = True
+
+        try:
+            client.load_table_from_uri(uris, temp_table, job_config=job_config).result()
+
+            if target_schema is None:
+                query = f"CREATE TABLE `{target_table}` AS SELECT * FROM `{temp_table}`"
+            else:
+                # Nạp lại cùng 1 manifest (VD: lần trước lỗi sau khi MERGE) cũng không tạo dòng trùng
+                query = f"""
+                        MERGE `{target_table}` tgt
+                        USING `{temp_table}` tmp
+                        ON tgt._id = tmp._id
+                        WHEN NOT MATCHED THEN
+                          INSERT ROW """
+            client.query(query).result()
+        finally:
+            client.delete_table(temp_table, not_found_ok=True)
+
+    # Đánh dấu manifest đã nạp để lần sau bỏ qua
+    bucket.blob(f"raw/{collection}/_loaded/{run_id}").upload_from_string(
+        json.dumps({'rows': manifest.get('total_rows', 0), 'parts': len(uris)}))
+    logging.info(f"Đã nạp manifest {run_id}: {len(uris)} part, {manifest.get('total_rows', 0)} dòng.")
+
+def load_incremental(client, bucket, collection):
+    manifests = list_pending_manifests(bucket, collection)
+    if not manifests:
+        logging.info(f"Không có manifest mới cho bảng {collection}.")
+        return
+
+    for manifest_blob in manifests:
+        load_manifest(client, bucket, collection, manifest_blob)
+
+    destination_table = client.get_table(f"{client.project}.{DATASET}.{collection}")
+    logging.info(f"THÀNH CÔNG! Bảng {collection} hiện có {destination_table.num_rows} dòng.")
+
+def build_ip_view_query(project, layout=IP_LAYOUT):
+    # View nối ip_locations với ip_places theo geo_id, đổi khóa IP nhị phân về chuỗi
+    locations = f"`{project}.{DATASET}.ip_locations`"
+    places = f"`{project}.{DATASET}.{PLACES_COLLECTION}`"
+    if layout == 'compact':
+        columns = "l.ip_key, NET.IP_TO_STRING(l.ip_key) AS ip"
+    else:
+        # Tra 1 IP: NET.SAFE_IP_FROM_STRING(ip) BETWEEN ip_from AND ip_to AND BYTE_LENGTH(ip_from) = BYTE_LENGTH(...)
+        columns = "l.ip_from, l.ip_to, NET.IP_TO_STRING(l.ip_from) AS ip_from_str, NET.IP_TO_STRING(l.ip_to) AS ip_to_str"
+
+    return f"""
+            CREATE OR REPLACE VIEW `{project}.{DATASET}.{IP_VIEW}` AS
+            SELECT {columns}, l.geo_id, p.country_short, p.country_long, p.region, p.city
+            FROM {locations} l
+            JOIN {places} p USING (geo_id)"""
+
+def create_ip_view(client):
+    # Chỉ cần với layout compact/ranges, layout document đã có sẵn tên địa điểm trong ip_locations
+    if IP_LAYOUT == 'document':
+        return
+    try:
+        client.query(build_ip_view_query(client.project)).result()
+        logging.info(f"Đã tạo view {DATASET}.{IP_VIEW} cho ip_locations layout {IP_LAYOUT}.")
+    except Exception as e:
+        logging.error(f"Lỗi tạo view {IP_VIEW}: {e}")
+
 def export_to_bigquery():
     start_time = time.time()
 
@@ -55,6 +184,9 @@ def export_to_bigquery():
         # Kết nối với BigQuery xác thực bằng file json gcp_key
         client = bigquery.Client()
 
+        # Chế độ incremental cần đọc manifest trên GCS
+        bucket = storage.Client().bucket(bucket_name)
+
         logging.info(f"Đã kết nối BigQuery! Project ID đang dùng: {client.project}")
     except Exception as e:
         logging.error(f"Lỗi khởi tạo kết nối: {e}")
@@ -64,8 +196,16 @@ def export_to_bigquery():
     for collection in COLLECTIONS:
         logging.info(f"\n========== ĐANG LOAD DỮ LIỆU BẢNG: {collection.upper()} ==========")
 
-        # Đường dẫn Nguồn: Trỏ đến toàn bộ file parquet của bảng tương ứng trên GCS
-        gcs_uri = f"gs://{bucket_name}/raw/{collection}/*.parquet"
+        if LOAD_MODE == 'incremental':
+            try:
+                load_incremental(client, bucket, collection)
+            except Exception as e:
+                logging.error(f"Lỗi nghiêm trọng khi nạp bảng {collection}: {e}")
+            continue
+
+        # Đường dẫn Nguồn: Trỏ đến toàn bộ file parquet của chế độ full (<collection>_part_x, <collection>_p<i>_part_x)
+        # Wildcard GCS khớp cả dấu "/", nên phải bắt đầu bằng tên collection để không lấy part incremental trong dt=.../
+        gcs_uri = f"gs://{bucket_name}/raw/{collection}/{collection}_*.parquet"
 
         # Đường dẫn Đích
         table = f"{client.project}.{DATASET}.{collection}"
@@ -77,6 +217,8 @@ def export_to_bigquery():
             autodetect=True
         )
 
+        job_config.parquet_options = get_parquet_options()
+
         try:
             # Kích hoạt tiến trình LoadJob
             load_job = client.load_table_from_uri(
@@ -93,6 +235,8 @@ def export_to_bigquery():
         except Exception as e:
             logging.error(f"Lỗi nghiêm trọng khi nạp bảng {collection}: {e}")
 
+    create_ip_view(client)
+
     logging.info(f"Tổng thời gian nạp BigQuery: {time.time() - start_time:.2f}s ({(time.time() - start_time) / 60:.2f} phút)")
 
 if __name__ == "__main__":
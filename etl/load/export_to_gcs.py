@@ -3,15 +3,30 @@ import logging
 import json
 import pandas as pd
 from google.cloud import storage
-from config.get_mongo_connection import get_database, close_connection
+from config.get_mongo_connection import get_database, get_batch_size, close_connection
 from src.get_data_from_env import get_filename
 from dotenv import load_dotenv
 import time
+import datetime
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from bson.objectid import ObjectId
-
-COLLECTIONS = ["product_names", "raw_data", "ip_locations"]
-CHUNK_SIZE = 250000 # Lượng data đạt ngưỡng để đẩy lên GCP
-BATCH_SIZE = 5000 # Lượng data lấy từ MongoDB mỗi lần
+from etl.load.partition_planner import plan_partitions
+from etl.load.local_storage import LocalStorageClient
+from etl.load.export_state import IncrementalState, append_part_record, read_part_records
+from etl.load.column_schema import ColumnSchema, standardlized_for_parquet
+from etl.load.export_profiles import (DEFAULT_PROFILE, PartSizer, get_export_profile, load_profile_overrides,
+                                      sort_keys, writer_options)
+from etl.load.export_pipeline import PIPELINE_MODES, create_pipeline, discard_part
+from etl.load.arrow_export import (iter_decoded_batches, docs_to_columns, infer_schema, to_part_schema, is_compatible,
+                                   widen_part_schema, columns_to_record_batch, MergedSchema, ParquetPartWriter)
+from etl.transform.ip_layout import SNAPSHOT_COLLECTIONS, layout_collections
+
+# Layout compact/ranges của ip_locations (IP_LAYOUT) xuất thêm bảng địa điểm ip_places
+COLLECTIONS = layout_collections(["product_names", "raw_data", "ip_locations"])
+CHUNK_SIZE = DEFAULT_PROFILE['chunk_rows'] # Số dòng tối đa mỗi part, part được chốt chủ yếu theo kích thước (xem export_profiles)
 
 # Cấu hình Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -43,6 +58,61 @@ if not parquet_path:
 
 parquet_foldername = os.path.abspath(os.path.expanduser(parquet_path))
 
+# Chế độ export:
+# - 'full': xuất cả collection vào raw/<collection>/, checkpoint chỉ dùng để chạy tiếp khi bị ngắt (mặc định)
+# - 'incremental': mỗi lần chạy chỉ xuất document mới sau high-water mark vào raw/<collection>/dt=<ngày>/ kèm manifest
+EXPORT_MODE = os.environ.get('EXPORT_MODE', 'full').lower()
+
+if EXPORT_MODE not in ('full', 'incremental'):
+    raise ValueError(f"LỖI: EXPORT_MODE '{EXPORT_MODE}' không hợp lệ. Chọn 'full' hoặc 'incremental'")
+
+# Profile kết nối MongoDB (nén wire protocol, read preference, xem config/get_mongo_connection)
+# Incremental đọc từ primary: cận trên _id và lượt quét phải thấy cùng 1 bản dữ liệu
+MONGO_PROFILE = 'incremental-scan' if EXPORT_MODE == 'incremental' else 'bulk-scan'
+BATCH_SIZE = get_batch_size(MONGO_PROFILE, 5000) # Lượng data lấy từ MongoDB mỗi lần
+
+# Engine xuất dữ liệu:
+# - 'pandas': gom cả chunk vào list -> DataFrame -> to_parquet (mặc định, cách cũ)
+# - 'arrow': decode từng batch BSON thô thành pyarrow RecordBatch, ghi thẳng từng row group vào ParquetWriter
+EXPORT_ENGINE = os.environ.get('EXPORT_ENGINE', 'pandas').lower()
+
+if EXPORT_ENGINE not in ('pandas', 'arrow'):
+    raise ValueError(f"LỖI: EXPORT_ENGINE '{EXPORT_ENGINE}' không hợp lệ. Chọn 'pandas' hoặc 'arrow'")
+
+# Cách ghi field lồng nhau (list/dict, VD: mảng option của event select_product_option):
+# - 'json': ép thành chuỗi JSON (mặc định)
+# - 'preserve': ghi thành cột LIST/STRUCT theo schema gộp ổn định giữa các part (chỉ dùng với EXPORT_ENGINE='arrow')
+EXPORT_NESTED = os.environ.get('EXPORT_NESTED', 'json').lower()
+
+if EXPORT_NESTED not in ('json', 'preserve'):
+    raise ValueError(f"LỖI: EXPORT_NESTED '{EXPORT_NESTED}' không hợp lệ. Chọn 'json' hoặc 'preserve'")
+
+if EXPORT_NESTED == 'preserve' and EXPORT_ENGINE != 'arrow':
+    raise ValueError("LỖI: EXPORT_NESTED='preserve' chỉ hỗ trợ EXPORT_ENGINE='arrow'")
+
+# Cách chạy các tầng đọc MongoDB -> ghi Parquet -> upload GCS:
+# - 'inline': chạy tuần tự trong 1 luồng (mặc định)
+# - 'threaded': 3 tầng chạy chồng lên nhau, nối bằng queue có giới hạn; checkpoint chỉ ghi sau khi upload xong
+EXPORT_PIPELINE = os.environ.get('EXPORT_PIPELINE', 'inline').lower()
+
+if EXPORT_PIPELINE not in PIPELINE_MODES:
+    raise ValueError(f"LỖI: EXPORT_PIPELINE '{EXPORT_PIPELINE}' không hợp lệ. Chọn 'inline' hoặc 'threaded'")
+
+# Cách đưa part Parquet lên GCS:
+# - 'file': ghi file tạm vào PARQUET_PATH, upload_from_filename rồi xóa (mặc định)
+# - 'stream': ghi vào buffer trong RAM (tràn ra đĩa khi quá EXPORT_SPOOL_MAX_MB), upload resumable qua blob.open('wb')
+EXPORT_UPLOAD_MODE = os.environ.get('EXPORT_UPLOAD_MODE', 'file').lower()
+EXPORT_SPOOL_MAX_MB = int(os.environ.get('EXPORT_SPOOL_MAX_MB') or 256)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024 # Kích thước mỗi khối upload resumable (bội số của 256KB theo yêu cầu của GCS)
+
+if EXPORT_UPLOAD_MODE not in ('file', 'stream'):
+    raise ValueError(f"LỖI: EXPORT_UPLOAD_MODE '{EXPORT_UPLOAD_MODE}' không hợp lệ. Chọn 'file' hoặc 'stream'")
+
+# Export song song: chia mỗi collection thành EXPORT_PARTITIONS khoảng _id, mỗi khoảng do 1 process đọc/ghi/upload
+# EXPORT_PARTITIONS = 1 (mặc định): chạy tuần tự 1 cursor như cũ
+EXPORT_PARTITIONS = int(os.environ.get('EXPORT_PARTITIONS') or 1)
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS') or min(EXPORT_PARTITIONS, os.cpu_count() or 1))
+
 # ĐẢM BẢO THƯ MỤC TỒN TẠI: Nếu chưa có thì Python tự động tạo folder này
 os.makedirs(parquet_foldername, exist_ok=True)
 
@@ -50,6 +120,12 @@ os.makedirs(parquet_foldername, exist_ok=True)
 checkpoint_path = os.path.join(parquet_foldername, 'checkpoints')
 os.makedirs(checkpoint_path, exist_ok=True)
 
+# (Tùy chọn) file JSON chỉnh profile layout Parquet theo collection, VD: {"raw_data": {"compression": "lz4"}}
+export_profiles_path = os.environ.get('EXPORT_PROFILES_PATH')
+
+# (Tùy chọn) thư mục giả lập GCS để chạy thử export: gs://<bucket>/<blob> -> <LOCAL_GCS_PATH>/<bucket>/<blob>
+local_gcs_path = os.environ.get('LOCAL_GCS_PATH')
+
 gcp_key_path = os.environ.get('GCP_KEY_FILE_PATH')
 
 # LOGIC TỰ ĐỘNG NHẬN DIỆN MÔI TRƯỜNG
@@ -65,6 +141,12 @@ else:
     # Trường hợp 2: Chạy trên VM (Lệnh storage.Client() ở dưới sẽ tự động dùng quyền của VM)
     logging.info("Không tìm thấy File JSON. Sẽ sử dụng quyền mặc định của VM (GCP Mode).")
 
+def get_storage_client():
+    # LOCAL_GCS_PATH: ghi "bucket" ra thư mục cục bộ để chạy thử, không cần kết nối GCS thật
+    if local_gcs_path:
+        return LocalStorageClient(local_gcs_path)
+    return storage.Client()
+
 def get_checkpoint(collection):
     # Đọc file checkpoint xem lần trước chạy đến đâu
     checkpoint_file = os.path.join(checkpoint_path, f"{collection}_checkpoint.json")
@@ -86,96 +168,470 @@ def clear_checkpoint(collection):
     if os.path.exists(checkpoint_file):
         os.remove(checkpoint_file)
 
-def standardlized_for_parquet(df):
-    # Các cột nghi ngờ dễ bị nhận nhầm thành số để ép thành string
-    force_string_cols = ['cat_id', 'is_paypal']
-
-    for force_col in force_string_cols:
-        if force_col in df.columns:
-            # Biến ô trống thành chuỗi rỗng và ép toàn bộ thành string
-            df[force_col] = df[force_col].fillna('').astype(str)
-
-    for col in df.columns:
-        # Bỏ qua những cột vừa bị ép kiểu thủ công ở trên để đỡ tốn thời gian chạy lại
-        if col in force_string_cols:
-            continue
-
-        # Bỏ qua các cột đã là kiểu số/ngày tháng rõ ràng, chỉ xử lý cột 'object' (kiểu thập cẩm)
-        if df[col].dtype == 'object':
-
-            # TẠO MẶT NẠ LỌC: Chỉ tìm những ô KHÔNG BỊ TRỐNG
-            valid_mask = df[col].notna()
-
-            # Nếu cột trống dữ liệu, bỏ qua luôn
-            if not valid_mask.any():
-                continue
-
-            # Thay vì quét apply toàn bộ cột, ta chỉ lấy mẫu 100 dòng đầu có chứa data để đoán định dạng
-            sample_data = df.loc[valid_mask, col].head(100)
-            has_complex_type = sample_data.apply(lambda x: isinstance(x, (list, dict))).any()
-
-            # Nếu cột chứa dữ liệu phức tạp (LIST/DICT)
-            if has_complex_type:
-                processed_values = []
-
-                # Lấy ra đúng những ô CÓ DỮ LIỆU (bỏ qua ô trống) để mang đi xử lý
-                data_to_process = df.loc[valid_mask, col]
+def new_part_output(part_prefix, part_number):
+    """
+    Chuẩn bị nơi ghi 1 part Parquet, trả về dict part:
+    - 'file': file tạm trong parquet_foldername ('local_filename'), upload xong thì xóa.
+    - 'stream': buffer trong RAM ('buffer'), vượt EXPORT_SPOOL_MAX_MB mới tràn ra file tạm của hệ thống.
+    """
+    part = {'part_number': part_number, 'filename': f"{part_prefix}_part_{part_number}.parquet"}
+
+    if EXPORT_UPLOAD_MODE == 'stream':
+        part['buffer'] = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_MB * 1024 * 1024)
+    else:
+        part['local_filename'] = os.path.join(parquet_foldername, part['filename'])
+
+    return part
+
+def part_target(part):
+    # Đích để pandas/pyarrow ghi Parquet vào: buffer (stream) hoặc đường dẫn file (file)
+    return part['buffer'] if 'buffer' in part else part['local_filename']
+
+def get_column_schema(collection):
+    # Schema chuẩn hóa cột của collection, lưu cạnh checkpoint để dùng lại cho mọi part và mọi lần chạy
+    return ColumnSchema(os.path.join(checkpoint_path, f"{collection}_schema.json"))
+
+def get_merged_schema(collection):
+    # Chế độ giữ LIST/STRUCT: schema Arrow gộp của collection, lưu cạnh checkpoint
+    if EXPORT_NESTED != 'preserve':
+        return None
+    return MergedSchema(os.path.join(checkpoint_path, f"{collection}_arrow_schema.bin"))
+
+def get_profile(collection):
+    # Profile layout Parquet của collection (export_profiles.py, chỉnh thêm qua file EXPORT_PROFILES_PATH)
+    return get_export_profile(collection, load_profile_overrides(export_profiles_path))
+
+def part_size(part):
+    # Kích thước part đã ghi xong (bytes)
+    if 'buffer' in part:
+        return part['buffer'].seek(0, os.SEEK_END)
+    # File part chỉ được tạo khi ghi row group đầu tiên
+    return os.path.getsize(part['local_filename']) if os.path.exists(part['local_filename']) else 0
+
+def sort_dataframe(df, profile):
+    # Sắp xếp dòng theo profile, cột có kiểu thập cẩm không so sánh được thì giữ nguyên thứ tự
+    keys = sort_keys(profile, df.columns)
+    if not keys:
+        return df
+    try:
+        return df.sort_values(by=[col for col, _ in keys], ascending=[order == 'ascending' for _, order in keys],
+                              kind='stable', na_position='last')
+    except TypeError as e:
+        logging.warning(f"Bỏ qua sắp xếp part theo {keys}: {e}")
+        return df
+
+def write_parquet_part(part_prefix, data_list, part_number, column_schema=None, profile=None):
+    # Biến mảng document thành 1 part Parquet, trả về dict part (xem new_part_output)
+    # column_schema=None: chuẩn hóa kiểu cũ (đoán lại kiểu trên từng part)
+    # profile=None: ghi với tham số mặc định của pandas (snappy, 1 row group cho cả part)
+    part = new_part_output(part_prefix, part_number)
 
-                # Lặp qua từng ô để xử lý kiểu dữ liệu
-                for x in data_to_process:
-                    if isinstance(x, (list, dict)):
-                        # Nếu là mảng -> ép json biến thành string
-                        json_str = json.dumps(x, ensure_ascii=False)
-                        processed_values.append(json_str)
+    try:
+        df = pd.DataFrame(data_list)
 
-                    else:
-                        # Nếu chỉ là số hoặc chữ -> Ép thành string
-                        obj_str = str(x)
-                        processed_values.append(obj_str)
+        if column_schema is not None:
+            df = column_schema.normalize(df)
+        else:
+            df = standardlized_for_parquet(df)
 
-                # Lấy toàn bộ kết quả đã xử lý đè ngược lại vào bảng DataFrame
-                df.loc[valid_mask, col] = processed_values
+        if profile is None:
+            df.to_parquet(part_target(part), engine='pyarrow', index=False)
+        else:
+            df = sort_dataframe(df, profile)
+            options = writer_options(profile, df.columns)
+            if profile['row_group_rows']:
+                options['row_group_size'] = profile['row_group_rows']
+            df.to_parquet(part_target(part), engine='pyarrow', index=False, **options)
+    except Exception:
+        discard_part(part)
+        raise
+
+    part['rows'] = len(data_list)
+    part['bytes'] = part_size(part)
+    return part
+
+def upload_part(collection, part, bucket, gcs_dir=None):
+    # Upload 1 part Parquet đã ghi xong lên GCS rồi dọn file tạm/buffer
+    # gcs_dir: thư mục đích (mặc định raw/<collection>, chế độ incremental dùng raw/<collection>/dt=<ngày>)
+    gcs_dest = f"{gcs_dir or f'raw/{collection}'}/{part['filename']}"
+    part['gcs_dest'] = gcs_dest
+    blob = bucket.blob(gcs_dest)
 
-            # Nếu cột chứa dữ liệu đơn giản
-            else:
-                df.loc[valid_mask, col] = df.loc[valid_mask, col].astype(str)
+    logging.info(f"Đang upload Part {part['part_number']} (Kích thước: {part['rows']} dòng, "
+                 f"{part['bytes'] / 1024 / 1024:.1f} MB Parquet từ {part['input_bytes'] / 1024 / 1024:.1f} MB BSON)...")
 
-    return df
+    try:
+        if 'buffer' in part:
+            # Upload resumable theo từng khối UPLOAD_CHUNK_SIZE, không cần file tạm trên đĩa
+            buffer = part['buffer']
+            buffer.seek(0)
+            writer = blob.open('wb', chunk_size=UPLOAD_CHUNK_SIZE)
+            try:
+                shutil.copyfileobj(buffer, writer, UPLOAD_CHUNK_SIZE)
+            except Exception:
+                # Lỗi giữa chừng: hủy phiên upload dở, không tạo blob thiếu dữ liệu
+                writer.terminate()
+                raise
+
+            # Chỉ close (chốt blob) khi đã ghi đủ
+            writer.close()
+        else:
+            blob.upload_from_filename(part['local_filename'])
+    finally:
+        # Xóa file tạm
+        discard_part(part)
+
+def build_resume_query(checkpoint_key, id_range=None):
+    # ĐỌC CHECKPOINT VÀ GẮN VÀO CÂU QUERY, trả về (query, part_number)
+    # id_range: khoảng _id của partition (chế độ export song song), None = cả collection
+    last_id, last_part = get_checkpoint(checkpoint_key)
+    query = {'_id': dict(id_range)} if id_range else {}
+
+    if last_id:
+        # Nếu có checkpoint, chỉ lấy những dòng có ID LỚN HƠN ID đã lưu (vẫn giữ cận trên của partition)
+        id_filter = query.setdefault('_id', {})
+        id_filter.pop('$gte', None)
+        id_filter['$gt'] = ObjectId(last_id)
+        part_number = last_part + 1
+        logging.info(f"KHÔI PHỤC: Chạy tiếp từ Part {part_number} (Sau _id: {last_id})")
+    else:
+        part_number = 1 # Chia phần với những collection có quá nhiều dữ liệu
+        logging.info("CHẠY MỚI: Bắt đầu từ Part 1")
+
+    return query, part_number
+
+class PandasPartEncoder:
+    # Tầng encode của engine pandas: mỗi chunk (docs, số byte BSON) do tầng đọc cắt theo sizer -> 1 file Parquet
+
+    def __init__(self, part_prefix, part_number, column_schema, profile):
+        self.part_prefix = part_prefix
+        self.part_number = part_number
+        self.column_schema = column_schema
+        self.profile = profile
+        self.sizer = PartSizer(profile)
+
+    def feed(self, chunk):
+        data_list, input_bytes = chunk
+
+        # 3. Convert to appropriate format (CSV/JSONL/PARQUET/ARVO/ORC)
+        part = write_parquet_part(self.part_prefix, data_list, self.part_number, self.column_schema, self.profile)
+        part['input_bytes'] = input_bytes
+        self.sizer.observe(input_bytes, part['bytes'])
+
+        # Lưu lại ID cuối cùng làm checkpoint
+        part['last_id'] = data_list[-1]['_id']
+        self.part_number += 1
+        return [part]
+
+    def finish(self):
+        return []
+
+    def abort(self):
+        pass
+
+class ArrowPartEncoder:
+    """
+    Tầng encode của engine arrow: mỗi batch BSON (BATCH_SIZE dòng) được decode thành 1 RecordBatch
+    và ghi ngay (hoặc gom đủ row_group_rows của profile) thành row group, nên RAM không phải giữ cả chunk.
+    Part được chốt khi sizer ước lượng file đã đạt kích thước mục tiêu (byte đã ghi + byte BSON còn chờ ghi),
+    khi đủ chunk_rows dòng (chỉ khi profile không có target_file_mb), hoặc khi batch mới có schema không ghi chung được.
+    merged_schema != None (EXPORT_NESTED='preserve'): list/dict ghi thành LIST/STRUCT theo schema gộp của collection,
+    part mới được mở khi schema gộp mở rộng.
+    """
+
+    def __init__(self, part_prefix, part_number, profile, merged_schema=None):
+        self.part_prefix = part_prefix
+        self.part_number = part_number
+        self.profile = profile
+        self.sizer = PartSizer(profile, row_cap=False)
+        self.merged_schema = merged_schema
+        self.part = None
+        self.part_writer = None
+        self.part_last_id = None
+        self.part_input_bytes = 0 # Byte BSON đã đưa vào part hiện tại
+        self.pending_input_bytes = 0 # Byte BSON của các dòng còn gom trong RAM, chưa thành row group
+
+    def _finish_part(self):
+        # Đóng file part hiện tại, trả về thông tin part để upload
+        self.part_writer.close()
+        part = self.part
+        part.update({'last_id': self.part_last_id, 'rows': self.part_writer.rows, 'bytes': part_size(part),
+                     'input_bytes': self.part_input_bytes})
+        self.sizer.observe(part['input_bytes'], part['bytes'])
+        self.part = None
+        self.part_writer = None
+        self.part_input_bytes = 0
+        self.pending_input_bytes = 0
+        self.part_number += 1
+        return part
+
+    def _target_schema(self, columns):
+        # Trả về (schema cho part mới, part hiện tại còn ghi tiếp được hay không)
+        batch_schema = infer_schema(columns)
+
+        if self.merged_schema is None:
+            if self.part_writer is None:
+                return to_part_schema(batch_schema), False
+
+            # Cột int64 của part gặp batch double: nới part thành double nếu chưa ghi row group nào,
+            # không thì chốt part, part mới mở theo kiểu double và nhận tiếp các batch int64
+            widened = widen_part_schema(batch_schema, self.part_writer.schema)
+            if widened is not None:
+                self.part_writer.widen(widened)
+            return to_part_schema(batch_schema), is_compatible(batch_schema, self.part_writer.schema)
+
+        self.merged_schema.merge(batch_schema)
+        part_schema = to_part_schema(self.merged_schema.schema)
+        return part_schema, self.part_writer is not None and self.part_writer.schema.equals(part_schema)
+
+    def feed(self, batch):
+        docs, input_bytes = batch
+        parts = []
+        columns = docs_to_columns(docs, nested=self.merged_schema is not None)
+        part_schema, compatible = self._target_schema(columns)
+
+        # Schema lệch với part đang ghi (cột mới/đổi kiểu) -> chốt part hiện tại, mở part mới
+        if self.part_writer is not None and not compatible:
+            parts.append(self._finish_part())
+
+        if self.part_writer is None:
+            self.part = new_part_output(self.part_prefix, self.part_number)
+            self.part_writer = ParquetPartWriter(part_target(self.part), part_schema,
+                                                 row_group_rows=self.profile['row_group_rows'],
+                                                 sort_by=self.profile['sort_by'],
+                                                 **writer_options(self.profile, part_schema.names))
+
+        # Dựng batch theo schema của part (cột thiếu -> null, lệch kiểu -> string)
+        self.part_writer.write(columns_to_record_batch(columns, self.part_writer.schema))
+        self.part_last_id = docs[-1]['_id']
+        self.part_input_bytes += input_bytes
+        self.pending_input_bytes = self.pending_input_bytes + input_bytes if self.part_writer.pending_rows else 0
+
+        # Xử lý đẩy dữ liệu vào GCP khi đủ ngưỡng (byte đã ghi ra file đo trực tiếp trên file/buffer của part)
+        if self.sizer.should_cut(self.part_writer.rows, self.pending_input_bytes, part_size(self.part)):
+            parts.append(self._finish_part())
+
+        return parts
+
+    def finish(self):
+        # Xử lý nốt số dữ liệu lẻ còn dư ở part cuối cùng
+        return [self._finish_part()] if self.part_writer is not None else []
+
+    def abort(self):
+        # Lỗi giữa chừng: bỏ file part ghi dở, lần sau chạy lại từ checkpoint
+        if self.part_writer is not None:
+            self.part_writer.close()
+            discard_part(self.part)
+            self.part = None
+            self.part_writer = None
+            self.part_input_bytes = 0
+            self.pending_input_bytes = 0
+
+def create_export_pipeline(collection, bucket, part_prefix, encoder, gcs_dir=None):
+    # Ghép tầng encode với tầng upload + checkpoint theo EXPORT_PIPELINE
+    def upload(part):
+        # 4. Upload to GCS (all data in VM or in MongoDB)
+        upload_part(collection, part, bucket, gcs_dir)
+
+    def commit(part):
+        # Chỉ ghi checkpoint sau khi part đã upload thành công
+        append_part_record(checkpoint_path, part_prefix, {
+            'name': part['gcs_dest'], 'part_number': part['part_number'],
+            'rows': part['rows'], 'bytes': part['bytes'], 'input_bytes': part['input_bytes'],
+            'last_id': str(part['last_id'])
+        })
+        save_checkpoint(part_prefix, part['last_id'], part['part_number'])
+        logging.info(f"Đã đánh dấu Checkpoint Part {part['part_number']} ({part_prefix}): "
+                     f"{part['rows']} dòng, {part['bytes']} bytes")
+
+    return create_pipeline(EXPORT_PIPELINE, encoder, upload, commit)
+
+def export_collection_pandas(collection, src_collection, bucket, part_prefix=None, id_range=None, gcs_dir=None):
+    # part_prefix: tên dùng cho checkpoint và file part (mặc định là tên collection)
+    part_prefix = part_prefix or collection
+    query, part_number = build_resume_query(part_prefix, id_range)
+
+    profile = get_profile(collection)
+    encoder = PandasPartEncoder(part_prefix, part_number, get_column_schema(collection), profile)
+    pipeline = create_export_pipeline(collection, bucket, part_prefix, encoder, gcs_dir)
+
+    batch_data = []
+    batch_bytes = 0 # Số byte BSON của chunk đang gom
+    processed = 0 # Tổng bản ghi dữ liệu đã xử lý
 
-def convert_and_upload(collection, data_list, part_number, bucket):
-    # Hàm phụ trách biến mảng thành Parquet và đẩy lên GCP
+    try:
+        # Mỗi lần kéo BATCH_SIZE dòng dạng BSON thô, chỉ lấy các field theo projection của profile
+        for docs, input_bytes in iter_decoded_batches(src_collection, query, BATCH_SIZE, profile['projection']):
+            batch_data.extend(docs)
+            batch_bytes += input_bytes
+            processed += len(docs)
 
-    # Chuyển đổi sang Parquet
-    filename = f"{collection}_part_{part_number}.parquet"
+            # Xử lý đẩy dữ liệu vào GCP khi chunk đạt ngưỡng kích thước (hoặc số dòng tối đa)
+            if encoder.sizer.should_cut(len(batch_data), batch_bytes):
+                pipeline.put((batch_data, batch_bytes))
 
-    local_filename = os.path.join(parquet_foldername, filename)
+                # Tạo list mới vì chunk cũ vẫn đang được tầng encode sử dụng
+                batch_data = []
+                batch_bytes = 0
 
-    df = pd.DataFrame(data_list)
+        # Xử lý nốt số dữ liệu lẻ còn dư ở batch cuối cùng
+        if len(batch_data) > 0:
+            pipeline.put((batch_data, batch_bytes))
+            batch_data = []
 
-    df = standardlized_for_parquet(df)
+        pipeline.close()
+    except BaseException:
+        pipeline.abort()
+        raise
 
-    df.to_parquet(local_filename, engine='pyarrow', index=False)
+    return processed
 
-    # Upload lên GCS
-    gcs_dest = f"raw/{collection}/{filename}"
-    blob = bucket.blob(gcs_dest)
+def export_collection_arrow(collection, src_collection, bucket, part_prefix=None, id_range=None, gcs_dir=None):
+    # Xuất 1 collection theo kiểu streaming từng batch BSON (xem ArrowPartEncoder)
+    part_prefix = part_prefix or collection
+    query, part_number = build_resume_query(part_prefix, id_range)
 
-    logging.info(f"Đang upload Part {part_number} (Kích thước: {len(data_list)} dòng)...")
+    profile = get_profile(collection)
+    encoder = ArrowPartEncoder(part_prefix, part_number, profile, get_merged_schema(collection))
+    pipeline = create_export_pipeline(collection, bucket, part_prefix, encoder, gcs_dir)
 
-    blob.upload_from_filename(local_filename)
+    processed = 0 # Tổng bản ghi dữ liệu đã xử lý
 
-    # Xóa file tạm
-    os.remove(local_filename)
+    try:
+        for docs, input_bytes in iter_decoded_batches(src_collection, query, BATCH_SIZE, profile['projection']):
+            pipeline.put((docs, input_bytes))
+            processed += len(docs)
+
+        pipeline.close()
+    except BaseException:
+        pipeline.abort()
+        raise
+
+    return processed
+
+EXPORT_FUNCTIONS = {
+    'pandas': export_collection_pandas,
+    'arrow': export_collection_arrow
+}
+
+def export_partition(collection, partition_index, id_range, run_key=None, gcs_dir=None):
+    # Chạy trong process con: mỗi partition dùng kết nối MongoDB và GCS riêng
+    # raw_bson=False: engine pandas cần dict thật (engine arrow đọc batch BSON thô nên không bị ảnh hưởng)
+    db = get_database(MONGO_PROFILE, raw_bson=False)
+    client = get_storage_client()
+    try:
+        bucket = client.bucket(bucket_name)
+        part_prefix = f"{run_key or collection}_p{partition_index}"
+        return EXPORT_FUNCTIONS[EXPORT_ENGINE](collection, db[collection], bucket, part_prefix, id_range, gcs_dir)
+    finally:
+        close_connection()
+        client.close()
+
+def export_collection_partitioned(collection, src_collection, bucket, run_key=None, base_range=None, gcs_dir=None):
+    """
+    Xuất 1 collection bằng EXPORT_WORKERS process song song, mỗi process xử lý 1 khoảng _id.
+    Mỗi partition có checkpoint riêng ({collection}_p{i}_checkpoint.json), nên khi bị ngắt
+    chỉ những partition chưa xong mới chạy tiếp. Kế hoạch chia khoảng được lưu lại để dùng cho lần sau.
+    run_key/base_range/gcs_dir: dùng cho 1 lượt chạy incremental (chỉ chia khoảng _id của lượt đó).
+    """
+    if base_range is None:
+        # Nếu trước đó đã xuất tuần tự 1 phần, chỉ chia khoảng trên phần dữ liệu còn lại
+        last_id, _ = get_checkpoint(collection)
+        base_range = {'$gt': ObjectId(last_id)} if last_id else {}
+
+    plan_file = os.path.join(checkpoint_path, f"{run_key or collection}_partitions.json")
+    ranges = plan_partitions(src_collection, EXPORT_PARTITIONS, plan_file, base_range)
+    logging.info(f"Chia {collection} thành {len(ranges)} partition, chạy bằng {EXPORT_WORKERS} process")
+
+    processed = 0
+    failed = []
+
+    # spawn: process con tự mở kết nối MongoDB mới, không kế thừa MongoClient của process cha
+    with ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(export_partition, collection, idx, id_range, run_key, gcs_dir): idx
+                   for idx, id_range in enumerate(ranges)}
+
+        for future in as_completed(futures):
+            idx = futures[future]
+            try:
+                rows = future.result()
+                processed += rows
+                logging.info(f"Xong partition {idx} của {collection}: {rows} dòng")
+            except Exception as e:
+                failed.append(idx)
+                logging.error(f"Lỗi partition {idx} của {collection}: {e}")
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} partition lỗi {sorted(failed)}, chạy lại để tiếp tục từ checkpoint")
+
+    return processed
+
+def export_collection_incremental(collection, src_collection, bucket):
+    """
+    Chế độ incremental: mỗi lần chạy chỉ xuất document mới kể từ high-water mark của lần trước,
+    ghi vào thư mục theo ngày raw/<collection>/dt=<YYYY-MM-DD>/ kèm file manifest liệt kê các part đã tạo.
+    High-water mark chỉ được nâng lên sau khi mọi part của lượt chạy đã upload và manifest đã ghi xong.
+    Collection trong SNAPSHOT_COLLECTIONS (bị ghi lại tại chỗ, _id không tăng theo dữ liệu mới) được xuất lại
+    toàn bộ mỗi lượt, manifest có replace=True để BigQuery nạp đè.
+    """
+    state = IncrementalState(checkpoint_path, collection)
+    snapshot = collection in SNAPSHOT_COLLECTIONS
+
+    # Collection đã từng xuất ở chế độ full -> bắt đầu từ checkpoint full để không xuất trùng
+    if not snapshot and state.get_high_water_mark() is None and state.get_run() is None:
+        last_id, _ = get_checkpoint(collection)
+        if last_id:
+            state.seed(last_id)
+            logging.info(f"Khởi tạo high-water mark của {collection} từ checkpoint full: {last_id}")
+
+    run = state.start_run(src_collection, snapshot=snapshot)
+    if run is None:
+        logging.info(f"Không có dữ liệu mới kể từ high-water mark của {collection}.")
+        return 0
+
+    run_key = state.run_key(run)
+    id_range = state.run_range(run)
+    gcs_dir = f"raw/{collection}/dt={run['dt']}"
+    if run.get('replace'):
+        logging.info(f"Lượt incremental {run['run_id']}: xuất lại toàn bộ {collection} (snapshot) -> {gcs_dir}")
+    else:
+        logging.info(f"Lượt incremental {run['run_id']}: _id trong ({run['lower']}, {run['upper']}] -> {gcs_dir}")
+
+    if EXPORT_PARTITIONS > 1:
+        export_collection_partitioned(collection, src_collection, bucket, run_key, id_range, gcs_dir)
+    else:
+        EXPORT_FUNCTIONS[EXPORT_ENGINE](collection, src_collection, bucket, run_key, id_range, gcs_dir)
+
+    # Tổng hợp log part (kể cả các part đã upload từ lần chạy bị ngắt trước đó) thành manifest
+    parts = read_part_records(checkpoint_path, run_key)
+    rows = sum(part['rows'] for part in parts)
+    size = sum(part.get('bytes', 0) for part in parts)
+    manifest = {
+        'collection': collection,
+        **run,
+        'finished_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'total_rows': rows,
+        'total_bytes': size,
+        'parts': parts
+    }
+
+    manifest_blob = bucket.blob(f"{gcs_dir}/_manifest_{run['run_id']}.json")
+    manifest_blob.upload_from_string(json.dumps(manifest, ensure_ascii=False, indent=2),
+                                     content_type='application/json')
+    logging.info(f"Đã ghi manifest {len(parts)} part ({rows} dòng, {size / 1024 / 1024:.1f} MB) cho lượt {run['run_id']}")
+
+    state.finish_run(run, rows)
+    return rows
 
 def export_to_gcs():
     start_time = time.time()
 
     # 1. Connect to MongoDB (or VM)
     try:
-        db = get_database()
+        db = get_database(MONGO_PROFILE, raw_bson=False)
 
         # Kết nối với GCP xác thực bằng file json gcp_key
-        client = storage.Client()
+        client = get_storage_client()
 
         # Chọn tới bucket cần lưu trữ
         bucket = client.bucket(bucket_name)
@@ -183,7 +639,7 @@ def export_to_gcs():
         logging.error(f"Lỗi khởi tạo kết nối: {e}")
         return
 
-    logging.info("BẮT ĐẦU PIPELINE XUẤT DỮ LIỆU LÊN GCS...")
+    logging.info(f"BẮT ĐẦU PIPELINE XUẤT DỮ LIỆU LÊN GCS (mode: {EXPORT_MODE}, engine: {EXPORT_ENGINE}, pipeline: {EXPORT_PIPELINE}, partitions: {EXPORT_PARTITIONS})...")
 
     # 2. Extract data in batches
     # Lặp qua từng bảng
@@ -191,63 +647,13 @@ def export_to_gcs():
         logging.info(f"\n========== ĐANG XỬ LÝ: {collection.upper()} ==========")
         src_collection = db[collection]
 
-        # ĐỌC CHECKPOINT VÀ GẮN VÀO CÂU QUERY
-        last_id, last_part = get_checkpoint(collection)
-        query = {}
-
-        if last_id:
-            # Nếu có checkpoint, chỉ lấy những dòng có ID LỚN HƠN ID đã lưu
-            query['_id'] = {'$gt': ObjectId(last_id)}
-            part_number = last_part + 1
-            logging.info(f"KHÔI PHỤC: Chạy tiếp từ Part {part_number} (Sau _id: {last_id})")
-        else:
-            part_number = 1 # Chia phần với những collection có quá nhiều dữ liệu
-            logging.info("CHẠY MỚI: Bắt đầu từ Part 1")
-
-        # Tạo cursor, mỗi lần kéo 5000 dòng
-        cursor = src_collection.find(query).sort('_id', 1).batch_size(BATCH_SIZE)
-
-        batch_data = []
-        processed = 0 # Tổng bản ghi dữ liệu đã xử lý
-
         try:
-            for doc in cursor:
-                batch_data.append(doc)
-                processed += 1
-
-                # Xử lý đẩy dữ liệu vào GCP khi đủ ngưỡng
-                if len(batch_data) >= CHUNK_SIZE:
-                    # Lưu lại ID cuối cùng làm checkpoint
-                    current_last_id = batch_data[-1]['_id']
-
-                    # 3. Convert to appropriate format (CSV/JSONL/PARQUET/ARVO/ORC)
-                    # 4. Upload to GCS (all data in VM or in MongoDB)
-                    convert_and_upload(collection, batch_data, part_number, bucket)
-
-                    # Ghi checkpoint vào file
-                    save_checkpoint(collection, current_last_id, part_number)
-                    logging.info(f"Đã đánh dấu Checkpoint Part {part_number}")
-
-                    logging.info(f"collection: {collection} part: {part_number}")
-
-                    batch_data.clear()
-                    part_number += 1
-
-            # Xử lý nốt số dữ liệu lẻ còn dư ở batch cuối cùng
-            if len(batch_data) > 0:
-                # Lưu lại ID cuối cùng làm checkpoint
-                current_last_id = batch_data[-1]['_id']
-
-                # 3. Convert to appropriate format (CSV/JSONL/PARQUET/ARVO/ORC)
-                # 4. Upload to GCS (all data in VM or in MongoDB)
-                convert_and_upload(collection, batch_data, part_number, bucket)
-
-                # Ghi checkpoint vào file
-                save_checkpoint(collection, current_last_id, part_number)
-
-                batch_data.clear()
-
-                logging.info( f"Xử lý batch còn dư: collection: {collection} part: {part_number}")
+            if EXPORT_MODE == 'incremental':
+                processed = export_collection_incremental(collection, src_collection, bucket)
+            elif EXPORT_PARTITIONS > 1:
+                processed = export_collection_partitioned(collection, src_collection, bucket)
+            else:
+                processed = EXPORT_FUNCTIONS[EXPORT_ENGINE](collection, src_collection, bucket)
 
             # Xóa checkpoint khi đã xong 100%
             # clear_checkpoint(collection)
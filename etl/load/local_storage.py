@@ -0,0 +1,103 @@
+import os
+import shutil
+
+# Bản thay thế storage.Client ghi blob ra thư mục cục bộ, dùng để chạy thử export mà không cần GCS thật:
+# gs://<bucket>/<blob_name> tương ứng với <root>/<bucket>/<blob_name>.
+# Chỉ cài đặt các hàm mà export_to_gcs đang dùng.
+
+
+class LocalBlobWriter:
+    # Giống BlobWriter của blob.open('wb'): ghi vào file tạm, đóng xong mới đổi tên (upload hoàn tất mới thấy blob)
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.uploading'
+        self._file = open(self.tmp_path, 'wb')
+
+    def write(self, data):
+        return self._file.write(data)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+            os.replace(self.tmp_path, self.path)
+
+    def terminate(self):
+        # Giống BlobWriter.terminate(): hủy upload, xóa file tạm
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Upload lỗi giữa chừng -> không để lại blob dở dang
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+class LocalBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.path, name)
+
+    def _prepare(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def open(self, mode='rb', chunk_size=None, **kwargs):
+        if mode == 'wb':
+            self._prepare()
+            return LocalBlobWriter(self.path)
+        if mode == 'rb':
+            return open(self.path, 'rb')
+        raise ValueError(f"LỖI: LocalBlob không hỗ trợ mode '{mode}'")
+
+    def upload_from_file(self, file_obj, rewind=False, **kwargs):
+        if rewind:
+            file_obj.seek(0)
+        with self.open('wb') as writer:
+            shutil.copyfileobj(file_obj, writer)
+
+    def upload_from_filename(self, filename, **kwargs):
+        with open(filename, 'rb') as f:
+            self.upload_from_file(f)
+
+    def upload_from_string(self, data, **kwargs):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self.open('wb') as writer:
+            writer.write(data)
+
+    def download_as_bytes(self, **kwargs):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+class LocalBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.path = os.path.join(client.root, name)
+
+    def blob(self, blob_name):
+        return LocalBlob(self, blob_name)
+
+
+class LocalStorageClient:
+    def __init__(self, root):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        os.makedirs(self.root, exist_ok=True)
+
+    def bucket(self, bucket_name):
+        return LocalBucket(self, bucket_name)
+
+    def close(self):
+        pass
@@ -0,0 +1,91 @@
+import json
+import os
+from bson.objectid import ObjectId
+
+PARTITION_SAMPLE_PER_SPLIT = 100 # Số _id lấy mẫu cho mỗi partition để ước lượng điểm cắt
+
+
+def sample_split_points(src_collection, partitions, base_range):
+    """
+    Ước lượng (partitions - 1) điểm cắt _id sao cho các partition có số dòng gần bằng nhau:
+    lấy mẫu ngẫu nhiên _id bằng $sample, sắp xếp rồi chọn các phân vị.
+    Chỉ lấy mẫu trong base_range (phần chưa xuất theo checkpoint cũ / khoảng _id của lượt chạy):
+    $match đặt trước $sample để đủ mẫu kể cả khi base_range chỉ là 1 phần nhỏ của collection.
+    """
+    sample_size = partitions * PARTITION_SAMPLE_PER_SPLIT
+
+    stages = [{'$match': {'_id': base_range}}] if base_range else []
+    cursor = src_collection.aggregate(stages + [
+        {'$sample': {'size': sample_size}},
+        {'$project': {'_id': 1}}
+    ], allowDiskUse=True)
+
+    sample_ids = sorted({doc['_id'] for doc in cursor})
+    if len(sample_ids) < partitions:
+        return []
+
+    step = len(sample_ids) / partitions
+    return sorted({sample_ids[int(i * step)] for i in range(1, partitions)})
+
+
+def timestamp_split_points(src_collection, partitions, base_range):
+    # Dự phòng: chia đều khoảng thời gian giữa _id nhỏ nhất và lớn nhất (ObjectId chứa timestamp tạo bản ghi)
+    query = {'_id': base_range} if base_range else {}
+
+    first = src_collection.find_one(query, {'_id': 1}, sort=[('_id', 1)])
+    last = src_collection.find_one(query, {'_id': 1}, sort=[('_id', -1)])
+    if first is None or not isinstance(first['_id'], ObjectId) or not isinstance(last['_id'], ObjectId):
+        return []
+
+    start, end = first['_id'].generation_time, last['_id'].generation_time
+    step = (end - start) / partitions
+    if not step:
+        return []
+
+    return sorted({ObjectId.from_datetime(start + step * i) for i in range(1, partitions)})
+
+
+def build_ranges(split_points, base_range):
+    # Biến danh sách điểm cắt thành các khoảng _id: [lower, split_1), [split_1, split_2), ..., [split_n, upper]
+    # Cận dưới/cận trên của base_range (nếu có) được giữ ở partition đầu/cuối
+    ranges = []
+    lower = {op: value for op, value in base_range.items() if op in ('$gt', '$gte')}
+    upper = {op: value for op, value in base_range.items() if op in ('$lt', '$lte')}
+    for split_id in split_points:
+        ranges.append({**lower, '$lt': split_id})
+        lower = {'$gte': split_id}
+    ranges.append({**lower, **upper})
+    return ranges
+
+
+def serialize_range(id_range):
+    return {op: str(value) for op, value in id_range.items()}
+
+
+def deserialize_range(id_range):
+    return {op: ObjectId(value) for op, value in id_range.items()}
+
+
+def plan_partitions(src_collection, partitions, plan_file, base_range=None):
+    """
+    Trả về danh sách khoảng _id cho từng partition.
+    Kế hoạch được lưu vào plan_file ở lần chạy đầu và dùng lại ở các lần sau,
+    để checkpoint của từng partition luôn khớp đúng khoảng _id của nó khi chạy tiếp.
+    """
+    if os.path.exists(plan_file):
+        with open(plan_file, 'r') as f:
+            return [deserialize_range(r) for r in json.load(f)['ranges']]
+
+    base_range = base_range or {}
+    split_points = sample_split_points(src_collection, partitions, base_range)
+    if not split_points:
+        split_points = timestamp_split_points(src_collection, partitions, base_range)
+
+    ranges = build_ranges(split_points, base_range)
+
+    tmp_file = plan_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump({'partitions': len(ranges), 'ranges': [serialize_range(r) for r in ranges]}, f)
+    os.replace(tmp_file, plan_file)
+
+    return ranges
@@ -1,5 +1,6 @@
 import functions_framework
 from google.cloud import bigquery
+from google.cloud.bigquery.format_options import ParquetOptions
 from google.api_core.exceptions import NotFound
 import logging
 
@@ -30,13 +31,20 @@ def trigger_bigquery_load(cloud_event):
         logging.info("Skipping BigQuery load as it is not a parquet")
         return
 
+    # Part của chế độ incremental/snapshot (raw/<collection>/dt=.../) được nạp theo manifest trong export_to_bigquery
+    if "/dt=" in path_name or "_manifest_" in path_name:
+        logging.info("Skipping BigQuery load as incremental parts are loaded via manifest")
+        return
+
     try:
         # 2. Start BigQuery load job
         # Lấy filename chuẩn (VD:raw_data_part_xx.parquet)
         file_name = path_name.split("/")[-1]
 
-        # Lấy tên collection
-        collection = file_name.split("_part_")[0]
+        # Lấy tên collection từ thư mục chứa file (raw/<collection>/...), vì file của chế độ
+        # export song song có tiền tố partition (VD: raw_data_p0_part_xx.parquet)
+        path_parts = path_name.split("/")
+        collection = path_parts[1] if len(path_parts) > 2 else file_name.split("_part_")[0]
 
         logging.info(f"\n========== ĐANG LOAD DỮ LIỆU BẢNG: {collection.upper()} ==========")
 
@@ -67,6 +75,11 @@ def trigger_bigquery_load(cloud_event):
             write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE # Tạo dữ liệu bảng temp mới
         )
 
+        # Cột LIST trong Parquet (chế độ EXPORT_NESTED='preserve') được nạp thành ARRAY thay vì STRUCT lồng "list.element"
+        parquet_options = ParquetOptions()
+        parquet_options.enable_list_inference = True
+        job_config.parquet_options = parquet_options
+
         # Nếu không phải lần đầu, ép Schema của bảng tạm y hệt bảng đích
         if not is_first_load:
             job_config.schema = target_schema
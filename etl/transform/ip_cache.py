@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Lấy thư mục gốc của project và file .env
+project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+load_dotenv(dotenv_path=os.path.join(project_dir, '.env'))
+
+# Kích thước mặc định của cache tra IP, chỉnh bằng .env:
+# - IP_CACHE_ENTRIES: số IP tối đa giữ trong cache
+# - IP_CACHE_MB: (tùy chọn) giới hạn thêm theo dung lượng ước tính của các entry
+IP_CACHE_ENTRIES = int(os.environ.get('IP_CACHE_ENTRIES') or 100000)
+IP_CACHE_MB = float(os.environ.get('IP_CACHE_MB') or 0) or None
+
+ENTRY_OVERHEAD_BYTES = 100  # Chi phí ước tính của 1 node OrderedDict + tuple key/value
+LOCATION_FIELDS = ('country_short', 'country_long', 'region', 'city')
+
+
+def estimate_size(key, value):
+    # Dung lượng ước tính của 1 entry (key + dict kết quả + các chuỗi bên trong)
+    size = ENTRY_OVERHEAD_BYTES + sys.getsizeof(key) + sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(v) for v in value.values())
+    return size
+
+
+class LRUCache:
+    """
+    Cache LRU có giới hạn theo số entry và/hoặc số byte ước tính, an toàn khi nhiều thread dùng chung.
+    Vượt giới hạn thì bỏ entry lâu nhất chưa được dùng tới. Đếm hit/miss/eviction để theo dõi hiệu quả.
+    """
+
+    def __init__(self, max_entries=IP_CACHE_ENTRIES, max_bytes=None):
+        if not max_entries and not max_bytes:
+            raise ValueError("LỖI: LRUCache cần ít nhất 1 giới hạn (max_entries hoặc max_bytes)")
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_size(key, value)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+
+            self._data[key] = (value, size)
+            self.bytes += size
+
+            while self._data and ((self.max_entries and len(self._data) > self.max_entries) or
+                                  (self.max_bytes and self.bytes > self.max_bytes)):
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+                self.counters['evictions'] += 1
+
+    def hit_rate(self):
+        lookups = self.counters['hits'] + self.counters['misses']
+        return self.counters['hits'] / lookups if lookups else 0.0
+
+    def metrics(self):
+        with self._lock:
+            return {**self.counters, 'entries': len(self._data), 'bytes': self.bytes, 'hit_rate': self.hit_rate()}
+
+
+class CachedIPResolver:
+    """
+    Bọc hàm tra IP theo batch (create_resolver() của ip_processing hoặc IPRangeIndex.lookup) bằng LRUCache.
+    Lượng truy cập IP lệch mạnh (1 nhóm nhỏ IP sinh phần lớn event) nên phần lớn lượt tra trúng cache.
+    IP chưa có trong cache được gom lại (bỏ trùng) và tra 1 lần cho cả batch.
+    Kết quả lỗi (None) không được lưu để lần sau tra lại. IP rỗng/None không được tra, kết quả là None.
+    validate: (tùy chọn) hàm kiểm tra bản ghi -> (is_valid, reason) như validate_data của ip_processing,
+    enrich_events chỉ gắn vị trí của bản ghi hợp lệ.
+    """
+
+    def __init__(self, resolve_batch, max_entries=IP_CACHE_ENTRIES, max_bytes=None, validate=None):
+        self.resolve_batch = resolve_batch
+        self.validate = validate
+        self.cache = LRUCache(max_entries, max_bytes)
+
+    def lookup(self, ips):
+        # Trả về list bản ghi vị trí (dict) theo đúng thứ tự ips, IP rỗng/None trả về None
+        results = [self.cache.get(ip) if ip else None for ip in ips]
+
+        missing = list(dict.fromkeys(ip for ip, result in zip(ips, results) if ip and result is None))
+        if missing:
+            resolved = dict(zip(missing, self.resolve_batch(missing)))
+            for ip, result in resolved.items():
+                if result is not None:
+                    self.cache.put(ip, result)
+            results = [resolved.get(ip) if result is None else result for ip, result in zip(ips, results)]
+
+        return results
+
+    def lookup_one(self, ip):
+        return self.lookup([ip])[0]
+
+    def enrich_events(self, events, ip_field='ip', valid_only=True):
+        # Gắn country_short/country_long/region/city vào từng event (dict) theo trường IP, sửa trực tiếp event
+        # valid_only: bỏ qua bản ghi không qua validate (VD: 'INVALID IP ADDRESS', '-') để không ghi rác vào event
+        for event, location in zip(events, self.lookup([event.get(ip_field) for event in events])):
+            if location is None:
+                continue
+            if valid_only and self.validate is not None and not self.validate(location)[0]:
+                continue
+            for field in LOCATION_FIELDS:
+                event[field] = location[field]
+        return events
+
+    def metrics(self):
+        return self.cache.metrics()
+
+    def report(self):
+        metrics = self.metrics()
+        print(f"--> Cache tra IP: {metrics['entries']} IP ({metrics['bytes'] / 1024 / 1024:.1f}MB), "
+              f"hit rate {metrics['hit_rate']:.1%} ({metrics['hits']} hit / {metrics['misses']} miss), "
+              f"{metrics['evictions']} lượt bỏ khỏi cache.")
+
+
+# Resolver dùng chung trong 1 process (Singleton), cho crawler/export gọi thẳng khi cần enrich event
+_ip_resolver = None
+_ip_resolver_lock = threading.Lock()
+
+
+def get_ip_resolver(max_entries=IP_CACHE_ENTRIES, max_bytes=None):
+    """
+    Trả về CachedIPResolver dùng chung, tạo lần đầu từ file BIN theo IP_DATA_PATH/IP_LOOKUP_ENGINE.
+    max_bytes mặc định lấy từ IP_CACHE_MB. VD:
+        resolver = get_ip_resolver()
+        resolver.enrich_events(events)
+    """
+    global _ip_resolver
+
+    with _ip_resolver_lock:
+        if _ip_resolver is None:
+            # Import khi cần để module không bắt buộc IP_DATA_PATH lúc import
+            from etl.transform.ip_processing import create_resolver, validate_data
+
+            if max_bytes is None and IP_CACHE_MB:
+                max_bytes = int(IP_CACHE_MB * 1024 * 1024)
+            _ip_resolver = CachedIPResolver(create_resolver(), max_entries, max_bytes, validate=validate_data)
+
+    return _ip_resolver
@@ -0,0 +1,75 @@
+import datetime
+import hashlib
+from etl.transform.ip_range_index import read_header, bin_signature
+
+CHECKSUM_CHUNK_BYTES = 8 * 1024 * 1024  # Đọc file BIN từng khối 8MB khi tính checksum
+
+
+def bin_fingerprint(bin_file, previous=None):
+    """
+    Phiên bản (loại DB + ngày phát hành trong header) và checksum SHA-256 của file BIN.
+    previous: fingerprint đã lưu lần trước, nếu kích thước + mtime không đổi thì dùng lại checksum cũ
+    để không phải đọc lại cả file BIN mỗi lần chạy.
+    """
+    signature = bin_signature(bin_file)
+    with open(bin_file, 'rb') as f:
+        header = read_header(f.read(21))
+        fingerprint = {'version': f"DB{header['dbtype']}-{header['db_date']}", **signature}
+
+        if previous and all(previous.get(key) == value for key, value in fingerprint.items()):
+            fingerprint['checksum'] = previous['checksum']
+            return fingerprint
+
+        f.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_BYTES), b''):
+            digest.update(chunk)
+
+    fingerprint['checksum'] = digest.hexdigest()
+    return fingerprint
+
+
+class IPEnrichState:
+    """
+    Trạng thái enrich IP tăng dần, lưu thành 1 document trong collection state_collection (cùng DB với kết quả):
+    - last_id: _id lớn nhất của raw_data đã được enrich xong (high-water mark).
+    - bin: fingerprint của file BIN đã dùng để tra (phiên bản + checksum).
+    - layout: cách lưu ip_locations (IP_LAYOUT) của lượt trước, đổi layout thì phải ghi lại toàn bộ.
+    Lưu cùng DB với ip_locations nên xóa/khôi phục DB thì state đi theo dữ liệu.
+    high-water mark chỉ được nâng sau khi ghi xong toàn bộ kết quả của lượt chạy.
+    """
+
+    def __init__(self, state_collection, target):
+        self.state_collection = state_collection
+        self.target = target
+
+    def load(self):
+        return self.state_collection.find_one({'_id': self.target}) or {}
+
+    def save(self, last_id, fingerprint, mode, stats, layout='document'):
+        self.state_collection.replace_one({'_id': self.target}, {
+            '_id': self.target,
+            'last_id': last_id,
+            'bin': fingerprint,
+            'layout': layout,
+            'last_run_mode': mode,
+            'last_run_resolved': stats['processed'],
+            'last_run_success': stats['success'],
+            'updated_at': datetime.datetime.now(datetime.timezone.utc)
+        }, upsert=True)
+
+    @staticmethod
+    def rebuild_reason(state, fingerprint, target_count, layout='document'):
+        # Trả về lý do phải tra lại toàn bộ IP, None nếu chỉ cần tra IP mới
+        if not state.get('last_id'):
+            return "chưa có high-water mark"
+        if target_count == 0:
+            return "collection kết quả đang rỗng"
+        if state.get('layout', 'document') != layout:
+            return f"đổi layout ({state.get('layout', 'document')} -> {layout})"
+        previous = state.get('bin') or {}
+        if previous.get('version') != fingerprint['version']:
+            return f"file BIN đổi phiên bản ({previous.get('version')} -> {fingerprint['version']})"
+        if previous.get('checksum') != fingerprint['checksum']:
+            return "file BIN đổi checksum"
+        return None
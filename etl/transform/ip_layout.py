@@ -0,0 +1,167 @@
+import os
+import socket
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from etl.transform.ip_range_index import parse_ip, MISSING_VALUE
+
+# Lấy thư mục gốc của project và file .env
+project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+load_dotenv(dotenv_path=os.path.join(project_dir, '.env'))
+
+# Cách lưu ip_locations:
+# - 'document' (mặc định): mỗi IP 1 document {ip, country_short, country_long, region, city} (như cũ)
+# - 'compact': mỗi IP 1 document {ip_key, geo_id}: ip_key là IP dạng nhị phân (4 byte IPv4 / 16 byte IPv6,
+#   giống NET.IP_FROM_STRING của BigQuery), geo_id trỏ vào bảng địa điểm ip_places (mỗi địa điểm lưu 1 lần)
+# - 'ranges': mỗi dải IP liền nhau cùng địa điểm (gộp từ file BIN) có chứa IP trong raw_data là 1 document
+#   {ip_from, ip_to, geo_id}
+IP_LAYOUT = os.environ.get('IP_LAYOUT', 'document').lower()
+
+if IP_LAYOUT not in ('document', 'compact', 'ranges'):
+    raise ValueError(f"LỖI: IP_LAYOUT '{IP_LAYOUT}' không hợp lệ. Chọn 'document', 'compact' hoặc 'ranges'")
+
+PLACES_COLLECTION = 'ip_places'  # Bảng địa điểm (geo_id -> country/region/city) của layout compact/ranges
+PLACE_FIELDS = ('country_short', 'country_long', 'region', 'city')
+
+# Trường khóa (unique index, upsert) của ip_locations theo từng layout
+LAYOUT_KEYS = {'document': 'ip', 'compact': 'ip_key', 'ranges': 'ip_from'}
+
+# Collection bị ghi lại tại chỗ (tra lại toàn bộ cấp _id mới, upsert giữ _id cũ) nên không xuất tăng dần theo _id được:
+# export incremental xuất lại cả bảng, BigQuery nạp đè thay vì MERGE
+SNAPSHOT_COLLECTIONS = ('ip_locations', PLACES_COLLECTION)
+
+
+def ip_key(ip_str):
+    # Chuỗi IP -> bytes (4 byte IPv4, 16 byte IPv6), None nếu sai định dạng
+    try:
+        if ':' in ip_str:
+            return socket.inet_pton(socket.AF_INET6, ip_str)
+        return socket.inet_pton(socket.AF_INET, ip_str)
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+def key_to_ip(key):
+    # Ngược lại của ip_key
+    return socket.inet_ntop(socket.AF_INET if len(key) == 4 else socket.AF_INET6, key)
+
+
+def layout_collections(collections, layout=IP_LAYOUT):
+    # Danh sách collection cần export/nạp: layout compact/ranges cần thêm bảng địa điểm
+    if layout == 'document' or PLACES_COLLECTION in collections:
+        return list(collections)
+    return list(collections) + [PLACES_COLLECTION]
+
+
+class PlaceRegistry:
+    """
+    Cấp geo_id cho từng bộ (country_short, country_long, region, city), lưu trong collection ip_places.
+    geo_id ổn định qua các lần chạy: địa điểm đã có giữ nguyên id, địa điểm mới lấy id kế tiếp.
+    Địa điểm mới được ghi vào ip_places trước khi trả id, nên document nào trỏ tới geo_id cũng đã có địa điểm.
+    Dùng chung cho nhiều luồng writer (có lock).
+    """
+
+    def __init__(self, places_collection):
+        self.places_collection = places_collection
+        self.places_collection.create_index([('geo_id', 1)], unique=True)
+
+        self._ids = {}
+        for place in places_collection.find({}, {'_id': 0}):
+            self._ids[tuple(place[field] for field in PLACE_FIELDS)] = place['geo_id']
+        self._next_id = max(self._ids.values(), default=0) + 1
+        self._lock = threading.Lock()
+        self.added = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def geo_ids(self, places):
+        # places: list tuple (country_short, country_long, region, city) -> list geo_id cùng thứ tự
+        with self._lock:
+            new_places = []
+            for place in dict.fromkeys(places):
+                if place not in self._ids:
+                    self._ids[place] = self._next_id
+                    new_places.append({'geo_id': self._next_id, **dict(zip(PLACE_FIELDS, place))})
+                    self._next_id += 1
+
+            if new_places:
+                self.places_collection.insert_many(new_places, ordered=False)
+                self.added += len(new_places)
+
+            return [self._ids[place] for place in places]
+
+
+def to_compact(docs, registry):
+    # Bản ghi đã chuẩn hóa {ip, country_short, ...} -> {ip_key, geo_id}
+    # Các chuỗi IP cùng địa chỉ (VD: khác hoa/thường, dạng viết tắt IPv6) chỉ giữ bản ghi đầu tiên
+    unique = {}
+    for doc in docs:
+        key = ip_key(doc['ip'])
+        if key is not None and key not in unique:
+            unique[key] = doc
+    docs = list(unique.items())
+    geo_ids = registry.geo_ids([tuple(doc[field] for field in PLACE_FIELDS) for _, doc in docs])
+    return [{'ip_key': key, 'geo_id': geo_id} for (key, _), geo_id in zip(docs, geo_ids)]
+
+
+class RangeCollector:
+    """
+    Layout 'ranges': gộp các dải liền nhau cùng địa điểm trong file BIN (IPRangeIndex.merged_ranges),
+    đánh dấu dải nào chứa ít nhất 1 IP hợp lệ của raw_data, cuối cùng mỗi dải được đánh dấu thành 1 document.
+    Chỉ giữ 1 mảng bool cho mỗi họ địa chỉ nên bộ nhớ không phụ thuộc số IP.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.ranges = {family: merged for family in (4, 6) if (merged := index.merged_ranges(family)) is not None}
+        self.used = {family: np.zeros(len(start), dtype=bool) for family, (start, _) in self.ranges.items()}
+        self._lock = threading.Lock()
+
+    def mark(self, docs):
+        # Đánh dấu các dải chứa IP của các bản ghi hợp lệ
+        values = {4: [], 6: []}
+        for doc in docs:
+            family, value = parse_ip(doc['ip'])
+            if family in self.ranges:
+                values[family].append(value)
+
+        for family, family_values in values.items():
+            if not family_values:
+                continue
+            start, _ = self.ranges[family]
+            rows = np.searchsorted(start, np.array(family_values, dtype=start.dtype), side='right') - 1
+            with self._lock:
+                self.used[family][rows[rows >= 0]] = True
+
+    def _place(self, codes, row):
+        dictionaries = self.index.dictionaries
+
+        def value(field, name):
+            code = -1 if codes[field] is None else int(codes[field][row])
+            return dictionaries[name][code] if code >= 0 else MISSING_VALUE
+
+        return (value('country', 'country_short'), value('country', 'country_long'),
+                value('region', 'region'), value('city', 'city'))
+
+    def count(self):
+        return int(sum(used.sum() for used in self.used.values()))
+
+    def iter_rows(self, registry, batch_size):
+        # Trả về từng lô document {ip_from, ip_to, geo_id} của các dải đã đánh dấu
+        for family, (start, codes) in self.ranges.items():
+            size = 4 if family == 4 else 16
+            last = (1 << (8 * size)) - 1
+            rows = np.flatnonzero(self.used[family])
+
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i:i + batch_size].tolist()
+                geo_ids = registry.geo_ids([self._place(codes, row) for row in batch])
+                docs = []
+                for row, geo_id in zip(batch, geo_ids):
+                    ip_from = int.from_bytes(start[row:row + 1].tobytes(), 'big') if family == 6 else int(start[row])
+                    ip_next = last + 1 if row + 1 == len(start) else \
+                        (int.from_bytes(start[row + 1:row + 2].tobytes(), 'big') if family == 6 else int(start[row + 1]))
+                    docs.append({'ip_from': ip_from.to_bytes(size, 'big'), 'ip_to': (ip_next - 1).to_bytes(size, 'big'),
+                                 'geo_id': geo_id})
+                yield docs
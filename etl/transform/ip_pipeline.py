@@ -0,0 +1,199 @@
+import concurrent.futures
+import multiprocessing
+import queue
+import threading
+import time
+
+WRITE_QUEUE_SIZE_PER_WRITER = 2 # Số lô chờ ghi tối đa cho mỗi luồng writer
+IN_FLIGHT_PER_WORKER = 2 # Số batch IP được giao cho mỗi process cùng lúc (đang chạy + chờ)
+_DONE = object() # Đánh dấu hết dữ liệu cho luồng writer
+
+
+class StageMeter:
+    # Đếm số phần tử và thời gian làm việc thực của 1 tầng (có thể nhiều luồng/process cùng cộng dồn)
+
+    def __init__(self, name, parallelism=1):
+        self.name = name
+        self.parallelism = parallelism
+        self.items = 0
+        self.busy = 0.0
+        self.wait = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items, busy, wait=0.0):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+            self.wait += wait
+
+    def rate(self):
+        # Tốc độ của 1 luồng/process khi làm việc liên tục
+        return self.items / self.busy if self.busy else float('inf')
+
+    def capacity(self):
+        # Tốc độ tối đa của cả tầng (nhân số luồng/process) - tầng có capacity nhỏ nhất là nút cổ chai
+        return self.rate() * self.parallelism
+
+
+class EnrichPipeline:
+    """
+    Pipeline 3 tầng cho enrich IP:
+    - Luồng gọi run() (reader) đọc từng batch IP từ MongoDB và giao cho pool process.
+    - Mỗi process (worker) tra cứu + chuẩn hóa + kiểm tra 1 batch, giữ handle file BIN/chỉ mục riêng
+      (init_worker chạy 1 lần trong mỗi process). Tối đa workers * IN_FLIGHT_PER_WORKER batch được giao cùng lúc.
+    - Các luồng writer lấy lô bản ghi hợp lệ từ write_queue (giới hạn kích thước) và insert song song.
+    Tầng sau chậm thì tầng trước phải chờ, nên RAM không phình ra khi MongoDB ghi chậm.
+    """
+
+    def __init__(self, init_worker, work, write, workers, writers, insert_batch_size, on_progress=None):
+        # work(batch) -> (bản ghi hợp lệ, số lượng theo loại kết quả, số IP, thời gian xử lý), chạy trong process con
+        # write(docs): ghi 1 lô vào MongoDB, chạy trong luồng writer
+        self.init_worker = init_worker
+        self.work = work
+        self.write = write
+        self.workers = workers
+        self.writers = writers
+        self.insert_batch_size = insert_batch_size
+        self.on_progress = on_progress
+
+        self.meters = {
+            'reader': StageMeter('reader'),
+            'worker': StageMeter('worker', workers),
+            'writer': StageMeter('writer', writers)
+        }
+        self.write_queue = queue.Queue(maxsize=writers * WRITE_QUEUE_SIZE_PER_WRITER)
+        self._stop = threading.Event()
+        self._error = None
+        self._pending_docs = []
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise self._error
+
+    def _writer_loop(self):
+        meter = self.meters['writer']
+        while True:
+            start = time.perf_counter()
+            try:
+                docs = self.write_queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            waited = time.perf_counter() - start
+            if docs is _DONE:
+                return
+            if self._stop.is_set():
+                # Đã có tầng lỗi: bỏ các lô còn lại để dừng nhanh
+                continue
+
+            start = time.perf_counter()
+            try:
+                self.write(docs)
+            except Exception as e:
+                self._fail(e)
+                return
+            meter.add(len(docs), time.perf_counter() - start, waited)
+
+    def _enqueue(self, docs):
+        # Giao 1 lô cho writer, chờ nếu writer đang bận (backpressure)
+        while True:
+            self._raise_if_failed()
+            try:
+                self.write_queue.put(docs, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _collect(self, future, stats):
+        valid, counts, items, busy = future.result()
+        self.meters['worker'].add(items, busy)
+        for key, value in counts.items():
+            if key in stats:
+                stats[key] += value
+
+        self._pending_docs.extend(valid)
+        while len(self._pending_docs) >= self.insert_batch_size:
+            self._enqueue(self._pending_docs[:self.insert_batch_size])
+            self._pending_docs = self._pending_docs[self.insert_batch_size:]
+            if self.on_progress:
+                self.on_progress()
+
+    def run(self, batches, stats):
+        writer_threads = [threading.Thread(target=self._writer_loop, name=f'ip-writer-{i}', daemon=True)
+                          for i in range(self.writers)]
+        for thread in writer_threads:
+            thread.start()
+
+        # spawn: process con không kế thừa MongoClient/file handle của process cha
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                          mp_context=multiprocessing.get_context('spawn'),
+                                                          initializer=self.init_worker)
+        reader = self.meters['reader']
+        futures = set()
+        try:
+            iterator = iter(batches)
+            while True:
+                start = time.perf_counter()
+                batch = next(iterator, None)
+                if batch is None:
+                    break
+                reader.add(len(batch), time.perf_counter() - start)
+
+                futures.add(executor.submit(self.work, batch))
+
+                # Đủ số batch đang giao thì chờ bớt trước khi đọc tiếp
+                while len(futures) >= self.workers * IN_FLIGHT_PER_WORKER:
+                    done, futures = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        self._collect(future, stats)
+
+            for future in concurrent.futures.as_completed(futures):
+                self._collect(future, stats)
+            futures = set()
+
+            if self._pending_docs:
+                self._enqueue(self._pending_docs)
+                self._pending_docs = []
+                if self.on_progress:
+                    self.on_progress()
+
+            for _ in writer_threads:
+                self._enqueue(_DONE)
+        except BaseException as e:
+            self._fail(e)
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            for thread in writer_threads:
+                thread.join()
+
+        self._raise_if_failed()
+
+    def report(self, duration):
+        # In tốc độ từng tầng để biết tầng nào là nút cổ chai
+        print(f"\n{'Tầng':<8} | {'Số lượng':<10} | {'Làm việc (s)':<12} | {'Tốc độ/luồng':<13} | {'Song song':<9} | {'Tối đa/s':<10}")
+        print("-" * 78)
+        for meter in self.meters.values():
+            print(f"{meter.name:<8} | {meter.items:<10} | {meter.busy:<12.2f} | {meter.rate():<13.0f} | "
+                  f"{meter.parallelism:<9} | {meter.capacity():<10.0f}")
+        print("-" * 78)
+
+        # Writer đếm theo bản ghi hợp lệ -> quy đổi ra số IP đầu vào để so sánh với 2 tầng kia
+        ips = self.meters['reader'].items
+        writer = self.meters['writer']
+        capacities = {
+            'reader': self.meters['reader'].capacity(),
+            'worker': self.meters['worker'].capacity(),
+            'writer': writer.capacity() * ips / writer.items if writer.items else float('inf')
+        }
+        bottleneck = min(capacities, key=capacities.get)
+        print(f"Tốc độ thực tế: {ips / duration:.0f} IP/s | "
+              f"Nút cổ chai: {bottleneck} (~{capacities[bottleneck]:.0f} IP/s)")
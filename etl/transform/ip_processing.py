@@ -1,13 +1,25 @@
 import IP2Location
 import time
 import os
-from config.get_mongo_connection import get_database, close_connection
+from collections import Counter
+from config.get_mongo_connection import get_database, get_batch_size, close_connection
 from src.get_data_from_env import get_filename
+from etl.transform.ip_range_index import IPRangeIndex
+from etl.transform.ip_pipeline import EnrichPipeline
+from etl.transform.ip_enrich_state import IPEnrichState, bin_fingerprint
+from etl.transform.ip_layout import (IP_LAYOUT, LAYOUT_KEYS, PLACES_COLLECTION, PlaceRegistry, RangeCollector,
+                                     ip_key, to_compact)
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 
 SOURCE_COLLECTION = 'raw_data'  # Collection chứa dữ liệu gốc
 TARGET_COLLECTION = 'ip_locations'  # Collection mới để chứa kết quả
 IP_FIELD_NAME = 'ip'  # Tên trường chứa IP
+LOOKUP_BATCH_SIZE = 10000  # Số IP tra cứu mỗi lượt
+INSERT_BATCH_SIZE = 10000  # Số document mỗi lần insert_many
+STATE_COLLECTION = 'etl_state'  # Collection lưu high-water mark + fingerprint file BIN của lượt enrich gần nhất
+REBUILD_COLLECTION = f'{TARGET_COLLECTION}_rebuild'  # Collection tạm khi tra lại toàn bộ ở chế độ incremental
 
 # Lấy thư mục file hiện tại
 current_dir = os.path.dirname(__file__)
@@ -24,6 +36,37 @@ ip_data_path = os.environ.get('IP_DATA_PATH')
 
 ip_filename = get_filename(ip_data_path, 'IP_DATA_PATH')
 
+# Cách tra IP:
+# - 'library' (mặc định): gọi IP2Location.get_all cho từng IP (đọc file BIN mỗi lần tra)
+# - 'index': nạp dải IP từ file BIN 1 lần vào mảng NumPy, tra cả batch bằng searchsorted (xem ip_range_index.py)
+IP_LOOKUP_ENGINE = os.environ.get('IP_LOOKUP_ENGINE', 'library').lower()
+
+if IP_LOOKUP_ENGINE not in ('library', 'index'):
+    raise ValueError(f"LỖI: IP_LOOKUP_ENGINE '{IP_LOOKUP_ENGINE}' không hợp lệ. Chọn 'library' hoặc 'index'")
+
+# (Tùy chọn) thư mục lưu chỉ mục dải IP dạng .npy để các lần sau mở bằng mmap thay vì dựng lại từ file BIN
+ip_index_cache_path = os.environ.get('IP_INDEX_CACHE_PATH')
+
+# Chế độ chạy:
+# - 'inline' (mặc định): đọc -> tra cứu -> insert tuần tự trong 1 luồng
+# - 'parallel': reader đọc IP theo batch, IP_WORKERS process tra cứu/kiểm tra, IP_WRITERS luồng insert song song
+IP_PROCESS_MODE = os.environ.get('IP_PROCESS_MODE', 'inline').lower()
+
+if IP_PROCESS_MODE not in ('inline', 'parallel'):
+    raise ValueError(f"LỖI: IP_PROCESS_MODE '{IP_PROCESS_MODE}' không hợp lệ. Chọn 'inline' hoặc 'parallel'")
+
+# Cách làm mới ip_locations:
+# - 'full' (mặc định): xóa hết và tra lại mọi IP trong raw_data
+# - 'incremental': chỉ tra IP mới xuất hiện sau high-water mark _id và chưa có trong ip_locations, upsert theo ip.
+#   Tự tra lại toàn bộ khi chưa có state, ip_locations rỗng hoặc file BIN đổi phiên bản/checksum
+IP_REFRESH_MODE = os.environ.get('IP_REFRESH_MODE', 'full').lower()
+
+if IP_REFRESH_MODE not in ('full', 'incremental'):
+    raise ValueError(f"LỖI: IP_REFRESH_MODE '{IP_REFRESH_MODE}' không hợp lệ. Chọn 'full' hoặc 'incremental'")
+
+IP_WORKERS = int(os.environ.get('IP_WORKERS') or os.cpu_count() or 1)
+IP_WRITERS = int(os.environ.get('IP_WRITERS') or 2)
+
 # DATA QUALITY (CHUẨN HÓA & VALIDATE)
 def normalize_data(ip_str, record):
     # Hàm chuẩn hóa dữ liệu trước khi lưu
@@ -54,6 +97,117 @@ def validate_data(item):
 
     return True, 'valid'
 
+def create_resolver():
+    # Trả về hàm tra 1 batch IP -> list bản ghi đã chuẩn hóa (None nếu tra lỗi) theo IP_LOOKUP_ENGINE
+    if IP_LOOKUP_ENGINE == 'index':
+        start_time = time.time()
+        index = IPRangeIndex.open(ip_filename, ip_index_cache_path)
+        print(f"--> Đã nạp chỉ mục dải IP ({index.meta['ipv4_count']} dải IPv4, {index.meta['ipv6_count']} dải IPv6) "
+              f"trong {time.time() - start_time:.2f}s.")
+        return index.lookup
+
+    ip_data = IP2Location.IP2Location(ip_filename)
+
+    def resolve(ip_list):
+        results = []
+        for ip_str in ip_list:
+            try:
+                results.append(normalize_data(ip_str, ip_data.get_all(ip_str)))
+            except Exception as e:
+                print(f"{e}")
+                results.append(None)
+        return results
+
+    return resolve
+
+def validate_batch(items):
+    # Kiểm tra cả batch bản ghi đã tra cứu, trả về (bản ghi hợp lệ, số lượng theo từng loại kết quả của stats)
+    valid = []
+    counts = Counter()
+    for normalized_item in items:
+        if normalized_item is None:
+            counts['err_exception'] += 1
+            continue
+
+        is_valid, reason = validate_data(normalized_item)
+
+        if is_valid:
+            counts['success'] += 1
+            valid.append(normalized_item)
+        else:
+            counts[f"dq_{reason}"] += 1
+    return valid, counts
+
+# Resolver riêng của từng process worker (chế độ parallel), tạo 1 lần khi process khởi động
+_worker_resolve = None
+
+def init_enrich_worker():
+    # Mỗi process tự mở file BIN (engine library) hoặc mở chỉ mục qua mmap dùng chung page cache (engine index)
+    global _worker_resolve
+    _worker_resolve = create_resolver()
+
+def enrich_batch(ip_batch):
+    # Chạy trong process worker: tra cứu + chuẩn hóa + kiểm tra 1 batch IP
+    start = time.perf_counter()
+    valid, counts = validate_batch(_worker_resolve(ip_batch))
+    return valid, counts, len(ip_batch), time.perf_counter() - start
+
+def merge_counts(stats, counts):
+    for key, value in counts.items():
+        if key in stats:
+            stats[key] += value
+
+def iter_ip_batches(ip_cursor, stats, batch_size=LOOKUP_BATCH_SIZE):
+    # Gom IP từ cursor thành từng batch để tra cứu, đếm luôn IP rỗng
+    batch = []
+    for ip in ip_cursor:
+        stats['processed'] += 1
+
+        # Lấy chính xác chuỗi IP ra khỏi dictionary của MongoDB
+        ip_str = ip.get('_id')
+
+        if not ip_str:
+            stats['dq_missing_ip'] += 1
+            continue
+
+        batch.append(ip_str)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+def upsert_docs(collection, docs, key=IP_FIELD_NAME):
+    # Ghi đè theo trường khóa (unique index), bản ghi đã có thì cập nhật, chưa có thì thêm
+    if not docs:
+        return
+    collection.bulk_write([UpdateOne({key: doc[key]}, {'$set': doc}, upsert=True) for doc in docs], ordered=False)
+
+def skip_known_keys(ip_batches, collection, stats):
+    # Layout compact: bỏ IP đã có ip_key trong collection kết quả ($lookup không so được chuỗi IP với ip_key nhị phân)
+    for batch in ip_batches:
+        keys = {ip: key for ip in batch if (key := ip_key(ip)) is not None}
+        known = {doc['ip_key'] for doc in collection.find({'ip_key': {'$in': list(keys.values())}}, {'ip_key': 1, '_id': 0})}
+        pending = [ip for ip in batch if keys.get(ip) not in known]
+        stats['skipped_known'] += len(batch) - len(pending)
+        if pending:
+            yield pending
+
+def build_ip_pipeline(id_range, skip_known=False):
+    # Gom IP duy nhất của các event trong khoảng _id, skip_known=True thì bỏ IP đã có trong collection kết quả
+    stages = [
+        {"$match": {"_id": id_range}},
+        {"$group": {"_id": f"${IP_FIELD_NAME}"}}
+    ]
+    if skip_known:
+        stages += [
+            {"$lookup": {"from": TARGET_COLLECTION, "localField": "_id", "foreignField": IP_FIELD_NAME, "as": "known"}},
+            {"$match": {"known.0": {"$exists": False}}},
+            {"$project": {"_id": 1}}
+        ]
+    return stages
+
 def process_ip_locations():
     # Hàm xử lý dữ liệu IP và đẩy vào MongoDB
 
@@ -62,17 +216,83 @@ def process_ip_locations():
         print(f"Lỗi: Không tìm thấy file '{ip_filename}'.")
         return
 
-    # Connect to MongoDB
-    db = get_database()
-    src_collection = db[SOURCE_COLLECTION]
-    tgt_collection = db[TARGET_COLLECTION]
+    # Load dữ liệu IP từ file BIN trước khi xóa/dựng lại ip_locations: file BIN hỏng thì dừng khi dữ liệu cũ còn nguyên
+    # (chế độ parallel: mỗi process worker tự load, ở đây chỉ kiểm tra file và dựng sẵn cache chỉ mục nếu có)
+    ranges = None
+    try:
+        resolve = create_resolver()
+        if IP_LAYOUT == 'ranges':
+            ranges = RangeCollector(IPRangeIndex.open(ip_filename, ip_index_cache_path))
+    except Exception as e:
+        print(f"Lỗi đọc file BIN: {e}")
+        return
+
+    try:
+        _process_ip_locations(resolve, ranges)
+    finally:
+        close_connection()
+
+
+def _process_ip_locations(resolve, ranges):
+    # Phần chính của process_ip_locations (file BIN đã nạp sẵn), kết nối MongoDB được đóng ở hàm gọi
+    # Connect to MongoDB: quét raw_data bằng profile incremental-scan (RawBSONDocument, nén, đọc từ primary để
+    # cận trên _id và các lượt quét cùng 1 bản dữ liệu), ghi kết quả bằng profile writer
+    src_collection = get_database('incremental-scan')[SOURCE_COLLECTION]
+    writer_db = get_database('writer')
+    tgt_collection = writer_db[TARGET_COLLECTION]
+    key_field = LAYOUT_KEYS[IP_LAYOUT]
 
     # Tạo index cho collection (nếu chưa tồn tại)
     print(f"Đang kiểm tra và tạo Index cho trường {IP_FIELD_NAME}...")
     src_collection.create_index([(IP_FIELD_NAME, 1)])
 
-    # Xóa dữ liệu cũ trong bảng kết quả (nếu có) để chạy lại cho sạch
-    tgt_collection.delete_many({})
+    # Chốt cận trên _id trước khi quét: event được ghi thêm trong lúc chạy thuộc về lượt sau
+    latest = src_collection.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    if latest is None:
+        print(f"=> Collection '{SOURCE_COLLECTION}' chưa có dữ liệu.")
+        return
+    upper_id = latest['_id']
+    id_range = {'$lte': upper_id}
+
+    state = IPEnrichState(writer_db[STATE_COLLECTION], TARGET_COLLECTION)
+    saved_state = state.load()
+    fingerprint = bin_fingerprint(ip_filename, saved_state.get('bin'))
+
+    # Chọn cách làm mới:
+    # - full: xóa hết rồi tra lại toàn bộ (như cũ)
+    # - incremental: chỉ tra IP mới sau high-water mark và chưa có trong ip_locations, upsert
+    # - rebuild (incremental nhưng chưa có state/đổi file BIN): tra lại toàn bộ vào collection tạm rồi đổi tên,
+    #   ip_locations cũ vẫn dùng được cho tới khi bản mới hoàn tất
+    refresh_mode = IP_REFRESH_MODE
+    write_collection = tgt_collection
+    if IP_REFRESH_MODE == 'incremental':
+        reason = IPEnrichState.rebuild_reason(saved_state, fingerprint, tgt_collection.estimated_document_count(),
+                                              IP_LAYOUT)
+        if reason is None:
+            try:
+                tgt_collection.create_index([(key_field, 1)], unique=True)
+            except OperationFailure as e:
+                reason = f"không tạo được unique index cho {key_field} ({e})"
+
+        if reason is None:
+            if upper_id <= saved_state['last_id']:
+                print(f"=> '{TARGET_COLLECTION}' đã cập nhật tới _id {saved_state['last_id']}, không có event mới.")
+                return
+            id_range['$gt'] = saved_state['last_id']
+            print(f"--> Incremental: chỉ tra IP mới của các event có _id trong ({saved_state['last_id']}, {upper_id}].")
+        else:
+            refresh_mode = 'rebuild'
+            print(f"--> Tra lại toàn bộ IP vào '{REBUILD_COLLECTION}': {reason}.")
+            write_collection = writer_db[REBUILD_COLLECTION]
+            write_collection.drop()
+            write_collection.create_index([(key_field, 1)], unique=True)
+    elif IP_LAYOUT == 'document':
+        # Xóa dữ liệu cũ trong bảng kết quả (nếu có) để chạy lại cho sạch
+        tgt_collection.delete_many({})
+    else:
+        # Layout compact/ranges: xóa cả collection để bỏ index của layout cũ
+        tgt_collection.drop()
+        tgt_collection.create_index([(key_field, 1)], unique=True)
 
     # 2. Read unique IPs from main collection
     # print(f"Đang quét danh sách IP duy nhất từ '{SOURCE_COLLECTION}'...")
@@ -81,37 +301,48 @@ def process_ip_locations():
     # print(f"=> Tìm thấy {ip_count} IP duy nhất.")
 
     # Lấy ra danh sách các unique IP cần quét
-    # Đếm tổng số IP duy nhất trước (để làm stats)
-    count_pipeline = [
-        {"$group": {"_id": f"${IP_FIELD_NAME}"}},
-        {"$count": "total_ips"}
-    ]
-    # allowDiskUse=True: Cho phép MongoDB dùng ổ cứng để sort/group nếu RAM server không đủ
-    count_result = list(src_collection.aggregate(count_pipeline, allowDiskUse=True))
-    ip_count = count_result[0]['total_ips'] if count_result else 0
-
-    print(f"=> Tìm thấy {ip_count} IP duy nhất.")
-
-    # Tạo cursor để duyệt dữ liệu
-    data_pipeline = [
-        {"$group": {"_id": f"${IP_FIELD_NAME}"}}
-    ]
-    ip_unique = src_collection.aggregate(data_pipeline, allowDiskUse=True)
-
-    # Load dữ liệu IP từ file BIN
-    try:
-        ip_data = IP2Location.IP2Location(ip_filename)
-    except Exception as e:
-        print(f"Lỗi đọc file BIN: {e}")
+    ip_count = None
+    if refresh_mode == 'full':
+        # Đếm tổng số IP duy nhất trước (để làm stats)
+        count_pipeline = build_ip_pipeline(id_range) + [{"$count": "total_ips"}]
+        # allowDiskUse=True: Cho phép MongoDB dùng ổ cứng để sort/group nếu RAM server không đủ
+        count_result = list(src_collection.aggregate(count_pipeline, allowDiskUse=True))
+        ip_count = count_result[0]['total_ips'] if count_result else 0
+
+        print(f"=> Tìm thấy {ip_count} IP duy nhất.")
+
+    # Tạo cursor để duyệt dữ liệu (incremental/rebuild không đếm trước để chỉ phải aggregate 1 lần)
+    data_pipeline = build_ip_pipeline(id_range, skip_known=refresh_mode == 'incremental' and IP_LAYOUT == 'document')
+    ip_unique = src_collection.aggregate(data_pipeline, allowDiskUse=True, batchSize=get_batch_size('incremental-scan'))
+
+    # Layout compact: nhiều chuỗi IP khác nhau có thể cùng 1 ip_key (VD: '2001:DB8::1' và '2001:db8::1'),
+    # insert_many sẽ lỗi trùng unique index ở batch sau nên luôn upsert theo ip_key
+    if refresh_mode == 'incremental' or IP_LAYOUT == 'compact':
+        store_docs = lambda docs: upsert_docs(write_collection, docs, key_field)
+    else:
+        store_docs = lambda docs: write_collection.insert_many(docs, ordered=False)
+
+    # Chuyển bản ghi đã kiểm tra sang layout của ip_locations trước khi ghi
+    registry = None
+    if IP_LAYOUT == 'document':
+        write_docs = store_docs
+    else:
+        registry = PlaceRegistry(writer_db[PLACES_COLLECTION])
+        if IP_LAYOUT == 'compact':
+            write_docs = lambda docs: store_docs(to_compact(docs, registry))
+        else:
+            # Layout ranges: chỉ đánh dấu dải chứa IP, ghi các dải sau khi tra xong
+            write_docs = ranges.mark
 
     stats = {
-        'total': ip_count,
+        'total': ip_count,  # None nếu không đếm trước (incremental/rebuild)
         'processed': 0,
         'success': 0,  # Đã lưu vào DB
         'dq_invalid_ip': 0,  # IP sai format
         'dq_missing_location_info': 0,  # Thiếu Country/Region/City (Gom chung)
         'dq_missing_ip': 0,  # Input rỗng
-        'err_exception': 0
+        'err_exception': 0,
+        'skipped_known': 0  # Incremental layout compact: IP đã có trong ip_locations
     }
 
     # Tạo một danh sách rỗng để chứa các data lấy được từ địa chỉ ip
@@ -123,58 +354,65 @@ def process_ip_locations():
     print(f"BẮT ĐẦU XỬ LÝ IP")
     print(f"{'Processed':<10} | {'Pending':<10} | {'Success':<10} | {'Missing IP':<10} | {'Missing Loc':<10} | {'Invalid':<10}")
     print("-" * 80)
-    print(f"{0:<10} | {stats['total']:<10} | {stats['success']:<10} | {stats['dq_missing_ip']:<10} | {stats['dq_missing_location_info']:<10} | {stats['dq_invalid_ip']:<10}")
+    print(f"{0:<10} | {stats['total'] if ip_count is not None else '-':<10} | {stats['success']:<10} | {stats['dq_missing_ip']:<10} | {stats['dq_missing_location_info']:<10} | {stats['dq_invalid_ip']:<10}")
 
-    for ip in ip_unique:
-        stats['processed'] += 1
+    def print_progress():
+        pending = max(ip_count - stats['processed'], 0) if ip_count is not None else '-'
+        print(f"{stats['processed']:<10} | {pending:<10} | {stats['success']:<10} | {stats['dq_missing_ip']:<10} | {stats['dq_missing_location_info']:<10} | {stats['dq_invalid_ip']:<10}")
 
-        # Lấy chính xác chuỗi IP ra khỏi dictionary của MongoDB
-        ip_str = ip.get('_id')
+    ip_batches = iter_ip_batches(ip_unique, stats)
+    if refresh_mode == 'incremental' and IP_LAYOUT == 'compact':
+        ip_batches = skip_known_keys(ip_batches, tgt_collection, stats)
+
+    pipeline = None
+    if IP_PROCESS_MODE == 'parallel':
+        print(f"--> Chế độ parallel: {IP_WORKERS} process tra cứu, {IP_WRITERS} luồng insert.")
+        pipeline = EnrichPipeline(init_enrich_worker, enrich_batch,
+                                  write_docs,
+                                  IP_WORKERS, IP_WRITERS, INSERT_BATCH_SIZE, on_progress=print_progress)
+        pipeline.run(ip_batches, stats)
+    else:
+        for ip_batch in ip_batches:
+            # Tra cứu + chuẩn hóa + kiểm tra cả batch
+            valid, counts = validate_batch(resolve(ip_batch))
+            merge_counts(stats, counts)
+            ip_data_list.extend(valid)
+
+            # Khi nào đủ INSERT_BATCH_SIZE document thì insert một thể
+            if len(ip_data_list) >= INSERT_BATCH_SIZE:
+                write_docs(ip_data_list)
+                inserted_count += len(ip_data_list)
+                # Reset thùng chứa
+                ip_data_list = []
+                print_progress()
+
+        # Ghi nốt số dữ liệu còn dư
+        if ip_data_list:
+            write_docs(ip_data_list)
+            inserted_count += len(ip_data_list)
+            print_progress()
 
-        if not ip_str:
-            stats['dq_missing_ip'] += 1
-            continue
+    range_count = 0
+    if ranges is not None:
+        for docs in ranges.iter_rows(registry, INSERT_BATCH_SIZE):
+            store_docs(docs)
+            range_count += len(docs)
 
-        try:
-            document = ip_data.get_all(ip_str)
-            # Chuẩn hóa
-            normalized_item = normalize_data(ip_str, document)
-            # Kiểm tra
-            is_valid, reason = validate_data(normalized_item)
-
-            if is_valid:
-                stats['success'] += 1
-                ip_data_list.append(normalized_item)
-            else:
-                dq_key = f"dq_{reason}"
-                if dq_key in stats:
-                    stats[dq_key] += 1
-        except Exception as e:
-            print(f"{e}")
-            continue
+    # Bản tra lại toàn bộ đã hoàn tất: thay thế ip_locations cũ (rename là thao tác nguyên tử)
+    if refresh_mode == 'rebuild':
+        write_collection.rename(TARGET_COLLECTION, dropTarget=True)
 
-        # Khi nào đủ 10000 document thì insert một thể
-        if len(ip_data_list) >= 10000:
-            tgt_collection.insert_many(ip_data_list)
-            inserted_count += len(ip_data_list)
-            pending = stats['total'] - stats['processed']
-            # Reset thùng chứa
-            ip_data_list = []
-            print(f"{stats['processed']:<10} | {pending:<10} | {stats['success']:<10} | {stats['dq_missing_ip']:<10} | {stats['dq_missing_location_info']:<10} | {stats['dq_invalid_ip']:<10}")
-
-    # Ghi nốt số dữ liệu còn dư
-    if ip_data_list:
-        tgt_collection.insert_many(ip_data_list)
-        inserted_count += len(ip_data_list)
-        pending = 0
-        print(f"{stats['processed']:<10} | {pending:<10} | {stats['success']:<10} | {stats['dq_missing_ip']:<10} | {stats['dq_missing_location_info']:<10} | {stats['dq_invalid_ip']:<10}")
+    # Nâng high-water mark sau cùng: chết giữa chừng thì lần sau tra lại đúng khoảng này (upsert nên không trùng)
+    state.save(upper_id, fingerprint, refresh_mode, stats, IP_LAYOUT)
 
-    close_connection()
     duration = time.time() - start_time
+    if ip_count is None:
+        stats['total'] = stats['processed']
 
     print("\n" + "=" * 40)
     print(f"HOÀN TẤT IP PROCESSING")
     print("-" * 50)
+    print(f"Chế độ                  : {refresh_mode} (high-water mark: {upper_id}, BIN {fingerprint['version']})")
     print(f"Tổng thời gian          : {duration:.2f}s")
     print(f"Tổng Input              : {stats['total']}")
     print("-" * 30)
@@ -184,8 +422,18 @@ def process_ip_locations():
     print(f" - Missing IP           : {stats['dq_missing_ip']}")
     print(f" - Missing Location     : {stats['dq_missing_location_info']} ")
     print(f" - Invalid IP           : {stats['dq_invalid_ip']}")
+    print(f" - Lỗi tra cứu          : {stats['err_exception']}")
+    if stats['skipped_known']:
+        print(f" - Đã có trong DB       : {stats['skipped_known']}")
     print("-" * 50)
-    print(f"MongoDB: Saved to '{TARGET_COLLECTION}'")
+    print(f"MongoDB: Saved to '{TARGET_COLLECTION}' (layout {IP_LAYOUT})")
+    if registry is not None:
+        print(f"Địa điểm: {len(registry)} trong '{PLACES_COLLECTION}' (+{registry.added} mới)")
+    if ranges is not None:
+        print(f"Dải IP đã ghi: {range_count}")
+
+    if pipeline is not None:
+        pipeline.report(duration)
 
 if __name__ == "__main__":
     process_ip_locations()
\ No newline at end of file
@@ -0,0 +1,292 @@
+import json
+import os
+import socket
+import struct
+import numpy as np
+
+# Vị trí cột (1-based, cột 1 là ip_from) của từng trường theo loại DB (chỉ số = dbtype), giống thư viện IP2Location
+COUNTRY_POSITION = (0,) + (2,) * 26
+REGION_POSITION = (0, 0, 0) + (3,) * 24
+CITY_POSITION = (0, 0, 0) + (4,) * 24
+
+CODE_FIELDS = {'country': COUNTRY_POSITION, 'region': REGION_POSITION, 'city': CITY_POSITION}
+FAMILIES = (4, 6)
+
+# Id từ điển đặc biệt: không có dải IP chứa địa chỉ / địa chỉ sai định dạng / tra IPv6 trên file BIN chỉ có IPv4
+NOT_FOUND = -1
+INVALID = -2
+NO_IPV6_TABLE = -3
+
+# Giá trị trả về cho các trường hợp trên, giống thư viện IP2Location ('-' khi thiếu dữ liệu)
+MISSING_VALUE = '-'
+INVALID_IP_VALUE = 'INVALID IP ADDRESS'
+NO_IPV6_TABLE_VALUE = 'IPV6 ADDRESS MISSING IN IPV4 BIN'
+
+# Các dạng IPv6 chứa IPv4 mà thư viện IP2Location tra trong bảng IPv4
+IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+SIXTO4_PREFIX = b'\x20\x02'
+TEREDO_PREFIX = b'\x20\x01\x00\x00'
+
+CACHE_FORMAT = 1
+CACHE_META_FILE = 'index.json'
+
+
+def parse_ip(ip_str):
+    """
+    Đổi chuỗi IP thành (4, int) hoặc (6, 16 byte big-endian); (0, None) nếu sai định dạng.
+    IPv4-mapped (::ffff:a.b.c.d), 6to4 (2002::/16) và Teredo (2001:0::/32) được quy về IPv4.
+    Không strip khoảng trắng, để IP nào sai định dạng với thư viện IP2Location thì ở đây cũng sai.
+    """
+    if not isinstance(ip_str, str):
+        return 0, None
+    try:
+        if ':' not in ip_str:
+            return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip_str), 'big')
+        packed = socket.inet_pton(socket.AF_INET6, ip_str)
+    except (OSError, ValueError):
+        return 0, None
+
+    if packed.startswith(IPV4_MAPPED_PREFIX):
+        return 4, int.from_bytes(packed[12:], 'big')
+    if packed.startswith(SIXTO4_PREFIX):
+        return 4, int.from_bytes(packed[2:6], 'big')
+    if packed.startswith(TEREDO_PREFIX):
+        return 4, ~int.from_bytes(packed[12:], 'big') & 0xFFFFFFFF
+    return 6, packed
+
+
+def read_header(mm):
+    # 21 byte đầu file BIN: loại DB, số cột, ngày phát hành, số dòng và địa chỉ (1-based) của bảng IPv4/IPv6
+    dbtype, dbcolumn, year, month, day, v4_count, v4_addr, v6_count, v6_addr = struct.unpack('<5B4I', bytes(mm[:21]))
+    if not 0 < dbtype < len(COUNTRY_POSITION) or dbcolumn < 2:
+        raise ValueError(f"LỖI: File BIN không đúng định dạng IP2Location (dbtype={dbtype}, dbcolumn={dbcolumn})")
+
+    return {
+        'dbtype': dbtype,
+        'dbcolumn': dbcolumn,
+        'db_date': f"20{year:02d}-{month:02d}-{day:02d}",
+        'ipv4_count': v4_count,
+        'ipv4_addr': v4_addr,
+        'ipv6_count': v6_count,
+        'ipv6_addr': v6_addr
+    }
+
+
+def read_string(mm, offset):
+    # Chuỗi trong BIN: 1 byte độ dài + nội dung (decode iso-8859-1 giống thư viện IP2Location)
+    length = int(mm[offset])
+    return bytes(mm[offset + 1:offset + 1 + length]).decode('iso-8859-1').strip()
+
+
+def read_table(mm, header, family):
+    """
+    Các cột của bảng IPv4/IPv6 dưới dạng mảng NumPy trỏ thẳng vào file BIN đã mmap (không copy):
+    start (ip_from của từng dải, đã sắp xếp) và con trỏ chuỗi của country/region/city.
+    Mỗi dải kéo dài tới ip_from của dải kế tiếp.
+    """
+    count = header[f'ipv{family}_count']
+    if not count:
+        return None
+
+    base = header[f'ipv{family}_addr'] - 1
+    ip_size = 4 if family == 4 else 16
+    width = header['dbcolumn'] * 4 + ip_size - 4
+
+    if family == 4:
+        start = np.ndarray((count,), dtype='<u4', buffer=mm, offset=base, strides=(width,))
+    else:
+        # ip_from IPv6 lưu little-endian -> đảo thành big-endian để so sánh chuỗi byte đúng thứ tự số
+        raw = np.ndarray((count, 16), dtype=np.uint8, buffer=mm, offset=base, strides=(width, 1))
+        start = np.ascontiguousarray(raw[:, ::-1]).view('S16').ravel()
+
+    table = {'start': start}
+    for field, positions in CODE_FIELDS.items():
+        position = positions[header['dbtype']]
+        table[field] = None if not position else \
+            np.ndarray((count,), dtype='<u4', buffer=mm, offset=base + ip_size + 4 * (position - 2), strides=(width,))
+    return table
+
+
+def encode_pointers(mm, tables):
+    """
+    Mã hóa từ điển: mỗi con trỏ chuỗi khác nhau (BIN dùng chung 1 con trỏ cho cùng 1 giá trị) thành 1 id int32,
+    đọc chuỗi 1 lần cho mỗi id. Trả về (tables với cột id thay cho cột con trỏ, từ điển chuỗi theo trường).
+    """
+    dictionaries = {'country_short': [], 'country_long': [], 'region': [], 'city': []}
+    encoded = {family: {'start': table['start']} for family, table in tables.items()}
+
+    for field in CODE_FIELDS:
+        columns = [table[field] for table in tables.values() if table[field] is not None]
+        pointers = np.unique(np.concatenate(columns)) if columns else np.array([], dtype=np.uint32)
+
+        for family, table in tables.items():
+            encoded[family][field] = None if table[field] is None else \
+                np.searchsorted(pointers, table[field]).astype(np.int32)
+
+        if field == 'country':
+            # Tên nước viết tắt nằm tại con trỏ, tên đầy đủ ở con trỏ + 3
+            dictionaries['country_short'] = [read_string(mm, int(p)) for p in pointers]
+            dictionaries['country_long'] = [read_string(mm, int(p) + 3) for p in pointers]
+        else:
+            dictionaries[field] = [read_string(mm, int(p)) for p in pointers]
+
+    return encoded, dictionaries
+
+
+def bin_signature(bin_file):
+    stat = os.stat(bin_file)
+    return {'bin_size': stat.st_size, 'bin_mtime_ns': stat.st_mtime_ns}
+
+
+class IPRangeIndex:
+    """
+    Chỉ mục dải IP nạp 1 lần từ file BIN IP2Location: với mỗi họ địa chỉ (IPv4/IPv6) có mảng start đã sắp xếp
+    và các mảng id country/region/city (mã hóa từ điển). Tra cả batch IP bằng np.searchsorted thay vì đọc file
+    cho từng IP, chuỗi trong từ điển đã strip sẵn nên không phải chuẩn hóa lại từng bản ghi.
+    Có cache_dir: chỉ mục được lưu thành các file .npy và các lần sau mở bằng mmap (process con dùng chung page cache),
+    tự dựng lại khi file BIN đổi (kích thước/thời gian sửa).
+    """
+
+    def __init__(self, tables, dictionaries, meta):
+        self.tables = tables
+        self.dictionaries = dictionaries
+        self.meta = meta
+
+        # Id âm được tra thẳng bằng chỉ số âm của list Python:
+        # -1 (NOT_FOUND) -> '-', -2 (INVALID) -> INVALID IP ADDRESS, -3 (NO_IPV6_TABLE) -> IPV6 ADDRESS MISSING IN IPV4 BIN
+        self._values = {field: values + [NO_IPV6_TABLE_VALUE, INVALID_IP_VALUE, MISSING_VALUE]
+                        for field, values in dictionaries.items()}
+
+    @classmethod
+    def from_bin(cls, bin_file):
+        mm = np.memmap(bin_file, dtype=np.uint8, mode='r')
+        header = read_header(mm)
+        tables = {family: table for family in FAMILIES if (table := read_table(mm, header, family)) is not None}
+        tables, dictionaries = encode_pointers(mm, tables)
+        return cls(tables, dictionaries, {**header, **bin_signature(bin_file)})
+
+    @classmethod
+    def open(cls, bin_file, cache_dir=None):
+        if not cache_dir:
+            return cls.from_bin(bin_file)
+
+        index = cls.load(cache_dir, bin_file)
+        if index is None:
+            cls.from_bin(bin_file).save(cache_dir)
+            index = cls.load(cache_dir, bin_file)
+        return index
+
+    def save(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        for family, table in self.tables.items():
+            for name, array in table.items():
+                if array is not None:
+                    np.save(os.path.join(cache_dir, f"ipv{family}_{name}.npy"), array)
+
+        # File meta ghi sau cùng: cache chỉ hợp lệ khi mọi mảng đã ghi xong
+        meta_file = os.path.join(cache_dir, CACHE_META_FILE)
+        tmp_file = meta_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'format': CACHE_FORMAT, 'meta': self.meta, 'dictionaries': self.dictionaries,
+                       'tables': {family: [name for name, array in table.items() if array is not None]
+                                  for family, table in self.tables.items()}}, f, ensure_ascii=False)
+        os.replace(tmp_file, meta_file)
+
+    @classmethod
+    def load(cls, cache_dir, bin_file=None):
+        # Trả về None nếu chưa có cache hoặc cache dựng từ file BIN khác
+        meta_file = os.path.join(cache_dir, CACHE_META_FILE)
+        if not os.path.exists(meta_file):
+            return None
+
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        meta = data['meta']
+        if data.get('format') != CACHE_FORMAT:
+            return None
+        if bin_file is not None and any(meta[key] != value for key, value in bin_signature(bin_file).items()):
+            return None
+
+        tables = {}
+        for family, names in data['tables'].items():
+            table = {field: None for field in CODE_FIELDS}
+            for name in names:
+                table[name] = np.load(os.path.join(cache_dir, f"ipv{family}_{name}.npy"), mmap_mode='r')
+            tables[int(family)] = table
+        return cls(tables, data['dictionaries'], meta)
+
+    def _search(self, family, positions, values, codes):
+        if not len(positions):
+            return
+
+        table = self.tables.get(family)
+        if table is None:
+            for field in CODE_FIELDS:
+                codes[field][positions] = NO_IPV6_TABLE if family == 6 else NOT_FOUND
+            return
+
+        rows = np.searchsorted(table['start'], values, side='right') - 1
+        found = rows >= 0
+        for field in CODE_FIELDS:
+            if table[field] is not None:
+                codes[field][positions[found]] = table[field][rows[found]]
+
+    def merged_ranges(self, family):
+        """
+        Gộp các dải liền nhau có cùng country/region/city thành 1 dải.
+        Trả về (mảng start đã gộp, {country, region, city: mảng id từ điển}), None nếu không có bảng của họ địa chỉ này.
+        Dải thứ i kéo dài tới start[i + 1] - 1 (dải cuối tới địa chỉ lớn nhất).
+        """
+        table = self.tables.get(family)
+        if table is None:
+            return None
+
+        start = np.asarray(table['start'])
+        keep = np.ones(len(start), dtype=bool)
+        if len(start) > 1:
+            keep[1:] = False
+            for field in CODE_FIELDS:
+                if table[field] is not None:
+                    codes = np.asarray(table[field])
+                    keep[1:] |= codes[1:] != codes[:-1]
+
+        return start[keep], {field: None if table[field] is None else np.asarray(table[field])[keep]
+                             for field in CODE_FIELDS}
+
+    def lookup_codes(self, ips):
+        """
+        Tra 1 batch IP, trả về {country, region, city: mảng id từ điển}.
+        Id NOT_FOUND nếu không có dải chứa IP (hoặc DB không có trường đó), INVALID nếu IP sai định dạng,
+        NO_IPV6_TABLE nếu tra IPv6 trên file BIN không có bảng IPv6.
+        """
+        parsed = [parse_ip(ip) for ip in ips]
+        versions = np.fromiter((version for version, _ in parsed), dtype=np.int8, count=len(parsed))
+
+        codes = {field: np.full(len(parsed), NOT_FOUND, dtype=np.int32) for field in CODE_FIELDS}
+        for field in CODE_FIELDS:
+            codes[field][versions == 0] = INVALID
+
+        v4_positions = np.flatnonzero(versions == 4)
+        v4_values = np.fromiter((parsed[i][1] for i in v4_positions), dtype=np.uint32, count=len(v4_positions))
+        self._search(4, v4_positions, v4_values, codes)
+
+        v6_positions = np.flatnonzero(versions == 6)
+        v6_values = np.array([parsed[i][1] for i in v6_positions], dtype='S16')
+        self._search(6, v6_positions, v6_values, codes)
+
+        return codes
+
+    def lookup(self, ips):
+        # Tra 1 batch IP, trả về list bản ghi cùng dạng với normalize_data của ip_processing
+        codes = self.lookup_codes(ips)
+        country_short = self._values['country_short']
+        country_long = self._values['country_long']
+        region = self._values['region']
+        city = self._values['city']
+
+        return [
+            {'ip': str(ip).strip(), 'country_short': country_short[c], 'country_long': country_long[c],
+             'region': region[r], 'city': city[t]}
+            for ip, c, r, t in zip(ips, codes['country'].tolist(), codes['region'].tolist(), codes['city'].tolist())
+        ]
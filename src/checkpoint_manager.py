@@ -1,7 +1,9 @@
 import threading
+import time
 import os
 from dotenv import load_dotenv
 from src.get_data_from_env import get_filename
+from src.processed_id_store import ProcessedIdStore
 
 # Lấy thư mục file hiện tại
 current_dir = os.path.dirname(__file__)
@@ -21,27 +23,113 @@ ERROR_404_FILE_PATH = os.environ.get('ERROR_404_FILE_PATH')
 SUCCESS_FILE = get_filename(SUCCESS_FILE_PATH, 'SUCCESS_FILE_PATH')
 ERROR_404_FILE = get_filename(ERROR_404_FILE_PATH, 'ERROR_404_FILE_PATH')
 
+# Cách lưu danh sách ID đã xử lý khi load:
+# - 'file' (mặc định): đọc toàn bộ 2 file text vào 1 set trong RAM
+# - 'sqlite': chỉ mục SQLite trên đĩa, chỉ import phần mới ghi thêm của 2 file text
+CHECKPOINT_BACKEND = os.environ.get('CHECKPOINT_BACKEND', 'file').lower()
+
+if CHECKPOINT_BACKEND not in ('file', 'sqlite'):
+    raise ValueError(f"LỖI: CHECKPOINT_BACKEND '{CHECKPOINT_BACKEND}' không hợp lệ. Chọn 'file' hoặc 'sqlite'")
+
+PROCESSED_ID_DB_PATH = os.environ.get('PROCESSED_ID_DB_PATH') or os.path.join(os.path.dirname(SUCCESS_FILE), 'processed_ids.sqlite3')
+
+PROCESSED_ID_DB_FILE = get_filename(PROCESSED_ID_DB_PATH, 'PROCESSED_ID_DB_PATH')
+
+_processed_id_store = None
+
+# Group commit: gom nhiều ID rồi mới ghi + fsync 1 lần
+CHECKPOINT_BATCH_SIZE = 500  # Số ID tối đa nằm trong bộ đệm
+CHECKPOINT_FLUSH_MS = 1000  # Thời gian tối đa (ms) một ID nằm trong bộ đệm
+
 # Tạo khóa để tránh việc 2 luồng ghi file cùng lúc gây lỗi (Race condition)
 file_lock = threading.Lock()
 
+def get_checkpoint_file(status):
+    # Trả về file checkpoint tương ứng với trạng thái, None nếu trạng thái không cần lưu
+    if status == 'success':
+        return SUCCESS_FILE
+    elif status == 'err_404':
+        return ERROR_404_FILE
+    return None
+
+def repair_torn_tail(filename):
+    """
+    Cắt bỏ dòng cuối bị ghi dở (không có ký tự xuống dòng) do chương trình dừng đột ngột.
+    ID bị cắt sẽ được crawl lại ở lần chạy sau nên không mất dữ liệu.
+    """
+    if not os.path.exists(filename):
+        return
+
+    with open(filename, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+
+        # Lùi dần từng khối để tìm ký tự xuống dòng cuối cùng
+        pos = size
+        block = 4096
+        while pos > 0:
+            start = max(pos - block, 0)
+            f.seek(start)
+            chunk = f.read(pos - start)
+            idx = chunk.rfind(b'\n')
+            if idx != -1:
+                f.truncate(start + idx + 1)
+                break
+            pos = start
+        else:
+            f.truncate(0)
+
+        f.flush()
+        os.fsync(f.fileno())
+        print(f"--> Đã cắt bỏ dòng ghi dở ở cuối file checkpoint '{filename}'.")
+
+def get_processed_id_store():
+    # Khởi tạo chỉ mục SQLite khi cần lần đầu
+    global _processed_id_store
+
+    if _processed_id_store is None:
+        _processed_id_store = ProcessedIdStore(PROCESSED_ID_DB_FILE)
+    return _processed_id_store
+
 def load_processed_ids():
     """
     Đọc toàn bộ ID đã crawl (thành công + 404) vào một Set.
     Dùng Set để tìm kiếm cực nhanh (O(1)).
+    Với CHECKPOINT_BACKEND='sqlite': trả về ProcessedIdStore (dùng `in`/`len` như set) mà không nạp vào RAM.
     """
+    if CHECKPOINT_BACKEND == 'sqlite':
+        repair_torn_tail(SUCCESS_FILE)
+        repair_torn_tail(ERROR_404_FILE)
+
+        store = get_processed_id_store()
+        imported = store.sync_from_files(SUCCESS_FILE, ERROR_404_FILE)
+        print(f"--> Chỉ mục SQLite: import thêm {imported} dòng mới, tổng {len(store)} ID đã xử lý.")
+        return store
+
     processed_ids = set()
 
     # 1. Đọc file thành công
     if os.path.exists(SUCCESS_FILE):
+        repair_torn_tail(SUCCESS_FILE)
         with open(SUCCESS_FILE, 'r', encoding='utf-8') as f:
             for line in f:
-                processed_ids.add(line.strip())  # strip() để xóa xuống dòng
+                line = line.strip()  # strip() để xóa xuống dòng
+                if line:
+                    processed_ids.add(line)
 
     # 2. Đọc file 404 (Để sau này không cần crawl lại những link chết này)
     if os.path.exists(ERROR_404_FILE):
+        repair_torn_tail(ERROR_404_FILE)
         with open(ERROR_404_FILE, 'r', encoding='utf-8') as f:
             for line in f:
-                processed_ids.add(line.strip())
+                line = line.strip()
+                if line:
+                    processed_ids.add(line)
 
     print(f"--> Đã tải được {len(processed_ids)} ID đã xử lý từ trước (sẽ không thống kê lại những ID đã được xử lý khi chạy từ đầu).")
     return processed_ids
@@ -52,12 +140,7 @@ def save_checkpoint(product_id, status):
     Ghi ID vào file tương ứng ngay lập tức.
     Sử dụng Lock để an toàn khi sử dụng đa luồng.
     """
-    filename = None
-
-    if status == 'success':
-        filename = SUCCESS_FILE
-    elif status == 'err_404':
-        filename = ERROR_404_FILE
+    filename = get_checkpoint_file(status)
 
     # Chỉ ghi nếu là success hoặc 404
     if filename:
@@ -66,4 +149,102 @@ def save_checkpoint(product_id, status):
                 f.write(f"{product_id}\n")
                 # flush và fsync để đảm bảo dữ liệu được ghi xuống ổ cứng ngay lập tức chứ không nằm chờ trong bộ nhớ đệm (buffer)
                 f.flush()
-                os.fsync(f.fileno())
\ No newline at end of file
+                os.fsync(f.fileno())
+
+
+class CheckpointWriter:
+    """
+    Ghi checkpoint theo lô (group commit) thay cho save_checkpoint ghi + fsync từng ID:
+    - Giữ file mở suốt quá trình chạy, ID được gom trong bộ đệm.
+    - auto_commit=True: tự ghi khi đủ batch_size ID hoặc quá flush_interval_ms.
+    - auto_commit=False: chỉ ghi khi gọi commit() (VD: ngay sau insert_many vào MongoDB),
+      để checkpoint không bao giờ đi trước dữ liệu đã lưu.
+    - Mỗi lần commit chỉ fsync 1 lần cho mỗi file.
+    """
+
+    def __init__(self, batch_size=CHECKPOINT_BATCH_SIZE, flush_interval_ms=CHECKPOINT_FLUSH_MS,
+                 auto_commit=True, fsync=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.auto_commit = auto_commit
+        self.fsync = fsync
+
+        self._files = {}
+        self._buffer = {}
+        self._pending = 0
+        self._last_commit = time.time()
+        self._lock = threading.Lock()
+
+        self.stats = {'ids': 0, 'commits': 0}
+
+    def _get_file(self, filename):
+        # Mở file lần đầu cần ghi, sửa dòng ghi dở (nếu có) trước khi ghi tiếp
+        if filename not in self._files:
+            repair_torn_tail(filename)
+            self._files[filename] = open(filename, 'a', encoding='utf-8')
+        return self._files[filename]
+
+    def add(self, product_id, status):
+        # Đưa ID vào bộ đệm, chỉ lưu các trạng thái success hoặc 404
+        filename = get_checkpoint_file(status)
+        if not filename:
+            return
+
+        with self._lock:
+            self._buffer.setdefault(filename, []).append(f"{product_id}\n")
+            self._pending += 1
+
+            if self.auto_commit and (self._pending >= self.batch_size or
+                                     time.time() - self._last_commit >= self.flush_interval):
+                self._commit_locked()
+
+    def commit(self):
+        # Ghi toàn bộ ID trong bộ đệm xuống đĩa
+        with self._lock:
+            self._commit_locked()
+
+    def _commit_locked(self):
+        if self._pending:
+            for filename, lines in self._buffer.items():
+                if not lines:
+                    continue
+
+                f = self._get_file(filename)
+                # Ghi cả lô trong 1 lần write, mỗi dòng đều có ký tự xuống dòng nên chỉ dòng cuối có thể bị ghi dở
+                f.write(''.join(lines))
+                f.flush()
+                # flush và fsync để đảm bảo dữ liệu được ghi xuống ổ cứng chứ không nằm chờ trong bộ nhớ đệm (buffer)
+                if self.fsync:
+                    os.fsync(f.fileno())
+
+            self.stats['ids'] += self._pending
+            self.stats['commits'] += 1
+            self._buffer = {}
+            self._pending = 0
+
+        self._last_commit = time.time()
+
+    def close(self):
+        # Ghi nốt phần còn trong bộ đệm và đóng file
+        with self._lock:
+            self._commit_locked()
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+
+
+def migrate_to_sqlite(compact=True):
+    """
+    Chuyển checkpoint dạng file text (SUCCESS_FILE/ERROR_404_FILE) sang chỉ mục SQLite.
+    Chỉ chạy khi crawler đang dừng vì bước compact sẽ viết lại 2 file text.
+    """
+    repair_torn_tail(SUCCESS_FILE)
+    repair_torn_tail(ERROR_404_FILE)
+
+    store = get_processed_id_store()
+    store.migrate_from_files(SUCCESS_FILE, ERROR_404_FILE, compact=compact)
+    return store
+
+
+if __name__ == "__main__":
+    migrate_to_sqlite()
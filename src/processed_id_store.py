@@ -0,0 +1,197 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+IMPORT_CHUNK = 10000  # Số ID ghi vào SQLite mỗi lần khi import từ file text
+
+
+def compact_checkpoint_file(filename):
+    """
+    Viết lại file checkpoint dạng append-only: bỏ dòng trống, bỏ ID trùng (giữ lần xuất hiện đầu tiên).
+    Ghi ra file tạm rồi đổi tên để không làm hỏng file gốc nếu bị dừng giữa chừng.
+    Trả về (số dòng trước, số dòng sau).
+    """
+    if not os.path.exists(filename):
+        return 0, 0
+
+    seen = set()
+    before = 0
+    tmp_file = filename + '.compact'
+
+    with open(filename, 'r', encoding='utf-8') as src, open(tmp_file, 'w', encoding='utf-8') as dst:
+        for line in src:
+            # Dòng cuối không có ký tự xuống dòng là dòng ghi dở -> bỏ
+            if not line.endswith('\n'):
+                continue
+            before += 1
+            product_id = line.strip()
+            if product_id and product_id not in seen:
+                seen.add(product_id)
+                dst.write(f"{product_id}\n")
+        dst.flush()
+        os.fsync(dst.fileno())
+
+    os.replace(tmp_file, filename)
+    return before, len(seen)
+
+
+class ProcessedIdStore:
+    """
+    Chỉ mục ID đã xử lý lưu trên SQLite (B-tree, tra cứu O(log n)) thay cho set nạp toàn bộ vào RAM.
+    - Dùng được như set: `product_id in store`, `len(store)`, `for product_id in store`.
+    - sync_from_files(): import phần mới ghi thêm của SUCCESS_FILE/ERROR_404_FILE (nhớ vị trí byte đã đọc),
+      nên lần chạy sau chỉ đọc phần tăng thêm thay vì đọc lại toàn bộ file.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_ids ("
+            " product_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        # Lưu vị trí byte đã import của từng file checkpoint, kèm định danh file (inode + hash dòng đầu)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS import_offsets ("
+            " filename TEXT PRIMARY KEY,"
+            " offset INTEGER NOT NULL,"
+            " file_id TEXT"
+            ")"
+        )
+        # DB tạo từ bản cũ chưa có cột file_id
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(import_offsets)")}
+        if 'file_id' not in columns:
+            self._conn.execute("ALTER TABLE import_offsets ADD COLUMN file_id TEXT")
+        self._conn.commit()
+
+    def __contains__(self, product_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM processed_ids WHERE product_id = ?", (str(product_id),)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM processed_ids").fetchone()[0]
+
+    def __iter__(self):
+        # Đọc toàn bộ ID ra theo từng khối (theo thứ tự product_id) để không giữ lock quá lâu
+        last_id = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT product_id FROM processed_ids WHERE product_id > ? ORDER BY product_id LIMIT ?",
+                    (last_id, IMPORT_CHUNK)
+                ).fetchall()
+            if not rows:
+                break
+            for (product_id,) in rows:
+                yield product_id
+            last_id = rows[-1][0]
+
+    def add_many(self, items):
+        # items: list (product_id, status). ID đã có thì bỏ qua
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO processed_ids (product_id, status) VALUES (?, ?)",
+                ((str(product_id), status) for product_id, status in items)
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _file_id(filename):
+        # Định danh file: inode + hash dòng đầu tiên. File bị xóa rồi ghi lại (kể cả dài hơn trước) sẽ đổi định danh
+        with open(filename, 'rb') as f:
+            first_line = f.readline()
+            return f"{os.fstat(f.fileno()).st_ino}:{hashlib.sha1(first_line).hexdigest()}"
+
+    def _get_offset(self, filename):
+        # Trả về (offset, file_id) đã lưu
+        row = self._conn.execute("SELECT offset, file_id FROM import_offsets WHERE filename = ?",
+                                 (filename,)).fetchone()
+        return (row[0], row[1]) if row else (0, None)
+
+    def _set_offset(self, filename, offset, file_id=None):
+        self._conn.execute(
+            "INSERT INTO import_offsets (filename, offset, file_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(filename) DO UPDATE SET offset = excluded.offset, file_id = excluded.file_id",
+            (filename, offset, file_id)
+        )
+
+    def import_file(self, filename, status):
+        # Import các dòng mới (từ vị trí đã lưu) của 1 file checkpoint, trả về số dòng đã đọc
+        if not os.path.exists(filename):
+            return 0
+
+        with self._lock:
+            offset, saved_file_id = self._get_offset(filename)
+            file_id = self._file_id(filename)
+            # Khác định danh đã lưu hoặc file nhỏ hơn vị trí đã lưu -> file đã bị xóa/viết lại, đọc lại từ đầu
+            # (ID đã import thì INSERT OR IGNORE bỏ qua)
+            if file_id != saved_file_id or os.path.getsize(filename) < offset:
+                offset = 0
+
+            count = 0
+            with open(filename, 'rb') as f:
+                f.seek(offset)
+                chunk = []
+                for raw_line in f:
+                    # Dòng ghi dở (chưa có xuống dòng) để lần sau đọc lại
+                    if not raw_line.endswith(b'\n'):
+                        break
+                    offset += len(raw_line)
+                    product_id = raw_line.decode('utf-8').strip()
+                    if product_id:
+                        chunk.append((product_id, status))
+                        count += 1
+
+                    if len(chunk) >= IMPORT_CHUNK:
+                        self._conn.executemany(
+                            "INSERT OR IGNORE INTO processed_ids (product_id, status) VALUES (?, ?)", chunk)
+                        chunk = []
+
+                if chunk:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO processed_ids (product_id, status) VALUES (?, ?)", chunk)
+
+            # Dòng đầu có thể vừa ghi xong trong lượt này -> tính lại định danh sau khi đọc
+            self._set_offset(filename, offset, self._file_id(filename))
+            self._conn.commit()
+
+        return count
+
+    def sync_from_files(self, success_file, error_404_file):
+        # Đồng bộ phần tăng thêm của 2 file checkpoint vào SQLite
+        imported = self.import_file(success_file, 'success')
+        imported += self.import_file(error_404_file, 'err_404')
+        return imported
+
+    def migrate_from_files(self, success_file, error_404_file, compact=True):
+        """
+        Chuyển đổi từ định dạng file text hiện tại sang SQLite.
+        compact=True: dọn trùng 2 file text trước, sau đó import lại từ đầu.
+        """
+        if compact:
+            for filename in (success_file, error_404_file):
+                before, after = compact_checkpoint_file(filename)
+                if before:
+                    print(f"--> Compact '{filename}': {before} dòng -> {after} dòng.")
+                with self._lock:
+                    self._set_offset(filename, 0)
+                    self._conn.commit()
+
+        imported = self.sync_from_files(success_file, error_404_file)
+        print(f"--> Đã import {imported} dòng checkpoint, tổng {len(self)} ID trong '{self.db_file}'.")
+        return imported
+
+    def close(self):
+        with self._lock:
+            self._conn.close()